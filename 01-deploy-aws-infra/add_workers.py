@@ -0,0 +1,173 @@
+import os
+import sys
+import argparse
+
+from dotenv import load_dotenv
+from utils.AWSSession import AWSSession, ClientError
+from main import _UBUNTU_AMI_ID, _WORKER_TYPE, load_data_from_file, save_data_to_file
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "03-spark"))
+from common.KubernetesSteps import INSTALL_KUBERNETES_STEPS, IMAGE_TAG_KEY, steps_hash, node_install_steps
+from common.Inventory import master_instance, worker_instances
+from common.Readiness import wait_for, all_ssh_reachable, nodes_ready, ready_nodes
+from common.Remote import banner, probe_cmd, read_cmd, run_cmd, run_steps, run_on_hosts, print_summary
+from common.SSHPool import pool
+from common.Trace import tracer
+from SparkSubmit import cluster_nodes
+from SparkValues import deploy_spark, deployed_workers_per_node
+from Storage import NFS_CLIENT_STEPS
+
+_SPARK_CLUSTER_NAME = "spark-cluster"
+
+load_dotenv()
+
+def launch_workers(session, data: dict, nb_instance: int, instance_type: str, spot: bool = False) -> list:
+    """
+    Créé `nb_instance` workers dans le sous-réseau et le security group de
+    l'inventaire, puis les ajoute à l'inventaire (sauvegardé aussitôt, même si
+    leur installation échoue ensuite).
+
+    Returns:
+        list: Entrées de l'inventaire des nouvelles instances
+    """
+    # Image pré-installée (bake_image.py) correspondant aux étapes d'installation actuelles
+    image_hash = steps_hash(INSTALL_KUBERNETES_STEPS)
+    image = session.find_image(IMAGE_TAG_KEY, image_hash)
+    key_pair_path = data["KeyPairPath"]
+    instances = session.create_ec2_instances(
+        nb_instance = nb_instance,
+        name = "ProjetCloud-InstanceEC2",
+        image_id = image.id if image is not None else _UBUNTU_AMI_ID,
+        instance_type = instance_type,
+        security_group_id = data["SecurityGroupId"],
+        subnet_id = data["SubnetId"],
+        key_pair_name = os.path.splitext(os.path.basename(key_pair_path))[0],
+        wait = False,
+        role = "worker",
+        spot = spot
+    )
+    public_ips = session.wait_until_ec2_instances_ready([i.id for i in instances])
+    new_instances = [{
+        "InstanceId": i.id,
+        "InstanceIp": public_ips[i.id],
+        "Role": "worker",
+        "InstanceType": instance_type,
+        "Spot": spot,
+        "StepsHash": image_hash if image is not None else None
+    } for i in instances]
+    data["Instances"] += new_instances
+    save_data_to_file(data)
+    return new_instances
+
+def join_workers(data: dict, new_instances: list, verbose=False, batch=False, parallel=1, cache=None, timeout=600, port=22, user="ubuntu") -> dict:
+    """
+    Installe Kubernetes sur les nouveaux workers uniquement et les joint au
+    cluster avec un nouveau jeton (celui de kubeadm init expire après 24h).
+
+    Returns:
+        dict: {"install_failures": {ip: exception}, "join_failures": {ip: exception}}
+    """
+    ssh_key = data["KeyPairPath"]
+    master_ip = master_instance(data)["InstanceIp"]
+    cache_ip = master_ip if cache == "master" else cache
+    if cache_ip:
+        # Le cache n'accepte que le VPC : les nœuds l'utilisent par son IP privée
+        cache_ip = read_cmd(pool.get(cache_ip, port, user, ssh_key), cache_ip, "hostname -I | awk '{print $1}'").strip()
+    instances = {i["InstanceIp"]: i for i in new_instances}
+    ips = list(instances)
+
+    def install_node(ip):
+        banner(ip, "Kubernetes installation")
+        run_steps(pool.get(ip, port, user, ssh_key), ip, node_install_steps(instances[ip], cache_ip), verbose, batch)
+
+    def join_node(ip, join_command):
+        banner(ip, "Setup workers")
+        run_cmd(pool.get(ip, port, user, ssh_key), ip, "sudo " + join_command + " --ignore-preflight-errors=all --v=5", verbose)
+
+    # Le démon SSH démarre quelques secondes après l'instance
+    wait_for("SSH sur les nouveaux workers", all_ssh_reachable(ips, port), timeout = 300)
+
+    _, install_failures = run_on_hosts(install_node, ips, parallel)
+    print_summary("Kubernetes installation", ips, install_failures)
+
+    master = pool.get(master_ip, port, user, ssh_key)
+    nodes_count = len(ready_nodes(master))
+    join_command = read_cmd(master, master_ip, "sudo kubeadm token create --print-join-command").strip()
+    ips = [ip for ip in ips if ip not in install_failures]
+    _, join_failures = run_on_hosts(join_node, ips, parallel, join_command)
+    print_summary("Setup workers", ips, join_failures)
+
+    nodes_count += len(ips) - len(join_failures)
+    wait_for(f"{nodes_count} node(s) Ready", nodes_ready(master, nodes_count), timeout = timeout, host = master_ip)
+    return {
+        "install_failures": install_failures,
+        "join_failures": join_failures
+    }
+
+def scale_spark_workers(data: dict, workers_per_node: int = None, verbose=False, port=22, user="ubuntu") -> None:
+    """
+    Adapte les workers Spark (nombre, cœurs, mémoire) aux nœuds Kubernetes, si
+    le cluster Spark est déjà installé (03-spark). Sans `workers_per_node`,
+    celui du cluster déployé est conservé.
+    """
+    master_ip = master_instance(data)["InstanceIp"]
+    client = pool.get(master_ip, port, user, data["KeyPairPath"])
+    exit_status, _ = probe_cmd(client, f"helm status {_SPARK_CLUSTER_NAME}")
+    if exit_status != 0:
+        print(f"Cluster Spark {_SPARK_CLUSTER_NAME} absent, rien à adapter.")
+        return
+    # Client NFS du volume partagé (03-spark/Storage.py), déjà présent sur les anciens workers
+    ips = [i["InstanceIp"] for i in worker_instances(data)]
+    def setup_nfs_client(ip):
+        run_steps(pool.get(ip, port, user, data["KeyPairPath"]), ip, NFS_CLIENT_STEPS, verbose)
+    _, failures = run_on_hosts(setup_nfs_client, ips, len(ips))
+    print_summary("NFS client", ips, failures)
+    nodes = cluster_nodes(client, data)
+    if workers_per_node is None:
+        workers_per_node = deployed_workers_per_node(client, nodes, _SPARK_CLUSTER_NAME)
+    deploy_spark(client, master_ip, nodes, _SPARK_CLUSTER_NAME, workers_per_node, verbose)
+
+if __name__ == '__main__':
+    # Setup env variables
+    if not os.getenv('AWS_ACCESS_KEY_ID'):
+        print("AWS_ACCESS_KEY_ID undefined in .env")
+        exit()
+    if not os.getenv('AWS_SECRET_ACCESS_KEY'):
+        print("AWS_SECRET_ACCESS_KEY undefined in .env")
+        exit()
+
+    # Arg parser
+    parser = argparse.ArgumentParser(description="Ajoute des workers au cluster existant (inventory.json)")
+    parser.add_argument("-n", "--nb_instance", type=int, required=True, help="Nombre de workers a ajouter")
+    parser.add_argument("--worker_type", help="Type d'instance des nouveaux workers (par defaut celui des workers existants)")
+    parser.add_argument("--spot", action="store_true", help="Workers en instances spot")
+    parser.add_argument("-v", "--verbose", help="Affiche la sortie des commandes", action="count")
+    parser.add_argument("-b", "--batch", help="Installation de chaque worker en un seul script", action="store_true")
+    parser.add_argument("-c", "--cache", help="Cache apt et miroir d'images deja en place : 'master' ou IP de l'instance")
+    parser.add_argument("-p", "--parallel", type=int, default=4, help="Nombre de workers installes/joints en meme temps")
+    parser.add_argument("--spark_workers_per_node", type=int, help="Workers Spark par worker Kubernetes (par defaut ceux du cluster Spark deploye)")
+    args = parser.parse_args()
+
+    data = load_data_from_file()
+    if not data:
+        print("inventory.json introuvable : lancer main.py avant add_workers.py")
+        exit()
+    workers = worker_instances(data)
+    instance_type = args.worker_type or (workers[-1].get("InstanceType") if workers else None) or _WORKER_TYPE
+
+    # Création session AWS
+    tracer.stage = "add-workers"
+    session = AWSSession(os.environ['AWS_ACCESS_KEY_ID'], os.environ['AWS_SECRET_ACCESS_KEY'], tracer = tracer)
+    try:
+        with tracer.span(tracer.stage, category = "stage"):
+            new_instances = launch_workers(session, data, args.nb_instance, instance_type, args.spot)
+            join_workers(data, new_instances, args.verbose, args.batch, args.parallel, args.cache)
+            scale_spark_workers(data, args.spark_workers_per_node, args.verbose)
+    except ClientError as err:
+        print(f"ClientError :\t{err}")
+    except Exception as err:
+        print(f"Exception :\t{err}")
+    finally:
+        pool.close_all()
+        tracer.finish()
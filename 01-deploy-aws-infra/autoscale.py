@@ -0,0 +1,290 @@
+import os
+import sys
+import json
+import time
+import argparse
+from collections import namedtuple
+
+from dotenv import load_dotenv
+from utils.AWSSession import AWSSession, ClientError
+from main import _WORKER_TYPE, load_data_from_file, save_data_to_file
+from add_workers import _SPARK_CLUSTER_NAME, launch_workers, join_workers, scale_spark_workers
+from SparkSubmit import cluster_nodes
+from SparkValues import deploy_spark, deployed_workers_per_node
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.Inventory import master_instance, worker_instances
+from common.Readiness import wait_for
+from common.Remote import banner, log, probe_cmd, read_cmd, run_cmd
+from common.SSHPool import pool
+from common.Trace import tracer
+
+load_dotenv()
+
+# Seuils de l'autoscaler (voir decide())
+Policy = namedtuple("Policy", [
+    "min_workers", "max_workers", "step",
+    "up_utilization", "down_utilization", "idle_time",
+    "up_cooldown", "down_cooldown",
+], defaults = [1, 10, 1, 0.9, 0.2, 300, 300, 600])
+
+def cluster_load(client) -> dict:
+    """
+    Charge du cluster Spark, lue sur le master : pods Spark en attente
+    (Pending) et état du master standalone (JSON de son interface web, via le
+    proxy de l'API server).
+
+    Returns:
+        dict: {"pending_pods", "waiting_apps", "running_apps", "cores", "cores_used"}
+    """
+    _, output = probe_cmd(client, f"kubectl get pods -l app.kubernetes.io/instance={_SPARK_CLUSTER_NAME} --field-selector=status.phase=Pending -o name")
+    # cores à None : master Spark injoignable
+    load = {"pending_pods": len(output.split()), "waiting_apps": 0, "running_apps": 0, "cores": None, "cores_used": 0}
+    exit_status, output = probe_cmd(client, f"kubectl get --raw /api/v1/namespaces/default/services/{_SPARK_CLUSTER_NAME}-master-svc:http/proxy/json/")
+    if exit_status == 0:
+        master = json.loads(output)
+        states = [app.get("state") for app in master.get("activeapps", [])]
+        load["waiting_apps"] = states.count("WAITING")
+        load["running_apps"] = states.count("RUNNING")
+        load["cores"] = master.get("cores", 0)
+        load["cores_used"] = master.get("coresused", 0)
+    return load
+
+def decide(load: dict, workers: int, policy: Policy, state: dict, now: float) -> tuple:
+    """
+    Décision de l'autoscaler, sans action sur le cluster.
+
+    - Ajout des workers manquants sous `min_workers`, hors `up_cooldown`.
+    - Ajout de `step` workers si des pods Spark ou des applications attendent,
+      ou si l'utilisation des cœurs dépasse `up_utilization`, hors
+      `up_cooldown` après la dernière action.
+    - Retrait d'un worker si l'utilisation reste sous `down_utilization`,
+      sans attente, depuis `idle_time`, hors `down_cooldown`.
+
+    `state` ({"last_action", "idle_since"}) est mis à jour.
+
+    Returns:
+        tuple: (nombre de workers à ajouter, négatif pour en retirer, raison)
+    """
+    since_last = now - state.get("last_action", float("-inf"))
+    # Sous le minimum, quelle que soit la charge (le master Spark tourne lui-même sur un worker)
+    if workers < policy.min_workers:
+        if since_last < policy.up_cooldown:
+            return 0, f"ajout en attente (cooldown {policy.up_cooldown - since_last:.0f}s)"
+        return policy.min_workers - workers, f"{workers} workers (min {policy.min_workers})"
+    if load["cores"] is None:
+        return 0, "master Spark injoignable"
+    utilization = load["cores_used"] / load["cores"] if load["cores"] else 0.0
+    backlog = load["pending_pods"] + load["waiting_apps"]
+
+    idle = backlog == 0 and utilization <= policy.down_utilization
+    if not idle:
+        state["idle_since"] = None
+    elif state.get("idle_since") is None:
+        state["idle_since"] = now
+
+    if backlog > 0 or utilization >= policy.up_utilization:
+        if workers >= policy.max_workers:
+            return 0, f"saturé mais déjà {workers} workers (max {policy.max_workers})"
+        if since_last < policy.up_cooldown:
+            return 0, f"ajout en attente (cooldown {policy.up_cooldown - since_last:.0f}s)"
+        return min(policy.step, policy.max_workers - workers), f"{backlog} en attente, utilisation {utilization:.0%}"
+
+    if idle and workers > policy.min_workers:
+        if now - state["idle_since"] < policy.idle_time:
+            return 0, f"inactif depuis {now - state['idle_since']:.0f}s"
+        if since_last < policy.down_cooldown:
+            return 0, f"retrait en attente (cooldown {policy.down_cooldown - since_last:.0f}s)"
+        return -1, f"inactif depuis {now - state['idle_since']:.0f}s, utilisation {utilization:.0%}"
+
+    return 0, f"utilisation {utilization:.0%}"
+
+def spark_pod_nodes(client, ip) -> dict:
+    """
+    Nœud Kubernetes de chaque pod du cluster Spark, en une requête
+
+    Returns:
+        dict: {nom du pod: nom du nœud}
+    """
+    output = read_cmd(client, ip, f"kubectl get pods -l app.kubernetes.io/instance={_SPARK_CLUSTER_NAME} -o jsonpath='{{range .items[*]}}{{.metadata.name}} {{.spec.nodeName}}{{\"\\n\"}}{{end}}'")
+    return {name: node for name, _, node in (line.partition(" ") for line in output.splitlines()) if node}
+
+def node_names(client, ip) -> dict:
+    """
+    Nom de chaque nœud Kubernetes selon son IP privée (InternalIP), en une requête
+
+    Returns:
+        dict: {IP privée: nom du nœud}
+    """
+    output = read_cmd(client, ip, "kubectl get nodes -o jsonpath='{range .items[*]}{.status.addresses[?(@.type==\"InternalIP\")].address} {.metadata.name}{\"\\n\"}{end}'")
+    return dict(line.split() for line in output.splitlines() if line.strip())
+
+def choose_victim(session, client, ip, data: dict) -> tuple:
+    """
+    Worker à retirer : celui dont le nœud héberge les derniers workers Spark
+    (ceux que la réduction des réplicas supprime), sinon le plus récent de
+    l'inventaire, hors nœuds du master Spark et du pod spark-cluster-worker-0
+    (le driver des jobs y tourne). Les instances sont associées aux nœuds par
+    leur IP privée.
+
+    Returns:
+        tuple: (entrée de l'inventaire, nom du nœud Kubernetes), ou (None, None)
+    """
+    pods = spark_pod_nodes(client, ip)
+    protected = {pods.get(f"{_SPARK_CLUSTER_NAME}-master-0"), pods.get(f"{_SPARK_CLUSTER_NAME}-worker-0")}
+    nodes = node_names(client, ip)
+    workers = worker_instances(data)
+    private_ips = session.get_ec2_instances_private_ips([i["InstanceId"] for i in workers]) if workers else {}
+    # Plus grand numéro de worker Spark de chaque nœud
+    last_worker = {}
+    for pod, pod_node in pods.items():
+        if pod.startswith(f"{_SPARK_CLUSTER_NAME}-worker-"):
+            last_worker[pod_node] = max(last_worker.get(pod_node, -1), int(pod.rsplit("-", 1)[1]))
+    victim = (None, None)
+    best = None
+    for index, instance in enumerate(workers):
+        node = nodes.get(private_ips.get(instance["InstanceId"]))
+        if node is None or node in protected:
+            continue
+        if best is None or (last_worker.get(node, -1), index) > best:
+            best = (last_worker.get(node, -1), index)
+            victim = (instance, node)
+    return victim
+
+def spark_workers_at_most(client, replicas: int):
+    """Condition de wait_for : au plus `replicas` pods de workers Spark"""
+    def condition():
+        exit_status, output = probe_cmd(client, f"kubectl get pods -l app.kubernetes.io/instance={_SPARK_CLUSTER_NAME},app.kubernetes.io/component=worker -o name")
+        return exit_status == 0 and len(output.split()) <= replicas
+    return condition
+
+def remove_worker(session, data: dict, instance: dict, node: str, workers_per_node: int = None, verbose=False, port=22, user="ubuntu") -> None:
+    """
+    Réduit d'abord les workers Spark aux nœuds restants (sans
+    `workers_per_node`, celui du cluster déployé est conservé), puis vide le
+    nœud, le retire de Kubernetes, supprime l'instance EC2 et la retire de
+    l'inventaire
+    """
+    master_ip = master_instance(data)["InstanceIp"]
+    master = pool.get(master_ip, port, user, data["KeyPairPath"])
+    banner(instance["InstanceIp"], "Retrait du worker")
+    exit_status, _ = probe_cmd(master, f"helm status {_SPARK_CLUSTER_NAME}")
+    if exit_status == 0:
+        # Les réplicas en trop sont supprimés avant le drain : aucun pod Spark évincé ne reste en attente
+        nodes = cluster_nodes(master, data)
+        if workers_per_node is None:
+            workers_per_node = deployed_workers_per_node(master, nodes, _SPARK_CLUSTER_NAME)
+        remaining = [n for n in nodes if n["name"] != node]
+        values = deploy_spark(master, master_ip, remaining, _SPARK_CLUSTER_NAME, workers_per_node, verbose)
+        replicas = values["worker"]["replicaCount"]
+        wait_for(f"{replicas} worker(s) Spark", spark_workers_at_most(master, replicas), timeout = 300, host = master_ip)
+    run_cmd(master, master_ip, f"kubectl drain {node} --ignore-daemonsets --delete-emptydir-data --force --timeout=300s", verbose)
+    run_cmd(master, master_ip, f"kubectl delete node {node}", verbose)
+    pool.discard(instance["InstanceIp"], port, user, data["KeyPairPath"])
+    session.terminate_ec2_instances([instance["InstanceId"]], wait = False)
+    data["Instances"] = [i for i in data["Instances"] if i["InstanceId"] != instance["InstanceId"]]
+    save_data_to_file(data)
+
+def autoscale(session, data: dict, policy: Policy, interval: int = 30, instance_type: str = _WORKER_TYPE, spot: bool = False,
+              workers_per_node: int = None, verbose=False, batch=False, parallel=4, cache=None, once=False, port=22, user="ubuntu") -> None:
+    """
+    Boucle de l'autoscaler : toutes les `interval` secondes, lit la charge du
+    cluster Spark et ajoute ou retire des workers selon `policy`.
+    L'inventaire est sauvegardé après chaque action. Sans `workers_per_node`,
+    celui du cluster Spark déployé est conservé.
+    """
+    master_ip = master_instance(data)["InstanceIp"]
+    state = {}
+    while True:
+        try:
+            master = pool.get(master_ip, port, user, data["KeyPairPath"])
+            load = cluster_load(master)
+        except Exception as err:
+            # Master injoignable (SSH) : nouvelle mesure au prochain tour
+            log("autoscale", f"Mesure de la charge impossible : {err}")
+            load = None
+        delta = 0
+        if load is not None:
+            workers = len(worker_instances(data))
+            delta, reason = decide(load, workers, policy, state, time.monotonic())
+            log("autoscale", f"{workers} worker(s), {load['cores_used']}/{load['cores'] or 0} cœurs, {load['pending_pods']} pod(s) et {load['waiting_apps']} application(s) en attente : {reason}")
+
+        # Une action en échec (ClientError, TimeoutError, SSH) n'arrête pas l'autoscaler,
+        # le cooldown s'applique comme après une action réussie
+        try:
+            if delta > 0:
+                with tracer.span(f"scale up +{delta}", category = "task", reason = reason):
+                    new_instances = launch_workers(session, data, delta, instance_type, spot)
+                    join_workers(data, new_instances, verbose, batch, parallel, cache, port = port, user = user)
+                    scale_spark_workers(data, workers_per_node, verbose, port, user)
+            elif delta < 0:
+                state["idle_since"] = None
+                instance, node = choose_victim(session, master, master_ip, data)
+                if instance is not None:
+                    with tracer.span("scale down -1", category = "task", host = instance["InstanceIp"], reason = reason):
+                        remove_worker(session, data, instance, node, workers_per_node, verbose, port, user)
+        except Exception as err:
+            log("autoscale", f"Echec de l'action ({'ajout' if delta > 0 else 'retrait'}) : {err}")
+        finally:
+            if delta != 0:
+                state["last_action"] = time.monotonic()
+
+        if once:
+            return
+        time.sleep(interval)
+
+if __name__ == '__main__':
+    # Setup env variables
+    if not os.getenv('AWS_ACCESS_KEY_ID'):
+        print("AWS_ACCESS_KEY_ID undefined in .env")
+        exit()
+    if not os.getenv('AWS_SECRET_ACCESS_KEY'):
+        print("AWS_SECRET_ACCESS_KEY undefined in .env")
+        exit()
+
+    # Arg parser
+    parser = argparse.ArgumentParser(description="Ajoute ou retire des workers selon la charge du cluster Spark")
+    parser.add_argument("--min_workers", type=int, default=1, help="Nombre minimum de workers")
+    parser.add_argument("--max_workers", type=int, default=10, help="Nombre maximum de workers")
+    parser.add_argument("--step", type=int, default=1, help="Workers ajoutes a la fois")
+    parser.add_argument("--up_utilization", type=float, default=0.9, help="Utilisation des coeurs (0-1) au-dessus de laquelle ajouter des workers")
+    parser.add_argument("--down_utilization", type=float, default=0.2, help="Utilisation des coeurs (0-1) en dessous de laquelle le cluster est inactif")
+    parser.add_argument("--idle_time", type=int, default=300, help="Inactivite (s) avant de retirer un worker")
+    parser.add_argument("--up_cooldown", type=int, default=300, help="Delai (s) minimum entre une action et un ajout")
+    parser.add_argument("--down_cooldown", type=int, default=600, help="Delai (s) minimum entre une action et un retrait")
+    parser.add_argument("-i", "--interval", type=int, default=30, help="Delai (s) entre deux mesures de la charge")
+    parser.add_argument("--once", action="store_true", help="Une seule mesure (et action)")
+    parser.add_argument("--worker_type", help="Type d'instance des nouveaux workers (par defaut celui des workers existants)")
+    parser.add_argument("--spot", action="store_true", help="Nouveaux workers en instances spot")
+    parser.add_argument("-v", "--verbose", help="Affiche la sortie des commandes", action="count")
+    parser.add_argument("-b", "--batch", help="Installation de chaque worker en un seul script", action="store_true")
+    parser.add_argument("-c", "--cache", help="Cache apt et miroir d'images deja en place : 'master' ou IP de l'instance")
+    parser.add_argument("-p", "--parallel", type=int, default=4, help="Nombre de workers installes/joints en meme temps")
+    parser.add_argument("--spark_workers_per_node", type=int, help="Workers Spark par worker Kubernetes (par defaut ceux du cluster Spark deploye)")
+    args = parser.parse_args()
+
+    data = load_data_from_file()
+    if not data:
+        print("inventory.json introuvable : lancer main.py avant autoscale.py")
+        exit()
+    workers = worker_instances(data)
+    instance_type = args.worker_type or (workers[-1].get("InstanceType") if workers else None) or _WORKER_TYPE
+    policy = Policy(args.min_workers, args.max_workers, args.step, args.up_utilization, args.down_utilization,
+                    args.idle_time, args.up_cooldown, args.down_cooldown)
+
+    # Création session AWS
+    tracer.stage = "autoscale"
+    session = AWSSession(os.environ['AWS_ACCESS_KEY_ID'], os.environ['AWS_SECRET_ACCESS_KEY'], tracer = tracer)
+    try:
+        with tracer.span(tracer.stage, category = "stage"):
+            autoscale(session, data, policy, args.interval, instance_type, args.spot, args.spark_workers_per_node,
+                      args.verbose, args.batch, args.parallel, args.cache, args.once)
+    except KeyboardInterrupt:
+        print("Autoscaler arrêté")
+    except ClientError as err:
+        print(f"ClientError :\t{err}")
+    except Exception as err:
+        print(f"Exception :\t{err}")
+    finally:
+        pool.close_all()
+        tracer.finish()
@@ -0,0 +1,106 @@
+import os
+import sys
+import argparse
+
+from dotenv import load_dotenv
+from utils.AWSSession import AWSSession, ClientError
+from main import _UBUNTU_AMI_ID, load_data_from_file
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.KubernetesSteps import INSTALL_KUBERNETES_STEPS, IMAGE_TAG_KEY, steps_hash
+from common.Readiness import wait_for, all_ssh_reachable
+from common.Remote import run_steps
+from common.SSHPool import pool
+from common.Trace import tracer
+
+load_dotenv()
+
+# L'image ne dépend pas du type d'instance : construction sur la plus petite
+_BUILDER_TYPE = "t2.micro"
+
+def bake_image(session, data: dict, verbose=False) -> str:
+    """
+    Créé une AMI avec Docker et Kubernetes pré-installés : les étapes
+    INSTALL_KUBERNETES_STEPS sont exécutées une seule fois sur une instance
+    temporaire, dans le sous-réseau de l'inventaire (inventory.json).
+    L'AMI est taguée avec le hash des étapes, main.py l'utilise ensuite
+    automatiquement tant que les étapes ne changent pas.
+
+    Args:
+        session (AWSSession)
+        data (dict): Inventaire de l'infrastructure (main.py)
+
+    Returns:
+        str: ID de l'AMI
+    """
+    image_hash = steps_hash(INSTALL_KUBERNETES_STEPS)
+    image = session.find_image(IMAGE_TAG_KEY, image_hash)
+    if image is not None:
+        print(f"Image {image.id} déjà à jour ({image_hash}).")
+        return image.id
+
+    # Instance temporaire de construction
+    key_pair_path = data["KeyPairPath"]
+    builder = session.create_ec2_instances(
+        nb_instance = 1,
+        name = "ProjetCloud-ImageBuilder",
+        image_id = _UBUNTU_AMI_ID,
+        instance_type = _BUILDER_TYPE,
+        security_group_id = data["SecurityGroupId"],
+        subnet_id = data["SubnetId"],
+        key_pair_name = os.path.splitext(os.path.basename(key_pair_path))[0],
+        wait = False
+    )[0]
+    try:
+        ip = session.wait_until_ec2_instances_ready([builder.id])[builder.id]
+
+        # Le démon SSH démarre quelques secondes après l'instance
+        wait_for(f"SSH sur {ip}", all_ssh_reachable([ip]), timeout = 300)
+        client = pool.get(ip, 22, "ubuntu", key_pair_path)
+
+        # Installation Docker + Kubernetes, en un seul aller-retour
+        run_steps(client, ip, INSTALL_KUBERNETES_STEPS, verbose, batch=True)
+        pool.discard(ip, 22, "ubuntu", key_pair_path)
+
+        # Création de l'AMI
+        image = session.create_image(builder.id, f"ProjetCloud-Kubernetes-{image_hash}", {
+            "Name": "ProjetCloud-Kubernetes",
+            IMAGE_TAG_KEY: image_hash
+        })
+    finally:
+        session.terminate_ec2_instances([builder.id], wait = False)
+    return image.id
+
+if __name__ == '__main__':
+    # Setup env variables
+    if not os.getenv('AWS_ACCESS_KEY_ID'):
+        print("AWS_ACCESS_KEY_ID undefined in .env")
+        exit()
+    if not os.getenv('AWS_SECRET_ACCESS_KEY'):
+        print("AWS_SECRET_ACCESS_KEY undefined in .env")
+        exit()
+
+    # Arg parser
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-v", "--verbose", help="Affiche la sortie des commandes", action="count")
+    verbose = parser.parse_args().verbose
+
+    data = load_data_from_file()
+    if not data:
+        print("inventory.json introuvable : lancer main.py avant bake_image.py")
+        exit()
+
+    # Création session AWS
+    tracer.stage = "bake-image"
+    session = AWSSession(os.environ['AWS_ACCESS_KEY_ID'], os.environ['AWS_SECRET_ACCESS_KEY'], tracer = tracer)
+    try:
+        with tracer.span(tracer.stage, category = "stage"):
+            image_id = bake_image(session, data, verbose)
+        print(f"Image pré-installée : {image_id}")
+    except ClientError as err:
+        print(f"ClientError :\t{err}")
+    except Exception as err:
+        print(f"Exception :\t{err}")
+    finally:
+        pool.close_all()
+        tracer.finish()
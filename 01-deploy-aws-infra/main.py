@@ -1,86 +1,269 @@
 import os
+import sys
 import argparse
 import json
-import time
+import importlib.util
+from collections import namedtuple
 
 from dotenv import load_dotenv
 from utils.AWSSession import AWSSession, ClientError
+from utils.Provisioner import Provisioner
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.KubernetesSteps import INSTALL_KUBERNETES_STEPS, IMAGE_TAG_KEY, steps_hash
+from common.Inventory import master_instance
+from common.Readiness import wait_for, all_ssh_reachable
+from common.SSHPool import pool
+from common.Trace import tracer
 
 _UBUNTU_AMI_ID = "ami-03b755af568109dc3"
-_INSTANCE_TYPE = "t2.micro"
+# kubeadm demande au moins 2 vCPU et 2 Go de mémoire sur le master
+_MASTER_TYPE = "t3.medium"
+_WORKER_TYPE = "t3.medium"
+# Plage d'adresses du VPC et de son sous-réseau
+_VPC_CIDR = "192.168.0.0/24"
+# Inventaire lu par les étapes suivantes
+INVENTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "inventory.json")
 
 load_dotenv()
 
-def main(session, nb_instance: int) -> dict:
-    try:
-        # Création d'un VPC Réservé
-        vpc = session.create_vpc("ProjetCloud-VPC", "192.168.0.0/24")
-        vpc_id = vpc.id
-        
-        # Création d'une passerelle Internet
-        internet_gateway = session.create_internet_gateway("ProjetCloud-InternetGateway")
-        internet_gateway_id = internet_gateway.id
-        session.attach_internet_gateway_to_vpc(internet_gateway, vpc)
-        
-        # Création d'un sous réseau lié au VPC
-        subnet = session.create_subnet("ProjetCloud-Subnet", "192.168.0.0/24", vpc_id)
-        subnet_id = subnet.id
-        
-        # On renomme la table de routage lié au VPC et on créée une route par défaut vers la passerelle
-        session.setup_route_table_from_vpc("ProjetCloud-RoutingTable", vpc_id, internet_gateway_id)        
-        
-        # Création security group (fw)
-        security_group = session.create_security_group("ProjetCloud-SecurityGroup",
-            "Security Group utilise pour le projet Infra",
-            vpc_id
-        )
-        security_group_id = security_group.id
-        
+# Instance de la flotte et son rôle dans le cluster
+Node = namedtuple("Node", ["role", "instance_type", "spot", "instance"])
+
+def default_fleet(nb_instance: int, master_type: str = _MASTER_TYPE, worker_type: str = _WORKER_TYPE, spot: bool = False) -> dict:
+    """
+    Flotte homogène : un master et `nb_instance - 1` workers
+
+    Returns:
+        dict: {"master": {"type"}, "workers": [{"type", "count", "spot"}]}
+    """
+    return {
+        "master": {"type": master_type},
+        "workers": [{"type": worker_type, "count": nb_instance - 1, "spot": spot}] if nb_instance > 1 else []
+    }
+
+def parse_worker_group(spec: str) -> dict:
+    """
+    Groupe de workers au format TYPE:NOMBRE[:spot] (ex: "m5.large:2:spot")
+    """
+    fields = spec.split(":")
+    if len(fields) not in (2, 3) or (len(fields) == 3 and fields[2] != "spot"):
+        raise argparse.ArgumentTypeError(f"Groupe de workers invalide : {spec} (attendu TYPE:NOMBRE[:spot])")
+    return {"type": fields[0], "count": int(fields[1]), "spot": len(fields) == 3}
+
+def main(session, fleet: dict, max_workers: int = 4, reconcile: bool = False, key_pair_dir: str = os.path.dirname(__file__), on_instance_ready = None) -> dict:
+    """
+    Provisionne le réseau et la flotte d'instances.
+
+    Avec `on_instance_ready`, chaque instance est passée à cette fonction
+    (entrée de l'inventaire, inventaire partiel) dès qu'elle fonctionne, sans
+    attendre les autres, et l'inventaire est sauvegardé au fur et à mesure.
+
+    Returns:
+        dict: Inventaire, None en cas d'échec
+    """
+    key_pair_name = "ProjetCloud-KeyPair"
+    key_pair_path = f"{key_pair_dir}/{key_pair_name}.pem"
+    instance_name = "ProjetCloud-InstanceEC2"
+
+    def reuse_or_create(label, find, create):
+        # Mode reconcile : on réutilise la ressource si elle existe déjà
+        if reconcile:
+            existing = find()
+            if existing is not None:
+                print(f"{label} {getattr(existing, 'id', '')} réutilisé(e).")
+                return existing
+        return create()
+
+    def create_key_pair(results):
         # Création/Importation paire de clé
-        key_pair_name = "ProjetCloud-KeyPair"
-        key_pair_path = f"{os.path.dirname(__file__)}/{key_pair_name}.pem"
         key_pair = session.create_key_pair(key_pair_name)
         with open(key_pair_path, "w") as file:
             file.write(key_pair.key_material)
         os.chmod(key_pair_path, 0o600)
-        
-        # Création VM EC2
-        ec2_instances = session.create_ec2_instances(
-            nb_instance = nb_instance,
-            name = "ProjetCloud-InstanceEC2",
-            image_id = _UBUNTU_AMI_ID,
-            instance_type =_INSTANCE_TYPE,
-            security_group_id = security_group_id,
-            subnet_id = subnet_id,
-            key_pair_name = key_pair_name
-        )
-        instances = []
-        for i in ec2_instances:
-            instances.append({
-                "InstanceId": i.id,
-                "InstanceIp": session.get_ec2_instance_public_ip(i.id)
-            })
-        
-        data = {
-            "VpcId" : vpc_id,
-            "InternetGatewayId": internet_gateway_id,
-            "SubnetId": subnet_id,
-            "SecurityGroupId": security_group_id,
+        return key_pair
+
+    def find_key_pair():
+        key_pair = session.find_key_pair(key_pair_name)
+        if key_pair is not None and not os.path.exists(key_pair_path):
+            # AWS ne redonne jamais la clé privée : sans le .pem les instances sont inaccessibles
+            raise Exception(f"La paire de clé {key_pair_name} existe mais {key_pair_path} est introuvable")
+        return key_pair
+
+    def find_baked_image(results):
+        # Image pré-installée (bake_image.py) correspondant aux étapes d'installation actuelles
+        image = session.find_image(IMAGE_TAG_KEY, steps_hash(INSTALL_KUBERNETES_STEPS))
+        if image is not None:
+            print(f"Image pré-installée {image.id} utilisée.")
+        return image
+
+    def create_ec2_instances(results):
+        image_id = results["image"].id if results["image"] is not None else _UBUNTU_AMI_ID
+        security_group_id = results["security_group"].id
+        subnet_id = results["subnet"].id
+        existing = session.find_ec2_instances(instance_name, subnet_id) if reconcile else []
+        if existing:
+            print(f"{len(existing)} instance(s) existante(s).")
+        # Rôle des instances existantes : tag Role, sinon celui de l'inventaire précédent
+        previous = load_data_from_file()
+        previous_master = master_instance(previous)["InstanceId"] if previous.get("Instances") else None
+        def existing_role(instance):
+            tags = {t["Key"]: t["Value"] for t in instance.tags or []}
+            return tags.get("Role", "master" if instance.id == previous_master else "worker")
+
+        def create_group(role, group, count):
+            # Création VM EC2 (uniquement celles qui manquent)
+            instances = session.create_ec2_instances(
+                nb_instance = count,
+                name = instance_name,
+                image_id = image_id,
+                instance_type = group["type"],
+                security_group_id = security_group_id,
+                subnet_id = subnet_id,
+                key_pair_name = key_pair_name,
+                wait = False,
+                role = role,
+                spot = group.get("spot", False)
+            )
+            return [Node(role, group["type"], group.get("spot", False), i) for i in instances]
+
+        # Le master en tête
+        nodes = []
+        for role, groups in [("master", [dict(fleet["master"], count = 1)]), ("worker", fleet["workers"])]:
+            for group in groups:
+                spot = group.get("spot", False)
+                reused = [i for i in existing
+                    if existing_role(i) == role and i.instance_type == group["type"] and (i.instance_lifecycle == "spot") == spot
+                ][:group["count"]]
+                for instance in reused:
+                    existing.remove(instance)
+                    nodes.append(Node(role, group["type"], spot, instance))
+                if len(reused) < group["count"]:
+                    nodes += create_group(role, group, group["count"] - len(reused))
+        # Les instances existantes hors de la flotte demandée sont conservées
+        for instance in existing:
+            print(f"Instance {instance.id} ({instance.instance_type}) hors flotte, conservée.")
+            nodes.append(Node(existing_role(instance), instance.instance_type, instance.instance_lifecycle == "spot", instance))
+        return nodes
+
+    def inventory_entry(node, public_ip, image):
+        return {
+            "InstanceId": node.instance.id,
+            "InstanceIp": public_ip,
+            "Role": node.role,
+            "InstanceType": node.instance_type,
+            "Spot": node.spot,
+            # Etapes d'installation déjà présentes dans l'image de l'instance
+            "StepsHash": steps_hash(INSTALL_KUBERNETES_STEPS) if image is not None and node.instance.image_id == image.id else None
+        }
+
+    def inventory(results, instances):
+        return {
+            "VpcId" : results["vpc"].id,
+            "InternetGatewayId": results["internet_gateway"].id,
+            "SubnetId": results["subnet"].id,
+            "VpcCidr": _VPC_CIDR,
+            "SecurityGroupId": results["security_group"].id,
             "KeyPairPath": key_pair_path,
             "Instances": instances
         }
-        
+
+    def wait_instances_ready(results):
+        nodes = {node.instance.id: node for node in results["instances"]}
+        if on_instance_ready is None:
+            return session.wait_until_ec2_instances_ready(list(nodes))
+        # Inventaire partiel, complété à chaque instance prête
+        public_ips = {}
+        data = inventory(results, [])
+        for instance_id, public_ip in session.iter_ec2_instances_ready(list(nodes)):
+            public_ips[instance_id] = public_ip
+            entry = inventory_entry(nodes[instance_id], public_ip, results["image"])
+            data["Instances"].append(entry)
+            save_data_to_file(data)
+            on_instance_ready(entry, data)
+        return public_ips
+
+    # Graphe des étapes : les étapes indépendantes s'exécutent en parallèle
+    provisioner = Provisioner(max_workers, tracer)
+    # Création d'un VPC Réservé
+    provisioner.add_step("vpc", lambda r: reuse_or_create("VPC",
+        lambda: session.find_vpc("ProjetCloud-VPC"),
+        lambda: session.create_vpc("ProjetCloud-VPC", _VPC_CIDR)
+    ))
+    # Création d'une passerelle Internet
+    provisioner.add_step("internet_gateway", lambda r: reuse_or_create("Passerelle Internet",
+        lambda: session.find_internet_gateway("ProjetCloud-InternetGateway"),
+        lambda: session.create_internet_gateway("ProjetCloud-InternetGateway")
+    ))
+    provisioner.add_step("key_pair", lambda r: reuse_or_create("Paire de clé",
+        find_key_pair,
+        lambda: create_key_pair(r)
+    ))
+    provisioner.add_step("attach_gateway",
+        lambda r: session.attach_internet_gateway_to_vpc(r["internet_gateway"], r["vpc"]),
+        depends_on = ["vpc", "internet_gateway"]
+    )
+    # Création d'un sous réseau lié au VPC
+    provisioner.add_step("subnet", lambda r: reuse_or_create("Sous-réseau",
+        lambda: session.find_subnet("ProjetCloud-Subnet", r["vpc"].id),
+        lambda: session.create_subnet("ProjetCloud-Subnet", _VPC_CIDR, r["vpc"].id)
+    ), depends_on = ["vpc"])
+    # On renomme la table de routage lié au VPC et on créée une route par défaut vers la passerelle
+    provisioner.add_step("route_table",
+        lambda r: session.setup_route_table_from_vpc("ProjetCloud-RoutingTable", r["vpc"].id, r["internet_gateway"].id),
+        depends_on = ["attach_gateway"]
+    )
+    # Création security group (fw)
+    provisioner.add_step("security_group", lambda r: reuse_or_create("Security group",
+        lambda: session.find_security_group("ProjetCloud-SecurityGroup", r["vpc"].id),
+        lambda: session.create_security_group("ProjetCloud-SecurityGroup",
+            "Security Group utilise pour le projet Infra",
+            r["vpc"].id
+        )
+    ), depends_on = ["vpc"])
+    provisioner.add_step("image", find_baked_image)
+    provisioner.add_step("instances", create_ec2_instances, depends_on = ["image", "subnet", "security_group", "key_pair"])
+    # Attente groupée de toutes les instances, qui renvoie aussi leurs IP publiques
+    provisioner.add_step("instances_ready",
+        wait_instances_ready,
+        # La route par défaut rend les instances joignables en SSH
+        depends_on = ["instances", "route_table"]
+    )
+
+    try:
+        results = provisioner.run()
+        public_ips = results["instances_ready"]
+        # Le master en tête
+        data = inventory(results, [inventory_entry(node, public_ips[node.instance.id], results["image"]) for node in results["instances"]])
+
     except ClientError as err:
         print(f"ClientError :\t{err}")
     except Exception as err:
         print(f"Exception :\t{err}")
     else:
         return data
+    finally:
+        provisioner.print_timings()
+
+def load_module(name, path):
+    # Les scripts des étapes sont dans des répertoires qui ne sont pas des paquets
+    spec = importlib.util.spec_from_file_location(name, os.path.join(os.path.dirname(os.path.abspath(__file__)), path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
 
 def save_data_to_file(data):
-    with open(f"{os.path.dirname(__file__)}/inventory.json", "w") as file:
+    with open(INVENTORY_PATH, "w") as file:
         json.dump(data, file)
 
+def load_data_from_file() -> dict:
+    # Inventaire de l'exécution précédente, vide s'il n'existe pas
+    try:
+        with open(INVENTORY_PATH, "r") as file:
+            return json.load(file) or {}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
 if __name__ == '__main__':
     # Setup env variables
     if not os.getenv('AWS_ACCESS_KEY_ID'):
@@ -92,13 +275,68 @@ if __name__ == '__main__':
     
     # Arg parser
     parser = argparse.ArgumentParser()
-    parser.add_argument("-n", "--nb_instance", type=int, default=3, help="Nombre d'instance EC2 a creer")
-    nb_instance = parser.parse_args().nb_instance
+    parser.add_argument("-n", "--nb_instance", type=int, default=3, help="Nombre d'instance EC2 a creer (un master, des workers --worker_type)")
+    parser.add_argument("--master_type", default=_MASTER_TYPE, help="Type d'instance du master")
+    parser.add_argument("--worker_type", default=_WORKER_TYPE, help="Type d'instance des workers")
+    parser.add_argument("--workers", type=parse_worker_group, action="append", metavar="TYPE:NOMBRE[:spot]", help="Groupe de workers, remplace -n/--worker_type (repetable, ex: --workers m5.large:2 --workers m5.xlarge:4:spot)")
+    parser.add_argument("--spot", action="store_true", help="Workers en instances spot")
+    parser.add_argument("--max_pool_connections", type=int, default=10, help="Taille du pool de connexions HTTP vers AWS")
+    parser.add_argument("-w", "--max_workers", type=int, default=4, help="Nombre d'etapes de provisionnement executees en parallele")
+    parser.add_argument("-r", "--reconcile", action="store_true", help="Reutilise les ressources ProjetCloud-* existantes et ne cree que celles qui manquent")
+    parser.add_argument("--retry_mode", choices=["legacy", "standard", "adaptive"], default="standard", help="Mode de reessai des appels AWS")
+    parser.add_argument("--pipeline", action="store_true", help="Installe Kubernetes (etape 02) sur chaque instance des qu'elle fonctionne, sans attendre les autres")
+    parser.add_argument("-v", "--verbose", help="Avec --pipeline : affiche la sortie des commandes", action="count")
+    parser.add_argument("-b", "--batch", help="Avec --pipeline : installation de chaque noeud en un seul script", action="store_true")
+    parser.add_argument("-p", "--parallel", type=int, default=4, help="Avec --pipeline : nombre de noeuds installes/joints en meme temps")
+    parser.add_argument("-c", "--cache", choices=["master"], help="Avec --pipeline : cache apt et miroir d'images sur le master")
+    args = parser.parse_args()
+    fleet = default_fleet(args.nb_instance, args.master_type, args.worker_type, args.spot)
+    if args.workers:
+        fleet["workers"] = [dict(group, spot = group["spot"] or args.spot) for group in args.workers]
+
+    # Nouvelle trace : première étape du déploiement
+    tracer.stage = "01-deploy-aws-infra"
+    tracer.reset()
 
     # Création session AWS
-    session = AWSSession(os.environ['AWS_ACCESS_KEY_ID'], os.environ['AWS_SECRET_ACCESS_KEY'])
-    # Appel de main
-    aws_data = main(session, nb_instance)
-    save_data_to_file(aws_data)
-    #
-    time.sleep(5)
\ No newline at end of file
+    session = AWSSession(
+        os.environ['AWS_ACCESS_KEY_ID'],
+        os.environ['AWS_SECRET_ACCESS_KEY'],
+        max_pool_connections = args.max_pool_connections,
+        retry_mode = args.retry_mode,
+        tracer = tracer
+    )
+    if args.pipeline:
+        # L'étape 02 démarre instance par instance, pendant l'attente des autres
+        tracer.stage = "01+02-pipeline"
+        install_kubernetes = load_module("install_kubernetes", "../02-install-kubernetes/main.py")
+        pipeline = install_kubernetes.PipelinedDeploy(args.verbose, args.batch, args.parallel, args.cache)
+        try:
+            with tracer.span(tracer.stage, category = "stage"):
+                aws_data = main(session, fleet, args.max_workers, args.reconcile,
+                    on_instance_ready = pipeline.add)
+                if aws_data:
+                    save_data_to_file(aws_data)
+                pipeline.finish()
+        except Exception as err:
+            print(f"Exception :\t{err}")
+        finally:
+            pool.close_all()
+            tracer.finish()
+        exit()
+
+    with tracer.span(tracer.stage, category = "stage"):
+        # Appel de main
+        aws_data = main(session, fleet, args.max_workers, args.reconcile)
+        # En cas d'échec on garde l'inventaire précédent
+        if aws_data:
+            save_data_to_file(aws_data)
+            # Attente que le serveur SSH de chaque instance réponde (étape suivante)
+            try:
+                wait_for("SSH sur toutes les instances",
+                    all_ssh_reachable([i["InstanceIp"] for i in aws_data["Instances"]]),
+                    timeout = 300
+                )
+            except TimeoutError as err:
+                print(f"Exception :\t{err}")
+    tracer.finish()
@@ -1,4 +1,9 @@
+import threading
+import time
+
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 class AWSSession:
@@ -6,7 +11,14 @@ class AWSSession:
     Classe fournissant une série de fonctions simplifiées
     afin de gérer l'environnement AWS
     """
-    def __init__(self, aws_acces_key_id : str, aws_secret_access_key : str) -> None:
+    def __init__(self,
+        aws_acces_key_id : str,
+        aws_secret_access_key : str,
+        max_pool_connections: int = 10,
+        retry_mode: str = "standard",
+        max_attempts: int = 5,
+        tracer = None
+    ) -> None:
         """
         Initialisation de la session AWS à partir des identifiants
         récupérés sur le compte personnel
@@ -14,13 +26,77 @@ class AWSSession:
         Args:
             aws_acces_key_id (str)
             aws_secret_access_key (str)
+            max_pool_connections (int): Taille du pool de connexions HTTP de botocore
+            retry_mode (str): Mode de réessai botocore ("legacy", "standard" ou "adaptive")
+            max_attempts (int): Nombre maximum de tentatives par appel
+            tracer (Tracer): Si fourni, chaque appel à l'API AWS est enregistré (common/Trace.py)
         """
         self.session = boto3.session.Session(
             aws_access_key_id = aws_acces_key_id,
             aws_secret_access_key = aws_secret_access_key,
             region_name = "eu-west-3"
         )
+        self.config = Config(
+            max_pool_connections = max_pool_connections,
+            retries = {
+                "mode": retry_mode,
+                "max_attempts": max_attempts
+            }
+        )
+        if tracer is not None:
+            tracer.instrument_boto3_session(self.session)
+        # Clients et ressources boto3, créés à la première utilisation.
+        # Les ressources boto3 ne sont pas thread-safe : une par thread
+        self._clients = {}
+        self._resources = threading.local()
+        self._lock = threading.Lock()
+
+    def client(self, service_name: str):
+        """
+        Client boto3 du service, créé une seule fois puis réutilisé
+
+        Args:
+            service_name (str): Nom du service AWS (ex: "ec2")
+
+        Returns:
+            botocore.client.BaseClient
+        """
+        with self._lock:
+            if service_name not in self._clients:
+                self._clients[service_name] = self.session.client(service_name, config = self.config)
+            return self._clients[service_name]
+
+    def resource(self, service_name: str):
+        """
+        Ressource boto3 du service, créée une seule fois (par thread) puis réutilisée
+
+        Args:
+            service_name (str): Nom du service AWS (ex: "ec2")
+
+        Returns:
+            boto3.resources.base.ServiceResource
+        """
+        resources = self._resources.__dict__
+        if service_name not in resources:
+            # La session boto3 n'est pas thread-safe non plus
+            with self._lock:
+                resources[service_name] = self.session.resource(service_name, config = self.config)
+        return resources[service_name]
         
+    def _find_one(self, collection, filters: list):
+        """
+        Premier élément d'une collection boto3 correspondant aux filtres
+
+        Returns:
+            L'élément trouvé ou None
+        """
+        try:
+            for item in collection.filter(Filters = filters):
+                return item
+        except ClientError:
+            raise
+        return None
+
     ###
     # KeyPair
     ###
@@ -34,7 +110,7 @@ class AWSSession:
         Returns:
             dict: ec2.KeyPair
         """
-        resource = self.session.resource('ec2')
+        resource = self.resource('ec2')
         try:
             new_key_pair = resource.create_key_pair(
                 KeyName = name,
@@ -47,6 +123,23 @@ class AWSSession:
             return new_key_pair
         
 
+    def find_key_pair(self, name: str) -> dict:
+        """
+        Recherche une paire de clé existante
+
+        Args:
+            name (str): Nom de la paire de clé
+
+        Returns:
+            dict: ec2.KeyPairInfo, ou None si elle n'existe pas
+        """
+        return self._find_one(self.resource('ec2').key_pairs, [
+            {
+                "Name": "key-name",
+                "Values": [name]
+            }
+        ])
+
     ###
     # Vpc
     ###
@@ -61,8 +154,8 @@ class AWSSession:
         Returns:
             dict: ec2.Vpc
         """
-        resource = self.session.resource('ec2')
-        client = self.session.client('ec2')
+        resource = self.resource('ec2')
+        client = self.client('ec2')
         try:
             # Création du VPC
             new_vpc = resource.create_vpc(
@@ -92,11 +185,25 @@ class AWSSession:
         else:
             return new_vpc
     
+    def find_vpc(self, name: str) -> dict:
+        """
+        Recherche un VPC existant à partir de son tag Name
+
+        Returns:
+            dict: ec2.Vpc, ou None s'il n'existe pas
+        """
+        return self._find_one(self.resource('ec2').vpcs, [
+            {
+                "Name": "tag:Name",
+                "Values": [name]
+            }
+        ])
+
     ###
     # InternetGateway
     ###
     def create_internet_gateway(self, name: str) -> dict:
-        resource = self.session.resource('ec2')
+        resource = self.resource('ec2')
         try:
             # On créé la passerelle Internet
             new_internet_gateway = resource.create_internet_gateway(
@@ -117,7 +224,25 @@ class AWSSession:
         else:
             return new_internet_gateway
     
+    def find_internet_gateway(self, name: str) -> dict:
+        """
+        Recherche une passerelle Internet existante à partir de son tag Name
+
+        Returns:
+            dict: ec2.InternetGateway, ou None si elle n'existe pas
+        """
+        return self._find_one(self.resource('ec2').internet_gateways, [
+            {
+                "Name": "tag:Name",
+                "Values": [name]
+            }
+        ])
+
     def attach_internet_gateway_to_vpc(self, internet_gateway: dict, vpc: dict):
+        # Rien à faire si la passerelle est déjà attachée au VPC
+        internet_gateway.reload()
+        if any(a["VpcId"] == vpc.id for a in internet_gateway.attachments):
+            return
         try:
             vpc.attach_internet_gateway(
                 InternetGatewayId = internet_gateway.id
@@ -140,8 +265,8 @@ class AWSSession:
         Returns:
             dict: ec2.Subnet
         """
-        resource = self.session.resource('ec2')
-        client = self.session.client('ec2')
+        resource = self.resource('ec2')
+        client = self.client('ec2')
         try:
             new_subnet = resource.create_subnet(
                 CidrBlock = cidr,
@@ -170,12 +295,30 @@ class AWSSession:
         else:
             return new_subnet
     
+    def find_subnet(self, name: str, vpc_id: str) -> dict:
+        """
+        Recherche un sous-réseau existant du VPC à partir de son tag Name
+
+        Returns:
+            dict: ec2.Subnet, ou None s'il n'existe pas
+        """
+        return self._find_one(self.resource('ec2').subnets, [
+            {
+                "Name": "tag:Name",
+                "Values": [name]
+            },
+            {
+                "Name": "vpc-id",
+                "Values": [vpc_id]
+            }
+        ])
+
     ###
     # RouteTable
     ###
     def setup_route_table_from_vpc(self, name: str, vpc_id: str, internet_gateway_id: str):
-        client = self.session.client('ec2')
-        resource = self.session.resource('ec2')
+        client = self.client('ec2')
+        resource = self.resource('ec2')
         try:
             # On récupère l'id de la RouteTable
             new_route_table = client.describe_route_tables(
@@ -196,7 +339,10 @@ class AWSSession:
                     }
                 ]
             )
-            # On créer une route statique par défaut vers la gateway
+            # On créer une route statique par défaut vers la gateway (si elle n'existe pas déjà)
+            routes = new_route_table["RouteTables"][0]["Routes"]
+            if any(r.get("DestinationCidrBlock") == "0.0.0.0/0" for r in routes):
+                return
             client.create_route(
                 DestinationCidrBlock = "0.0.0.0/0",
                 GatewayId = internet_gateway_id,
@@ -220,7 +366,7 @@ class AWSSession:
         Returns:
             dict: ec2.securityGroup
         """
-        resource = self.session.resource('ec2')
+        resource = self.resource('ec2')
         try:
             # Création du Security Group
             new_security_group = resource.create_security_group(
@@ -252,6 +398,24 @@ class AWSSession:
         else:
             return new_security_group
     
+    def find_security_group(self, name: str, vpc_id: str) -> dict:
+        """
+        Recherche un groupe de sécurité existant du VPC
+
+        Returns:
+            dict: ec2.SecurityGroup, ou None s'il n'existe pas
+        """
+        return self._find_one(self.resource('ec2').security_groups, [
+            {
+                "Name": "group-name",
+                "Values": [name]
+            },
+            {
+                "Name": "vpc-id",
+                "Values": [vpc_id]
+            }
+        ])
+
     ###
     # Instances
     ###
@@ -262,7 +426,10 @@ class AWSSession:
         instance_type: str,
         security_group_id: str,
         subnet_id: str,
-        key_pair_name: str
+        key_pair_name: str,
+        wait: bool = True,
+        role: str = None,
+        spot: bool = False
     ) -> dict:
         """
         Créé de nouvelles instances EC2
@@ -275,11 +442,34 @@ class AWSSession:
             security_group_id (str): ID du groupe de sécurité
             subnet_id (str): ID du sous-réseau
             key_pair_name (str): Nom de la paire de clé RSA
+            wait (bool): Attendre que toutes les instances soient fonctionnelles
+            role (str): Rôle des instances dans le cluster ("master", "worker"), enregistré dans le tag Role
+            spot (bool): Instances spot (capacité inutilisée, moins chère mais pouvant être reprise par AWS)
 
         Returns:
             dict: ec2.Instance
         """
-        resource = self.session.resource('ec2')
+        resource = self.resource('ec2')
+        tags = [
+            {
+                "Key": "Name",
+                "Value": name
+            }
+        ]
+        if role is not None:
+            tags.append({
+                "Key": "Role",
+                "Value": role
+            })
+        options = {}
+        if spot:
+            options["InstanceMarketOptions"] = {
+                "MarketType": "spot",
+                "SpotOptions": {
+                    "SpotInstanceType": "one-time",
+                    "InstanceInterruptionBehavior": "terminate"
+                }
+            }
         try: 
             new_ec2_instances = resource.create_instances(
                 
@@ -299,45 +489,301 @@ class AWSSession:
                 TagSpecifications = [
                     {
                         "ResourceType": "instance",
-                        "Tags": [
-                            {
-                                "Key": "Name",
-                                "Value": name
-                            }
-                        ]
+                        "Tags": tags
                     }
-                ]
+                ],
+                **options
             )
             for instance in new_ec2_instances:
-                print(f"Instance {instance} en cours de création...")
-            for instance in new_ec2_instances:
-                instance.wait_until_exists()
-                print(f"Instance {instance} créée.")
-            for instance in new_ec2_instances:
-                instance.wait_until_running()
-                print(f"Instance {instance} fonctionnelle.")
+                print(f"Instance {instance} ({instance_type}{', spot' if spot else ''}) en cours de création...")
+            if wait:
+                self.wait_until_ec2_instances_ready([i.id for i in new_ec2_instances])
         except ClientError:
             raise
         else:
             return new_ec2_instances
         
-    def get_ec2_instance_public_ip(self, instance_id: str) -> str:
+    def find_ec2_instances(self, name: str, subnet_id: str) -> list:
+        """
+        Recherche les instances EC2 non terminées du sous-réseau à partir de leur tag Name
+
+        Returns:
+            list: ec2.Instance
+        """
+        try:
+            return list(self.resource('ec2').instances.filter(
+                Filters = [
+                    {
+                        "Name": "tag:Name",
+                        "Values": [name]
+                    },
+                    {
+                        "Name": "subnet-id",
+                        "Values": [subnet_id]
+                    },
+                    {
+                        "Name": "instance-state-name",
+                        "Values": ["pending", "running"]
+                    }
+                ]
+            ))
+        except ClientError:
+            raise
+
+    def wait_until_ec2_instances_ready(self,
+        instance_ids: list,
+        timeout: int = 600,
+        delay: float = 2,
+        max_delay: float = 15
+    ) -> dict:
+        """
+        Attend que toutes les instances soient "running" avec une adresse IP publique.
+
+        Args:
+            instance_ids (list): IDs des instances
+            timeout (int): Durée maximale d'attente en secondes
+            delay (float): Délai initial entre deux interrogations
+            max_delay (float): Délai maximal entre deux interrogations
+
+        Returns:
+            dict: {instance_id: adresse IP publique}
+        """
+        return dict(self.iter_ec2_instances_ready(instance_ids, timeout, delay, max_delay))
+
+    def iter_ec2_instances_ready(self,
+        instance_ids: list,
+        timeout: int = 600,
+        delay: float = 2,
+        max_delay: float = 15
+    ):
         """
-        Récupère l'adresse IP publique d'une instance EC2
+        Renvoie les instances une par une, dès qu'elles sont "running" avec une
+        adresse IP publique. Un seul describe_instances (paginé) interroge toutes
+        les instances restantes à chaque tour, avec un délai croissant entre deux tours.
 
         Args:
-            instance_id (str): Id de l'instance
+            instance_ids (list): IDs des instances
+            timeout (int): Durée maximale d'attente en secondes
+            delay (float): Délai initial entre deux interrogations
+            max_delay (float): Délai maximal entre deux interrogations
+
+        Yields:
+            tuple: (instance_id, adresse IP publique)
+        """
+        client = self.client('ec2')
+        paginator = client.get_paginator('describe_instances')
+        pending = set(instance_ids)
+        deadline = time.monotonic() + timeout
+        try:
+            while pending:
+                # Le filtre (plutôt que InstanceIds) évite les erreurs
+                # InvalidInstanceID.NotFound tant que l'instance n'est pas encore visible
+                ids = list(pending)
+                ready = []
+                for start in range(0, len(ids), 200):
+                    pages = paginator.paginate(
+                        Filters = [
+                            {
+                                "Name": "instance-id",
+                                "Values": ids[start:start + 200]
+                            }
+                        ]
+                    )
+                    for page in pages:
+                        for reservation in page["Reservations"]:
+                            for instance in reservation["Instances"]:
+                                ip = instance.get("PublicIpAddress")
+                                if instance["State"]["Name"] == "running" and ip:
+                                    ready.append((instance["InstanceId"], ip))
+                                    pending.discard(instance["InstanceId"])
+                                    print(f"Instance {instance['InstanceId']} fonctionnelle ({ip}).")
+                # Instances prêtes à ce tour, rendues une fois la pagination terminée
+                yield from ready
+                if not pending:
+                    break
+                if time.monotonic() + delay > deadline:
+                    raise TimeoutError(f"Instances non fonctionnelles après {timeout}s : {sorted(pending)}")
+                time.sleep(delay)
+                delay = min(delay * 2, max_delay)
+        except ClientError:
+            raise
+
+    def terminate_ec2_instances(self, instance_ids: list, wait: bool = True) -> None:
+        """
+        Supprime des instances EC2
+
+        Args:
+            instance_ids (list): IDs des instances
+            wait (bool): Attendre la fin de la suppression
+        """
+        client = self.client('ec2')
+        try:
+            client.terminate_instances(InstanceIds = instance_ids)
+            if wait:
+                client.get_waiter('instance_terminated').wait(InstanceIds = instance_ids)
+        except ClientError:
+            raise
+
+    def get_ec2_instances_private_ips(self, instance_ids: list) -> dict:
+        """
+        Récupère les adresses IP privées d'instances EC2, en une requête
+
+        Args:
+            instance_ids (list): IDs des instances
+
+        Returns:
+            dict: {id de l'instance: adresse IP privée}
+        """
+        client = self.client('ec2')
+        try:
+            private_ips = {}
+            for page in client.get_paginator('describe_instances').paginate(InstanceIds = instance_ids):
+                for reservation in page["Reservations"]:
+                    for instance in reservation["Instances"]:
+                        private_ips[instance["InstanceId"]] = instance.get("PrivateIpAddress")
+        except ClientError:
+            raise
+        else:
+            return private_ips
+
+    ###
+    # Image
+    ###
+    def create_image(self, instance_id: str, name: str, tags: dict) -> dict:
+        """
+        Créé une AMI à partir d'une instance et attend qu'elle soit disponible
+
+        Args:
+            instance_id (str): ID de l'instance source
+            name (str): Nom de l'AMI (unique dans la région)
+            tags (dict): Tags de l'AMI {clé: valeur}
 
         Returns:
-            str: Adresse IP publique de l'instance
+            dict: ec2.Image
         """
-        client = self.session.client('ec2')
+        resource = self.resource('ec2')
+        client = self.client('ec2')
         try:
-            ec2_instance = client.describe_instances(
-                InstanceIds = [instance_id]
+            new_image = resource.Instance(instance_id).create_image(
+                Name = name,
+                TagSpecifications = [
+                    {
+                        "ResourceType": "image",
+                        "Tags": [{"Key": k, "Value": v} for k, v in tags.items()]
+                    }
+                ]
             )
-            ec2_instance_ip = ec2_instance["Reservations"][0]["Instances"][0]["PublicIpAddress"]            
+            print(f"Image {new_image.id} en cours de création...")
+            client.get_waiter('image_available').wait(
+                ImageIds = [new_image.id],
+                WaiterConfig = {
+                    "Delay": 15,
+                    "MaxAttempts": 80
+                }
+            )
+            print(f"Image {new_image.id} disponible.")
         except ClientError:
             raise
         else:
-            return ec2_instance_ip
+            return new_image
+
+    def find_image(self, tag_key: str, tag_value: str) -> dict:
+        """
+        Recherche une AMI disponible du compte à partir d'un tag
+
+        Args:
+            tag_key (str): Clé du tag
+            tag_value (str): Valeur du tag
+
+        Returns:
+            dict: ec2.Image, ou None si aucune ne correspond
+        """
+        resource = self.resource('ec2')
+        try:
+            images = list(resource.images.filter(
+                Owners = ["self"],
+                Filters = [
+                    {
+                        "Name": f"tag:{tag_key}",
+                        "Values": [tag_value]
+                    },
+                    {
+                        "Name": "state",
+                        "Values": ["available"]
+                    }
+                ]
+            ))
+        except ClientError:
+            raise
+        # La plus récente en premier
+        images.sort(key=lambda i: i.creation_date, reverse=True)
+        return images[0] if images else None
+
+    ###
+    # S3
+    ###
+    def create_bucket(self, name: str) -> None:
+        """
+        Créé un bucket S3 dans la région de la session (rien à faire s'il est déjà à nous)
+
+        Args:
+            name (str): Nom du bucket
+        """
+        client = self.client('s3')
+        try:
+            client.create_bucket(
+                Bucket = name,
+                CreateBucketConfiguration = {
+                    "LocationConstraint": self.session.region_name
+                }
+            )
+            print(f"Bucket {name} créé.")
+        except ClientError as err:
+            if err.response["Error"]["Code"] != "BucketAlreadyOwnedByYou":
+                raise
+
+    def find_s3_object(self, bucket: str, key: str) -> dict:
+        """
+        Métadonnées d'un objet S3
+
+        Returns:
+            dict: Réponse de head_object, ou None si l'objet n'existe pas
+        """
+        try:
+            return self.client('s3').head_object(Bucket = bucket, Key = key)
+        except ClientError as err:
+            if err.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def upload_fileobj_to_s3(self,
+        fileobj,
+        bucket: str,
+        key: str,
+        metadata: dict = None,
+        multipart_chunksize: int = 16 * 1024 * 1024,
+        max_concurrency: int = 4
+    ) -> None:
+        """
+        Envoie un fichier vers S3, en multipart (parties envoyées en parallèle)
+        au-delà de `multipart_chunksize`
+
+        Args:
+            fileobj: Objet fichier lu jusqu'à la fin
+            bucket (str): Nom du bucket
+            key (str): Clé de l'objet
+            metadata (dict): Métadonnées de l'objet (x-amz-meta-*)
+            multipart_chunksize (int): Taille des parties, en octets
+            max_concurrency (int): Nombre de parties envoyées en même temps
+        """
+        self.client('s3').upload_fileobj(
+            fileobj,
+            bucket,
+            key,
+            ExtraArgs = {"Metadata": metadata or {}},
+            Config = TransferConfig(
+                multipart_threshold = multipart_chunksize,
+                multipart_chunksize = multipart_chunksize,
+                max_concurrency = max_concurrency
+            )
+        )
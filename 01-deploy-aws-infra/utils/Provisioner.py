@@ -0,0 +1,115 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class Provisioner:
+    """
+    Exécute des étapes de provisionnement déclarées sous forme de graphe de
+    dépendances (DAG) : une étape démarre dès que toutes ses dépendances sont
+    terminées, les étapes indépendantes s'exécutent en parallèle.
+    """
+    def __init__(self, max_workers: int = 4, tracer = None) -> None:
+        """
+        Args:
+            max_workers (int): Nombre maximal d'étapes exécutées en même temps
+            tracer (Tracer): Si fourni, chaque étape est enregistrée (common/Trace.py)
+        """
+        self.max_workers = max_workers
+        self.tracer = tracer
+        self.steps = {}
+        self.timings = {}
+
+    def add_step(self, name: str, func, depends_on: list = ()) -> None:
+        """
+        Déclare une étape
+
+        Args:
+            name (str): Nom unique de l'étape
+            func (callable): Fonction appelée avec le dict {nom d'étape: résultat}
+                des étapes déjà terminées, sa valeur de retour est le résultat de l'étape
+            depends_on (list): Noms des étapes qui doivent être terminées avant
+        """
+        if name in self.steps:
+            raise ValueError(f"Etape {name} déjà déclarée")
+        for dependency in depends_on:
+            if dependency not in self.steps:
+                raise ValueError(f"Etape {name} : dépendance inconnue {dependency}")
+        self.steps[name] = {
+            "func": func,
+            "depends_on": list(depends_on)
+        }
+
+    def run(self) -> dict:
+        """
+        Exécute toutes les étapes. A la première erreur, plus aucune étape ne
+        démarre, les étapes en cours se terminent puis l'erreur est relevée.
+
+        Returns:
+            dict: {nom d'étape: résultat}
+        """
+        results = {}
+        started = set()
+        futures = {}
+        error = None
+        origin = time.monotonic()
+
+        def timed(name):
+            start = time.monotonic() - origin
+            wall_start = time.time()
+            status = "error"
+            try:
+                result = self.steps[name]["func"](results)
+                status = 0
+                return result
+            finally:
+                self.timings[name] = (start, time.monotonic() - origin)
+                if self.tracer is not None:
+                    self.tracer.record(name, wall_start, time.time(), category = "step", exit_status = status)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                # Lancement des étapes dont toutes les dépendances sont terminées
+                if error is None:
+                    for name, step in self.steps.items():
+                        if name not in started and all(d in results for d in step["depends_on"]):
+                            started.add(name)
+                            futures[executor.submit(timed, name)] = name
+                if not futures:
+                    break
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = futures.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as err:
+                        if error is None:
+                            error = err
+        if error is not None:
+            raise error
+        return results
+
+    def critical_path(self) -> list:
+        """
+        Chemin critique de la dernière exécution : chaîne de dépendances qui
+        se termine le plus tard
+
+        Returns:
+            list: Noms des étapes, de la première à la dernière
+        """
+        if not self.timings:
+            return []
+        path = [max(self.timings, key=lambda n: self.timings[n][1])]
+        while True:
+            dependencies = [d for d in self.steps[path[-1]]["depends_on"] if d in self.timings]
+            if not dependencies:
+                break
+            path.append(max(dependencies, key=lambda n: self.timings[n][1]))
+        return path[::-1]
+
+    def print_timings(self) -> None:
+        """Affiche la durée de chaque étape et le chemin critique"""
+        print("Durée des étapes :")
+        for name, (start, end) in sorted(self.timings.items(), key=lambda t: t[1][0]):
+            print(f"  {name:<20}\t{start:7.2f}s -> {end:7.2f}s\t({end - start:.2f}s)")
+        path = self.critical_path()
+        if path:
+            print(f"Chemin critique ({self.timings[path[-1]][1]:.2f}s) : {' -> '.join(path)}")
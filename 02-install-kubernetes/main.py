@@ -1,219 +1,59 @@
 import argparse
 import json
 import os
-import time
-import re
+import sys
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.SSHPool import pool
+from common.Remote import banner, log, read_cmd, run_cmd, run_steps, run_on_hosts, traced, print_summary
+from common.Readiness import wait_for, nodes_ready, all_ssh_reachable
+from common.Trace import tracer
+from common.Inventory import master_instance, worker_instances, vpc_cidr
+from common.KubernetesSteps import INSTALL_KUBERNETES_STEPS, node_install_steps
+from common.CacheSteps import cache_server_steps
+
+def install_kubernetes(ip, port, user, ssh_key, verbose=False, batch=False, steps=INSTALL_KUBERNETES_STEPS):
+    # Banner
+    banner(ip, "Kubernetes installation")
+
+    # Connect to instance (pooled connection)
+    client = pool.get(ip, port, user, ssh_key)
 
-import paramiko
-from termcolor import colored
+    # Install Docker and Kubernetes
+    run_steps(client, ip, steps, verbose, batch)
 
-def install_kubernetes(ip, port, user, ssh_key, verbose=False):
+def setup_cache(ip, port, user, ssh_key, allowed_cidr, verbose=False, batch=False):
     # Banner
-    print("###################################################")
-    print(f"### {ip} : Kubernetes installation \t###")
-    print("###################################################")
-
-    # Connect to instance
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(ip, port, user, key_filename=ssh_key)
-
-    # Install Docker
-    cmd = "sudo swapoff -a"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            print("Error : ", cmd, exit_status)
-
-    cmd = "wget -qO- https://get.docker.com/ | sh"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    # Install Kubernetes
-    cmd = "sudo modprobe br_netfilter"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-    
-    cmd = """
-cat <<EOF | sudo tee /etc/sysctl.d/k8s.conf
-net.bridge.bridge-nf-call-ip6tables = 1
-net.bridge.bridge-nf-call-iptables = 1 
-EOF"""
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    cmd = "sudo sysctl --system"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    cmd = "curl -s https://packages.cloud.google.com/apt/doc/apt-key.gpg | sudo apt-key add -"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    cmd = """
-cat <<EOF | sudo tee /etc/apt/sources.list.d/kubernetes.list
-deb https://apt.kubernetes.io/ kubernetes-xenial main
-EOF"""
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    cmd = "sudo apt-get update && sudo apt-get install -y kubelet kubeadm kubectl"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    cmd = "sudo sed -i 's|Environment=\"KUBELET_CONFIG_ARGS=--config=/var/lib/kubelet/config.yaml\"|Environment=\"KUBELET_CONFIG_ARGS=--config=/var/lib/kubelet/config.yaml --cgroup-driver=cgroupfs\"|' /etc/systemd/system/kubelet.service.d/10-kubeadm.conf"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    cmd = "sudo systemctl daemon-reload"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    cmd = "sudo rm /etc/containerd/config.toml && sudo systemctl restart containerd"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    # Close connection
-    client.close()
+    banner(ip, "Package and image cache")
+
+    # Connect to instance (pooled connection)
+    client = pool.get(ip, port, user, ssh_key)
+
+    # apt-cacher-ng + docker.io pull-through registry mirror, reachable from the VPC only
+    run_steps(client, ip, cache_server_steps(allowed_cidr), verbose, batch)
+
+    # The nodes reach the cache on its private IP
+    return read_cmd(client, ip, "hostname -I | awk '{print $1}'").strip()
 
 def setup_master(ip, port, user, ssh_key, verbose=False):
     # Banner
-    print("###########################################")
-    print(f"### {ip} : Setup Master \t###")
-    print("###########################################")
+    banner(ip, "Setup Master")
 
-    # Connect to instance
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(ip, port, user, key_filename=ssh_key)
+    # Connect to instance (pooled connection)
+    client = pool.get(ip, port, user, ssh_key)
 
     # Configuration Kubernetes Master
-    cmd = "sudo kubeadm init --pod-network-cidr=10.244.0.0/16 --ignore-preflight-errors=all --v=5"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    cmd = "sudo kubeadm token create --print-join-command"
-    output = client.exec_command(cmd)
-    join_command = output[1].readline()
-
-    cmd = "sudo mkdir -p $HOME/.kube && sudo cp -i /etc/kubernetes/admin.conf $HOME/.kube/config && sudo chown $(id -u):$(id -g) $HOME/.kube/config"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    cmd = "kubectl apply -f https://raw.githubusercontent.com/coreos/flannel/master/Documentation/kube-flannel.yml"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
+    run_cmd(client, ip, "sudo kubeadm init --pod-network-cidr=10.244.0.0/16 --ignore-preflight-errors=all --v=5", verbose)
+
+    join_command = read_cmd(client, ip, "sudo kubeadm token create --print-join-command")
+
+    run_cmd(client, ip, "sudo mkdir -p $HOME/.kube && sudo cp -i /etc/kubernetes/admin.conf $HOME/.kube/config && sudo chown $(id -u):$(id -g) $HOME/.kube/config", verbose)
+    run_cmd(client, ip, "kubectl apply -f https://raw.githubusercontent.com/coreos/flannel/master/Documentation/kube-flannel.yml", verbose)
 
     # Installation Helm
-    cmd = "curl https://raw.githubusercontent.com/helm/helm/master/scripts/get-helm-3 | bash"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-    
-    # Close connection
-    client.close()
+    run_cmd(client, ip, "curl https://raw.githubusercontent.com/helm/helm/master/scripts/get-helm-3 | bash", verbose)
 
     # Return Kubernetes Join Command
     return {
@@ -223,92 +63,225 @@ def setup_master(ip, port, user, ssh_key, verbose=False):
 
 def setup_worker(ip, port, user, ssh_key, master_join_command, verbose=False):
     # Banner
-    print("###########################################")
-    print(f"### {ip} : Setup workers \t###")
-    print("###########################################")
-
-    # Connect to instance
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(ip, port, user, key_filename=ssh_key)
-
-    cmd = "sudo " + master_join_command + " --ignore-preflight-errors=all --v=5"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    # Close connection
-    client.close()
+    banner(ip, "Setup workers")
+
+    # Connect to instance (pooled connection)
+    client = pool.get(ip, port, user, ssh_key)
+
+    run_cmd(client, ip, "sudo " + master_join_command + " --ignore-preflight-errors=all --v=5", verbose)
 
 def get_nodes(ip, port, user, ssh_key):
     # Banner
-    print("###################################")
-    print(f"### {ip} : Get nodes \t###")
-    print("###################################")
-    
-    # Connect to instance
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(ip, port, user, key_filename=ssh_key)
-
-    cmd = "kubectl get nodes && kubectl get pods --all-namespaces"
-    output = client.exec_command(cmd)
-    print_std(cmd, output)
-
-    # Close connection
-    client.close()
-
-def print_std(command, output, verbose=1):
-    stdin, stdout, stderr = output
-    stdout = stdout.readlines()
-    stderr = stderr.readlines()
-
-    print(command)
-    [print(colored(i, 'green')) for i in stdout]
-    print()
-    
-    if verbose >= 2:
-        [print(colored(i, 'red')) for i in stderr]
-        print()
+    banner(ip, "Get nodes")
+
+    # Connect to instance (pooled connection)
+    client = pool.get(ip, port, user, ssh_key)
+
+    # Always show the output
+    run_cmd(client, ip, "kubectl get nodes && kubectl get pods --all-namespaces", verbose=1)
+
+def deploy(data, verbose=False, batch=False, parallel=1, cache=None, timeout=600, port=22, user="ubuntu"):
+    """
+    Install Kubernetes on the nodes of the inventory (`data`), setup the master,
+    join the workers and wait until every node is Ready.
+
+    Returns a dict {"install_failures": {ip: exception}, "join_failures": {ip: exception}}
+    """
+    ssh_key = data["KeyPairPath"]
+    master_ip = master_instance(data)["InstanceIp"]
+    workers_ip = [i["InstanceIp"] for i in worker_instances(data)]
+    instances = {i["InstanceIp"]: i for i in data["Instances"]}
+    # Package and image cache host
+    cache_ip = master_ip if cache == "master" else cache
+    if cache_ip in workers_ip:
+        # Dedicated cache node, out of the cluster (recorded in the inventory)
+        workers_ip.remove(cache_ip)
+        instances[cache_ip]["Role"] = "cache"
+
+    # Setup package and image cache, before any node installation uses it
+    cache_private_ip = traced(setup_cache, cache_ip, port, user, ssh_key, vpc_cidr(data), verbose, batch) if cache_ip else None
+
+    def install_node(ip):
+        steps = node_install_steps(instances[ip], cache_private_ip)
+        return install_kubernetes(ip, port, user, ssh_key, verbose, batch, steps)
+
+    # Install kubernetes
+    _, install_failures = run_on_hosts(install_node, [master_ip] + workers_ip, parallel)
+    print_summary("Kubernetes installation", [master_ip] + workers_ip, install_failures)
+    if master_ip in install_failures:
+        raise Exception(f"Master {master_ip} installation failed, aborting")
+
+    # Setup master
+    master = traced(setup_master, master_ip, port, user, ssh_key, verbose)
+
+    # Setup workers (only those which were installed)
+    workers_ip = [ip for ip in workers_ip if ip not in install_failures]
+    _, join_failures = run_on_hosts(setup_worker, workers_ip, parallel, port, user, ssh_key, master["join_command"], verbose)
+    print_summary("Setup workers", workers_ip, join_failures)
+
+    # Wait until the master and every joined worker are Ready, then get nodes
+    nodes_count = 1 + len(workers_ip) - len(join_failures)
+    wait_for(f"{nodes_count} node(s) Ready", nodes_ready(pool.get(master_ip, port, user, ssh_key), nodes_count), timeout=timeout, host=master_ip)
+    get_nodes(master_ip, port, user, ssh_key)
+
+    return {
+        "install_failures": install_failures,
+        "join_failures": join_failures
+    }
+
+
+class PipelinedDeploy:
+    """
+    Stage 02 fed node by node by stage 01 (`main.py --pipeline`): `add()`
+    starts the installation of a node as soon as its instance is running,
+    while the other instances are still booting.
+
+    The master is set up as soon as its own installation is done, on a thread
+    of its own (never queued behind the workers). Each worker is queued for
+    its join once its installation is done (join slots only hold installed
+    nodes), and joins as soon as the master setup is done. `finish()` waits
+    for the cluster, like `deploy()`.
+    """
+    def __init__(self, verbose=False, batch=False, parallel=1, cache=None, port=22, user="ubuntu"):
+        if cache not in (None, "master"):
+            raise ValueError("Pipelined deployment: the cache can only be hosted on the master")
+        self.ssh_key = None
+        self.allowed_cidr = None
+        self.verbose = verbose
+        self.batch = batch
+        self.cache = cache
+        self.port = port
+        self.user = user
+        self.master_ip = None
+        self.master = None
+        self.workers = {}
+        self.lock = threading.Lock()
+        # Resolved by the master thread
+        self.cache_ip = Future()
+        self.join_command = Future()
+        self.master_executor = ThreadPoolExecutor(max_workers=1)
+        self.install_executor = ThreadPoolExecutor(max_workers=max(1, parallel))
+        self.join_executor = ThreadPoolExecutor(max_workers=max(1, parallel))
+        if cache is None:
+            self.cache_ip.set_result(None)
+
+    def add(self, instance, data):
+        """Start the deployment of one node of the inventory (`data`, possibly partial)"""
+        ip = instance["InstanceIp"]
+        self.ssh_key = data["KeyPairPath"]
+        self.allowed_cidr = vpc_cidr(data)
+        if instance.get("Role") == "master":
+            self.master_ip = ip
+            self.master = self.master_executor.submit(traced, self._master, ip, instance)
+            return
+        install = self.install_executor.submit(traced, self._install, ip, instance)
+        with self.lock:
+            self.workers[ip] = install
+
+    def _wait_ssh(self, ip):
+        wait_for(f"SSH {ip}", all_ssh_reachable([ip], self.port), timeout=300, host=ip)
+
+    def _master(self, ip, instance):
+        try:
+            self._wait_ssh(ip)
+            if self.cache:
+                self.cache_ip.set_result(traced(setup_cache, ip, self.port, self.user, self.ssh_key, self.allowed_cidr, self.verbose, self.batch))
+            steps = node_install_steps(instance, self.cache_ip.result())
+            traced(install_kubernetes, ip, self.port, self.user, self.ssh_key, self.verbose, self.batch, steps)
+            master = traced(setup_master, ip, self.port, self.user, self.ssh_key, self.verbose)
+            self.join_command.set_result(master["join_command"])
+        except Exception as e:
+            # The workers waiting for the cache or the master fail instead of waiting forever
+            for future in (self.cache_ip, self.join_command):
+                if not future.done():
+                    future.set_exception(e)
+            raise
+
+    def _install(self, ip, instance):
+        """Install the node, then queue its join: returns the Future of the join"""
+        self._wait_ssh(ip)
+        steps = node_install_steps(instance, self.cache_ip.result())
+        install_kubernetes(ip, self.port, self.user, self.ssh_key, self.verbose, self.batch, steps)
+        return self.join_executor.submit(traced, self._join, ip)
+
+    def _join(self, ip):
+        setup_worker(ip, self.port, self.user, self.ssh_key, self.join_command.result(), self.verbose)
+
+    def finish(self, timeout=600):
+        """
+        Wait until every added node is deployed and Ready.
+
+        Returns a dict {"install_failures": {ip: exception}, "join_failures": {ip: exception}}
+        """
+        try:
+            if self.master_ip is None:
+                error = Exception("Pipelined deployment: no master was added, aborting")
+                for future in (self.cache_ip, self.join_command):
+                    if not future.done():
+                        future.set_exception(error)
+                raise error
+            try:
+                self.master.result()
+            except Exception as e:
+                raise Exception(f"Master {self.master_ip} installation failed, aborting") from e
+
+            install_failures = {}
+            join_failures = {}
+            for ip, install in self.workers.items():
+                try:
+                    join = install.result()
+                except Exception as e:
+                    install_failures[ip] = e
+                    log(ip, f"FAILED : {e}")
+                    continue
+                try:
+                    join.result()
+                except Exception as e:
+                    join_failures[ip] = e
+                    log(ip, f"FAILED : {e}")
+            workers_ip = list(self.workers)
+            print_summary("Kubernetes installation", [self.master_ip] + workers_ip, install_failures)
+            joined_ip = [ip for ip in workers_ip if ip not in install_failures]
+            print_summary("Setup workers", joined_ip, join_failures)
+
+            # Wait until the master and every joined worker are Ready, then get nodes
+            nodes_count = 1 + len(joined_ip) - len(join_failures)
+            wait_for(f"{nodes_count} node(s) Ready", nodes_ready(pool.get(self.master_ip, self.port, self.user, self.ssh_key), nodes_count), timeout=timeout, host=self.master_ip)
+            get_nodes(self.master_ip, self.port, self.user, self.ssh_key)
+            return {
+                "install_failures": install_failures,
+                "join_failures": join_failures
+            }
+        finally:
+            for executor in (self.master_executor, self.install_executor, self.join_executor):
+                executor.shutdown(wait=True, cancel_futures=True)
 
 
 if __name__ == '__main__':
     # Arg parser
     parser = argparse.ArgumentParser()
     parser.add_argument("-v", "--verbose", help="increase output verbosity", action="count")
-    verbose = parser.parse_args().verbose
-    
+    parser.add_argument("-b", "--batch", help="run each node's installation steps as one uploaded script", action="store_true")
+    parser.add_argument("-c", "--cache", help="host the apt cache and registry mirror used by all nodes on 'master' or on this instance IP (excluded from the cluster)")
+    parser.add_argument("-t", "--timeout", type=int, default=600, help="maximum wait (s) for all the nodes to be Ready")
+    parser.add_argument("-p", "--parallel", type=int, default=1, help="number of nodes installed/joined at the same time")
+    args = parser.parse_args()
+
     # Setup vars
-    with open(f"{os.path.dirname(__file__)}/../01-deploy-aws-infra/inventory.json", 'r') as file:
+    _INVENTORY_PATH = f"{os.path.dirname(__file__)}/../01-deploy-aws-infra/inventory.json"
+    with open(_INVENTORY_PATH, 'r') as file:
         _DATA = json.load(file)
-    _SSH_KEY = _DATA["KeyPairPath"]
-    _PORT = 22
-    _USER = "ubuntu"
-    _MASTER_IP = _DATA["Instances"][0]["InstanceIp"]
-    _WORKERS_IP = [i["InstanceIp"] for i in _DATA["Instances"][1:]]
-    try:
-        # Install kubernetes
-        install_kubernetes(_MASTER_IP, _PORT, _USER, _SSH_KEY, verbose)
-        for ip in _WORKERS_IP:
-            install_kubernetes(ip, _PORT, _USER, _SSH_KEY, verbose)
-
-        # Setup master
-        master = setup_master(_MASTER_IP, _PORT, _USER, _SSH_KEY, verbose)
 
-        # Setup workers
-        for ip in _WORKERS_IP:
-            setup_worker(ip, _PORT, _USER, _SSH_KEY, master["join_command"], verbose)
-
-        # Get nodes
-        print("Waiting 30 secondes... (to be sure that all nodes are ready)")
-        time.sleep(30)
-        get_nodes(_MASTER_IP, _PORT, _USER, _SSH_KEY)
+    tracer.stage = "02-install-kubernetes"
+    try:
+        with tracer.span(tracer.stage, category="stage"):
+            deploy(_DATA, args.verbose, args.batch, args.parallel, args.cache, args.timeout)
 
     except Exception as e:
         print(e)
+    finally:
+        # Roles set by deploy() (dedicated cache host)
+        with open(_INVENTORY_PATH, 'w') as file:
+            json.dump(_DATA, file)
+        pool.close_all()
+        tracer.finish()
@@ -0,0 +1,175 @@
+import json
+import os
+import re
+import time
+
+from common import Output
+from common.Inventory import worker_instances
+from common.Remote import log, probe_cmd, run_cmd
+
+# vCPU and memory (MiB) of the instance types, used when Kubernetes doesn't
+# report the node capacity
+INSTANCE_RESOURCES = {
+    "t2.micro": (1, 1024),
+    "t2.medium": (2, 4096),
+    "t3.medium": (2, 4096),
+    "t3.large": (2, 8192),
+    "t3.xlarge": (4, 16384),
+    "m5.large": (2, 8192),
+    "m5.xlarge": (4, 16384),
+    "m5.2xlarge": (8, 32768),
+    "c5.xlarge": (4, 8192),
+    "r5.large": (2, 16384),
+}
+DEFAULT_INSTANCE_TYPE = "t3.medium"
+
+_MEMORY_UNITS = {"": 1 / 2**20, "k": 1e3 / 2**20, "M": 1e6 / 2**20, "G": 1e9 / 2**20, "Ki": 1 / 2**10, "Mi": 1, "Gi": 2**10, "Ti": 2**20}
+
+def parse_cpu(quantity):
+    """Kubernetes CPU quantity ("2", "1900m") to cores"""
+    if quantity.endswith("m"):
+        return int(quantity[:-1]) / 1000
+    return float(quantity)
+
+def parse_memory(quantity):
+    """Kubernetes memory quantity ("3914284Ki", "4Gi", bytes) to MiB"""
+    number, unit = re.fullmatch(r"([0-9.]+)([a-zA-Z]*)", quantity).groups()
+    return int(float(number) * _MEMORY_UNITS[unit])
+
+def cluster_nodes(client, data=None):
+    """
+    Allocatable resources of the nodes running Spark workers (every node but
+    the control plane), from Kubernetes, or from the instance types of the
+    inventory if Kubernetes doesn't answer.
+
+    Returns a list of dict {"name", "cores", "memory_mb"}
+    """
+    nodes = []
+    exit_status, output = probe_cmd(client, "kubectl get nodes -o json")
+    if exit_status == 0:
+        for item in json.loads(output)["items"]:
+            labels = item["metadata"].get("labels", {})
+            if "node-role.kubernetes.io/control-plane" in labels or "node-role.kubernetes.io/master" in labels:
+                continue
+            allocatable = item["status"]["allocatable"]
+            nodes.append({
+                "name": item["metadata"]["name"],
+                "cores": parse_cpu(allocatable["cpu"]),
+                "memory_mb": parse_memory(allocatable["memory"]),
+            })
+    if not nodes and data is not None:
+        for instance in worker_instances(data):
+            cores, memory_mb = INSTANCE_RESOURCES.get(instance.get("InstanceType"), INSTANCE_RESOURCES[DEFAULT_INSTANCE_TYPE])
+            nodes.append({"name": instance["InstanceIp"], "cores": cores, "memory_mb": memory_mb})
+    return nodes
+
+def worker_resources(node, workers_per_node=1, reserved_cores=1, reserved_memory_mb=1024):
+    """
+    Cores and memory (MiB) offered by each of the `workers_per_node` Spark
+    workers of a node. `reserved_cores` and `reserved_memory_mb` are left to
+    the OS, kubelet and Spark worker daemon.
+    """
+    cores = max(1, int(node["cores"] - reserved_cores) // workers_per_node)
+    memory_mb = max(512, int(node["memory_mb"] - reserved_memory_mb) // workers_per_node)
+    return cores, memory_mb
+
+def executor_config(nodes, max_executor_cores=5, reserved_cores=1, reserved_memory_mb=1024, memory_overhead=0.1, tasks_per_core=2, workers_per_node=1):
+    """
+    Size the executors to the cluster (standalone cluster manager).
+
+    Executors get at most `max_executor_cores` cores (more hurts HDFS/S3
+    client throughput and GC), the same size on every node so that they fit
+    the Spark workers (see `worker_resources()`), and their heap
+    leaves `memory_overhead` of the memory to off-heap allocations.
+
+    Returns a dict of Spark properties
+    """
+    if not nodes:
+        raise Exception("No node to run Spark executors")
+    # Every Spark worker has the size of the smallest one (see SparkValues.worker_values())
+    cores, memory = min(worker_resources(n, workers_per_node, reserved_cores, reserved_memory_mb) for n in nodes)
+    executor_cores = min(max_executor_cores, cores)
+    executors = cores // executor_cores
+    executor_memory = max(512, int(memory // executors / (1 + memory_overhead)))
+    total_cores = len(nodes) * workers_per_node * executors * executor_cores
+    parallelism = total_cores * tasks_per_core
+    return {
+        "spark.executor.cores": executor_cores,
+        "spark.executor.memory": f"{executor_memory}m",
+        # Standalone mode: the executor count is spark.cores.max / spark.executor.cores
+        "spark.cores.max": total_cores,
+        "spark.default.parallelism": parallelism,
+        "spark.sql.shuffle.partitions": parallelism,
+    }
+
+def write_secret_properties(client, properties, cluster_name="spark-cluster", namespace="default"):
+    """
+    Write Spark properties (credentials) into a new private file of the first
+    Spark worker pod, through the channel stdin: unlike `--conf`, they don't
+    show up in the command line, the logs or the trace. Each call gets its own
+    file, so concurrent jobs don't overwrite each other's. Delete it with
+    `remove_secret_properties()` once the job is over.
+
+    Returns:
+        str: Path of the properties file in the pod, for `submit(properties_file=...)`
+    """
+    stdin, stdout, stderr = client.exec_command(
+        f"kubectl exec -i --namespace {namespace} {cluster_name}-worker-0 -- sh -c"
+        " 'umask 077 && path=$(mktemp /tmp/secret.XXXXXXXX) && cat > \"$path\" && echo \"$path\"'"
+    )
+    stdin.write("".join(f"{key} {value}\n" for key, value in properties.items()))
+    stdin.channel.shutdown_write()
+    path = stdout.read().decode().strip()
+    if stdout.channel.recv_exit_status() != 0 or not path:
+        raise Exception(f"Cannot write the secret properties in {cluster_name}-worker-0")
+    return path
+
+def remove_secret_properties(client, path, cluster_name="spark-cluster", namespace="default"):
+    """Delete a properties file written by `write_secret_properties()`, once the job is over"""
+    exit_status, _ = probe_cmd(client, f"kubectl exec --namespace {namespace} {cluster_name}-worker-0 -- rm -f {path}")
+    if exit_status != 0:
+        raise Exception(f"Cannot remove {path} from {cluster_name}-worker-0")
+
+def submit(client, ip, jar, main_class, args=(), conf=None, verbose=False, cluster_name="spark-cluster", namespace="default", properties_file=None):
+    """
+    spark-submit a job from inside the first Spark worker pod, against the
+    standalone master of the `cluster_name` Helm release.
+
+    The configuration and the runtime of the job are logged together, and
+    appended to `LOG_DIR/spark-jobs.jsonl`. Secrets go in `properties_file`
+    (see `write_secret_properties()`), never in `conf`.
+
+    Returns:
+        float: Runtime of the job, in seconds
+    """
+    conf = dict(conf or {})
+    cmd = (
+        f"kubectl exec -ti --namespace {namespace} {cluster_name}-worker-0 -- spark-submit"
+        f" --master spark://{cluster_name}-master-svc:7077 --class {main_class}"
+        + (f" --properties-file {properties_file}" if properties_file else "")
+        + "".join(f" --conf {key}={value}" for key, value in conf.items())
+        + f" {jar}" + "".join(f" {arg}" for arg in args)
+    )
+    start = time.monotonic()
+    status = "error"
+    try:
+        run_cmd(client, ip, cmd, verbose)
+        status = "ok"
+    finally:
+        runtime = time.monotonic() - start
+        sizing = ", ".join(f"{key}={conf[key]}" for key in conf if key in (
+            "spark.executor.cores", "spark.executor.memory", "spark.cores.max", "spark.default.parallelism"
+        ))
+        log(ip, f"{main_class} {status} in {runtime:.1f}s ({sizing})")
+        os.makedirs(Output.LOG_DIR, exist_ok=True)
+        with open(os.path.join(Output.LOG_DIR, "spark-jobs.jsonl"), "a") as file:
+            file.write(json.dumps({
+                "time": time.time(),
+                "main_class": main_class,
+                "jar": jar,
+                "args": list(args),
+                "conf": conf,
+                "status": status,
+                "runtime_s": round(runtime, 3),
+            }) + "\n")
+    return runtime
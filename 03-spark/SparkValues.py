@@ -0,0 +1,67 @@
+import json
+
+from common.Remote import probe_cmd, run_steps
+from SparkSubmit import worker_resources
+from Storage import storage_values
+
+WORKERS_PER_NODE_ANNOTATION = "projet-cloud/workers-per-node"
+
+def worker_values(nodes, workers_per_node=1, reserved_cores=1, reserved_memory_mb=1024):
+    """
+    Helm values of the Spark workers: `workers_per_node` workers on every
+    node, each offering its share of the smallest node (the chart has one
+    worker spec for every replica).
+    """
+    if not nodes:
+        raise Exception("No node to run Spark workers")
+    cores, memory_mb = min(worker_resources(n, workers_per_node, reserved_cores, reserved_memory_mb) for n in nodes)
+    return {
+        "replicaCount": len(nodes) * workers_per_node,
+        # SPARK_WORKER_CORES / SPARK_WORKER_MEMORY, offered to the executors
+        "coreLimit": cores,
+        "memoryLimit": f"{memory_mb}m",
+        # Requests only: the scheduler places the pods, no limit kills a JVM over its heap
+        "resources": {"requests": {"cpu": str(cores), "memory": f"{memory_mb}Mi"}},
+        # One worker per node ("hard"), or spread them as much as possible
+        "podAntiAffinityPreset": "hard" if workers_per_node == 1 else "soft",
+        # Read back by deployed_workers_per_node(), whatever the nodes became since
+        "podAnnotations": {WORKERS_PER_NODE_ANNOTATION: str(workers_per_node)},
+    }
+
+def spark_values(nodes, workers_per_node=1):
+    """Helm values of the bitnami/spark chart for the nodes of the cluster (see `cluster_nodes()`)"""
+    values = storage_values()
+    values["worker"].update(worker_values(nodes, workers_per_node))
+    return values
+
+def deployed_workers_per_node(client, nodes, cluster_name="spark-cluster"):
+    """
+    Spark workers per node of the installed cluster, read back from the
+    values of its Helm release: the recorded setting, else the replicas over
+    `nodes` for releases deployed before it was recorded (1 if it can't be read)
+    """
+    exit_status, output = probe_cmd(client, f"helm get values {cluster_name} -o json")
+    if exit_status != 0:
+        return 1
+    worker = (json.loads(output or "{}") or {}).get("worker", {})
+    recorded = worker.get("podAnnotations", {}).get(WORKERS_PER_NODE_ANNOTATION)
+    if recorded:
+        return int(recorded)
+    replicas = worker.get("replicaCount")
+    return max(1, replicas // len(nodes)) if replicas and nodes else 1
+
+def deploy_spark(client, ip, nodes, cluster_name="spark-cluster", workers_per_node=1, verbose=False, batch=False, values_path="spark-values.yaml"):
+    """
+    Install the Spark cluster, or upgrade it to the current nodes (new
+    replicas, new sizes), with values generated from the nodes
+    """
+    values = spark_values(nodes, workers_per_node)
+    run_steps(client, ip, [
+        # Add binami spark chart
+        "helm repo add bitnami https://charts.bitnami.com/bitnami",
+        # Values of the chart (JSON is valid YAML)
+        f"cat > {values_path} <<'EOF'\n{json.dumps(values, indent=2)}\nEOF",
+        # Create the spark cluster, or upgrade it
+        f"helm upgrade --install {cluster_name} bitnami/spark -f {values_path}",
+    ], verbose, batch)
+    return values
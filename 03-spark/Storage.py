@@ -0,0 +1,62 @@
+from common.Remote import Step
+
+# Node-local input datasets (ingest_input.py), same path on the nodes and in the Spark worker pods
+LOCAL_INPUT_DIR = "/data/input"
+# Shared volume (PVC impvc, NFS export of the master): jar, event logs, results
+SHARED_DIR = "/opt/bitnami/spark/tmp"
+# Node-local scratch (emptyDir, on the node disk): shuffle files and spills
+SCRATCH_DIR = "/opt/bitnami/spark/local"
+NFS_EXPORT = "/srv/spark-shared"
+PVC_NAME = "impvc"
+
+def nfs_server_steps(allowed_cidr):
+    """
+    NFS server of the shared volume, on the master, exported to the nodes of
+    the VPC only (root squashed)
+    """
+    export = f"{NFS_EXPORT} {allowed_cidr}(rw,sync,no_subtree_check)"
+    return [
+        Step("sudo apt-get update && sudo apt-get install -y nfs-kernel-server"),
+        # Written by the Spark pods (uid 1001)
+        Step(f"sudo mkdir -p {NFS_EXPORT} && sudo chmod 1777 {NFS_EXPORT}"),
+        # Replaces the export line of a previous run
+        Step(f"grep -qx '{export}' /etc/exports || (sudo sed -i '\\#^{NFS_EXPORT} #d' /etc/exports && echo '{export}' | sudo tee -a /etc/exports)"),
+        Step("sudo exportfs -ra && sudo systemctl enable --now nfs-kernel-server"),
+    ]
+
+# NFS client, needed by the kubelet of every node mounting the shared volume
+NFS_CLIENT_STEPS = [
+    Step("dpkg -s nfs-common > /dev/null 2>&1 || (sudo apt-get update && sudo apt-get install -y nfs-common)"),
+]
+
+def storage_values():
+    """
+    Helm values of the bitnami/spark chart mounting the storage in the worker
+    pods (the driver runs in spark-cluster-worker-0 too)
+    """
+    return {
+        "worker": {
+            "extraVolumes": [
+                {"name": "input", "hostPath": {"path": LOCAL_INPUT_DIR, "type": "DirectoryOrCreate"}},
+                {"name": "scratch", "emptyDir": {}},
+                {"name": "shared", "persistentVolumeClaim": {"claimName": PVC_NAME}},
+            ],
+            "extraVolumeMounts": [
+                {"name": "input", "mountPath": LOCAL_INPUT_DIR},
+                {"name": "scratch", "mountPath": SCRATCH_DIR},
+                {"name": "shared", "mountPath": SHARED_DIR},
+            ],
+            # Local dirs of the executors, set by the standalone worker
+            "extraEnvVars": [
+                {"name": "SPARK_LOCAL_DIRS", "value": SCRATCH_DIR},
+            ],
+        }
+    }
+
+def storage_conf():
+    """Spark properties of a job using the storage: driver scratch and event logs"""
+    return {
+        "spark.local.dir": SCRATCH_DIR,
+        "spark.eventLog.enabled": "true",
+        "spark.eventLog.dir": f"file://{SHARED_DIR}/events",
+    }
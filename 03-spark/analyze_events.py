@@ -0,0 +1,214 @@
+import argparse
+import gzip
+import json
+import os
+import shlex
+import statistics
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.SSHPool import pool
+from common.Remote import log, read_cmd
+from common.Output import print_block
+from common.Trace import tracer
+from common.Inventory import master_instance
+from fetch_result import LOCAL_RESULT_DIR, fetch_part
+from Storage import SHARED_DIR
+
+EVENTS_DIR = f"{SHARED_DIR}/events"
+LOCAL_EVENTS_DIR = os.path.join(LOCAL_RESULT_DIR, "events")
+
+# Spark properties worth showing when two runs are compared
+_CONF_PREFIXES = ("spark.executor.", "spark.cores.", "spark.default.", "spark.sql.shuffle.", "spark.serializer", "spark.local.dir", "spark.memory.")
+
+def list_event_logs(client, ip, pod, remote_dir=EVENTS_DIR, namespace="default"):
+    """Names of the complete event logs in the pod (running applications are still named .inprogress)"""
+    output = read_cmd(client, ip, f"kubectl exec --namespace {namespace} {pod} -- sh -c {shlex.quote(f'cd {remote_dir} && ls')}")
+    return [name for name in output.split() if not name.endswith(".inprogress")]
+
+def fetch_event_logs(client, ip, pod, local_dir=LOCAL_EVENTS_DIR, remote_dir=EVENTS_DIR, namespace="default"):
+    """
+    Fetch the event logs not fetched yet (a complete event log doesn't change).
+
+    Returns the list of local paths of every event log, in name (time) order
+    """
+    os.makedirs(local_dir, exist_ok=True)
+    paths = []
+    for name in sorted(list_event_logs(client, ip, pod, remote_dir, namespace)):
+        local_path = os.path.join(local_dir, name if name.endswith(".gz") else name + ".gz")
+        if not os.path.exists(local_path):
+            fetch_part(client, ip, pod, name, local_dir, remote_dir, namespace)
+        paths.append(local_path)
+    log(ip, f"{len(paths)} event log(s) in {local_dir}")
+    return paths
+
+def read_events(path):
+    """Events of an event log one by one, decompressed on the fly"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+def _new_stage(stage_id, name=""):
+    return {
+        "id": stage_id, "name": name, "attempts": 0, "duration_ms": 0,
+        "tasks": [], "failed_tasks": 0, "run_ms": 0, "gc_ms": 0,
+        "input_bytes": 0, "shuffle_read_bytes": 0, "shuffle_fetch_wait_ms": 0,
+        "shuffle_write_bytes": 0, "memory_spill_bytes": 0, "disk_spill_bytes": 0,
+    }
+
+def analyze(path):
+    """
+    Aggregate an event log in one pass: per stage (all attempts together),
+    the task durations and the sums of the task metrics.
+
+    Returns a dict {"app_id", "app_name", "duration_ms", "conf", "stages"}
+    """
+    report = {"app_id": None, "app_name": None, "duration_ms": None, "conf": {}, "stages": {}}
+    stages = report["stages"]
+    start = None
+    for event in read_events(path):
+        kind = event.get("Event")
+        if kind == "SparkListenerApplicationStart":
+            report["app_id"] = event.get("App ID")
+            report["app_name"] = event.get("App Name")
+            start = event.get("Timestamp")
+        elif kind == "SparkListenerApplicationEnd" and start is not None:
+            report["duration_ms"] = event["Timestamp"] - start
+        elif kind == "SparkListenerEnvironmentUpdate":
+            report["conf"] = {key: value for key, value in event.get("Spark Properties", {}).items() if key.startswith(_CONF_PREFIXES)}
+        elif kind == "SparkListenerStageCompleted":
+            info = event["Stage Info"]
+            stage = stages.setdefault(info["Stage ID"], _new_stage(info["Stage ID"]))
+            stage["name"] = info.get("Stage Name", "")
+            stage["attempts"] += 1
+            if info.get("Submission Time") and info.get("Completion Time"):
+                stage["duration_ms"] += info["Completion Time"] - info["Submission Time"]
+        elif kind == "SparkListenerTaskEnd":
+            stage = stages.setdefault(event["Stage ID"], _new_stage(event["Stage ID"]))
+            info = event["Task Info"]
+            if info.get("Failed") or info.get("Killed"):
+                stage["failed_tasks"] += 1
+                continue
+            stage["tasks"].append(info["Finish Time"] - info["Launch Time"])
+            metrics = event.get("Task Metrics") or {}
+            shuffle_read = metrics.get("Shuffle Read Metrics", {})
+            stage["run_ms"] += metrics.get("Executor Run Time", 0)
+            stage["gc_ms"] += metrics.get("JVM GC Time", 0)
+            stage["input_bytes"] += metrics.get("Input Metrics", {}).get("Bytes Read", 0)
+            stage["shuffle_read_bytes"] += shuffle_read.get("Remote Bytes Read", 0) + shuffle_read.get("Local Bytes Read", 0)
+            stage["shuffle_fetch_wait_ms"] += shuffle_read.get("Fetch Wait Time", 0)
+            stage["shuffle_write_bytes"] += metrics.get("Shuffle Write Metrics", {}).get("Shuffle Bytes Written", 0)
+            stage["memory_spill_bytes"] += metrics.get("Memory Bytes Spilled", 0)
+            stage["disk_spill_bytes"] += metrics.get("Disk Bytes Spilled", 0)
+
+    # Task durations -> distribution, the list is no longer needed
+    for stage in stages.values():
+        tasks = stage.pop("tasks")
+        stage["task_count"] = len(tasks)
+        stage["task_median_ms"] = statistics.median(tasks) if tasks else 0
+        stage["task_max_ms"] = max(tasks, default=0)
+        stage["skew"] = stage["task_max_ms"] / stage["task_median_ms"] if stage["task_median_ms"] else 1.0
+    report["stages"] = [stages[key] for key in sorted(stages)]
+    return report
+
+def _mib(size):
+    return f"{size / 2**20:.1f}M"
+
+def _gc(stage):
+    return f"{100 * stage['gc_ms'] / stage['run_ms']:.0f}%" if stage["run_ms"] else "-"
+
+def print_report(report, skew_threshold=2.0):
+    """Per-stage table; stages whose slowest task takes `skew_threshold` times the median are flagged"""
+    lines = [f"=== {report['app_name']} ({report['app_id']}) : {(report['duration_ms'] or 0) / 1000:.1f}s ==="]
+    lines.append(f"  {'stage':>5} {'tasks':>6} {'time':>8} {'median':>8} {'max':>8} {'skew':>6} {'GC':>4} {'input':>9} {'sh.read':>9} {'sh.write':>9} {'spill':>9}  name")
+    for stage in report["stages"]:
+        flag = " <- skew" if stage["skew"] >= skew_threshold and stage["task_count"] > 1 else ""
+        failed = f" ({stage['failed_tasks']} failed)" if stage["failed_tasks"] else ""
+        lines.append(
+            f"  {stage['id']:>5} {stage['task_count']:>6} {stage['duration_ms'] / 1000:>7.1f}s"
+            f" {stage['task_median_ms'] / 1000:>7.2f}s {stage['task_max_ms'] / 1000:>7.2f}s {stage['skew']:>5.1f}x {_gc(stage):>4}"
+            f" {_mib(stage['input_bytes']):>9} {_mib(stage['shuffle_read_bytes']):>9} {_mib(stage['shuffle_write_bytes']):>9}"
+            f" {_mib(stage['disk_spill_bytes']):>9}  {stage['name'][:40]}{failed}{flag}"
+        )
+    print_block(lines)
+
+def print_comparison(before, after):
+    """Stage by stage differences of two runs of the same job, and of their sizing"""
+    def delta(old, new):
+        return f"{(new - old) / old * 100:+.0f}%" if old else "-"
+
+    lines = [f"=== {before['app_id']} -> {after['app_id']} ==="]
+    old_total, new_total = before["duration_ms"] or 0, after["duration_ms"] or 0
+    lines.append(f"  total : {old_total / 1000:.1f}s -> {new_total / 1000:.1f}s ({delta(old_total, new_total)})")
+    for key in sorted(set(before["conf"]) | set(after["conf"])):
+        if before["conf"].get(key) != after["conf"].get(key):
+            lines.append(f"  {key} : {before['conf'].get(key)} -> {after['conf'].get(key)}")
+    # Same job: stages are matched by id, the name is checked
+    old_stages = {stage["id"]: stage for stage in before["stages"]}
+    for stage in after["stages"]:
+        old = old_stages.get(stage["id"])
+        if old is None or old["name"] != stage["name"]:
+            lines.append(f"  stage {stage['id']} : no match ({stage['name'][:40]})")
+            continue
+        lines.append(
+            f"  stage {stage['id']} : {old['duration_ms'] / 1000:.1f}s -> {stage['duration_ms'] / 1000:.1f}s ({delta(old['duration_ms'], stage['duration_ms'])}),"
+            f" skew {old['skew']:.1f}x -> {stage['skew']:.1f}x, GC {_gc(old)} -> {_gc(stage)},"
+            f" spill {_mib(old['disk_spill_bytes'])} -> {_mib(stage['disk_spill_bytes'])}"
+        )
+    print_block(lines)
+
+def find_event_log(name, local_dir=LOCAL_EVENTS_DIR):
+    """Local path of an event log, given as a path or an application id"""
+    if os.path.exists(name):
+        return name
+    for candidate in (name, name + ".gz"):
+        if os.path.exists(os.path.join(local_dir, candidate)):
+            return os.path.join(local_dir, candidate)
+    raise Exception(f"No event log {name} in {local_dir}")
+
+
+if __name__ == '__main__':
+    # Arg parser
+    parser = argparse.ArgumentParser(description="Per-stage report of Spark event logs, or comparison of two runs")
+    parser.add_argument("apps", nargs="*", help="Event logs (path or application id), default: the last one. Two: compare them")
+    parser.add_argument("--no_fetch", action="store_true", help="Use the event logs already fetched")
+    parser.add_argument("--skew", type=float, default=2.0, help="Flag the stages whose slowest task takes SKEW times the median")
+    parser.add_argument("--json", help="Also write the report(s) into this file")
+    args = parser.parse_args()
+
+    tracer.stage = "analyze-events"
+    try:
+        with tracer.span(tracer.stage, category="stage"):
+            paths = []
+            if not args.no_fetch:
+                # Setup vars
+                with open(f"{os.path.dirname(__file__)}/../01-deploy-aws-infra/inventory.json", 'r') as file:
+                    _DATA = json.load(file)
+                _MASTER_IP = master_instance(_DATA)["InstanceIp"]
+                client = pool.get(_MASTER_IP, 22, "ubuntu", _DATA["KeyPairPath"])
+                paths = fetch_event_logs(client, _MASTER_IP, "spark-cluster-worker-0")
+            elif os.path.isdir(LOCAL_EVENTS_DIR):
+                paths = sorted(os.path.join(LOCAL_EVENTS_DIR, name) for name in os.listdir(LOCAL_EVENTS_DIR))
+            if args.apps:
+                paths = [find_event_log(app) for app in args.apps]
+            elif paths:
+                paths = paths[-1:]
+            else:
+                raise Exception("No event log")
+
+            reports = [analyze(path) for path in paths]
+            for report in reports:
+                print_report(report, args.skew)
+            if len(reports) == 2:
+                print_comparison(*reports)
+            if args.json:
+                with open(args.json, "w") as file:
+                    json.dump(reports, file, indent=2)
+
+    except Exception as e:
+        print(e)
+    finally:
+        pool.close_all()
+        tracer.finish()
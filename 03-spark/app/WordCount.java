@@ -1,34 +1,197 @@
 package wc;
 
-import java.util.Arrays;
+import java.io.Serializable;
+import java.util.ArrayList;
+import java.util.Collections;
+import java.util.Comparator;
+import java.util.HashMap;
+import java.util.Iterator;
+import java.util.List;
+import java.util.Map;
+import java.util.regex.Pattern;
+
+import org.apache.hadoop.fs.FileSystem;
+import org.apache.hadoop.fs.Path;
+import org.apache.hadoop.io.compress.BZip2Codec;
+import org.apache.hadoop.io.compress.CompressionCodec;
+import org.apache.hadoop.io.compress.GzipCodec;
 import org.apache.spark.SparkConf;
 import org.apache.spark.api.java.JavaPairRDD;
 import org.apache.spark.api.java.JavaRDD;
 import org.apache.spark.api.java.JavaSparkContext;
+import org.apache.spark.executor.TaskMetrics;
+import org.apache.spark.scheduler.SparkListener;
+import org.apache.spark.scheduler.SparkListenerStageCompleted;
+import org.apache.spark.scheduler.StageInfo;
+import org.apache.spark.sql.Row;
+import org.apache.spark.sql.RowFactory;
+import org.apache.spark.sql.SaveMode;
+import org.apache.spark.sql.SparkSession;
+import org.apache.spark.sql.types.DataTypes;
+import org.apache.spark.sql.types.StructType;
 import scala.Tuple2;
 
+/**
+ * WordCount input [--output path] [--partitions n] [--top k]
+ *                 [--format text|parquet|orc] [--compression codec] [--overwrite]
+ *
+ * Words are counted per partition before the shuffle, so only one record per
+ * distinct word and partition is shuffled. With --top, only the k most frequent
+ * words are brought back and written, not the whole vocabulary.
+ */
 public class WordCount {
-	public static void main(String[] args) {
-	    String filename = args[0];
-		String inputFile = filename;
+	private static final Pattern WHITESPACE = Pattern.compile("\\s+");
+
+	/** Ascending count, then descending word: top() returns the most frequent words first, ties in alphabetical order */
+	static class ByCount implements Comparator<Tuple2<String, Long>>, Serializable {
+		@Override
+		public int compare(Tuple2<String, Long> a, Tuple2<String, Long> b) {
+			int byCount = Long.compare(a._2(), b._2());
+			return byCount != 0 ? byCount : b._1().compareTo(a._1());
+		}
+	}
+
+	/** Duration, input and shuffle volumes of every completed stage */
+	static class StageTimings extends SparkListener {
+		final List<String> lines = Collections.synchronizedList(new ArrayList<>());
+
+		@Override
+		public void onStageCompleted(SparkListenerStageCompleted event) {
+			StageInfo info = event.stageInfo();
+			TaskMetrics metrics = info.taskMetrics();
+			long duration = (Long) info.completionTime().get() - (Long) info.submissionTime().get();
+			lines.add(String.format("stage %d %-30s %8d ms  input %d B  shuffle read %d B  shuffle write %d B",
+				info.stageId(), info.name(), duration,
+				metrics.inputMetrics().bytesRead(),
+				metrics.shuffleReadMetrics().totalBytesRead(),
+				metrics.shuffleWriteMetrics().bytesWritten()));
+		}
+	}
+
+	/** Word counts of one partition, without a Tuple2 per word */
+	static Iterator<Tuple2<String, Long>> countPartition(Iterator<String> lines) {
+		Map<String, long[]> counts = new HashMap<>();
+		while (lines.hasNext()) {
+			for (String word : WHITESPACE.split(lines.next())) {
+				if (word.isEmpty()) {
+					continue;
+				}
+				long[] count = counts.get(word);
+				if (count == null) {
+					counts.put(word, new long[] {1});
+				} else {
+					count[0]++;
+				}
+			}
+		}
+		List<Tuple2<String, Long>> result = new ArrayList<>(counts.size());
+		for (Map.Entry<String, long[]> entry : counts.entrySet()) {
+			result.add(new Tuple2<>(entry.getKey(), entry.getValue()[0]));
+		}
+		return result.iterator();
+	}
+
+	static void write(SparkSession spark, JavaPairRDD<String, Long> counts, String output, String format, String compression, boolean overwrite) throws Exception {
+		if (format.equals("text")) {
+			if (overwrite) {
+				Path path = new Path(output);
+				FileSystem fs = path.getFileSystem(spark.sparkContext().hadoopConfiguration());
+				fs.delete(path, true);
+			}
+			JavaRDD<String> lines = counts.map(t -> t._1() + "\t" + t._2());
+			Class<? extends CompressionCodec> codec = null;
+			if (compression.equals("gzip")) {
+				codec = GzipCodec.class;
+			} else if (compression.equals("bzip2")) {
+				codec = BZip2Codec.class;
+			}
+			if (codec == null) {
+				lines.saveAsTextFile(output);
+			} else {
+				lines.saveAsTextFile(output, codec);
+			}
+			return;
+		}
+		StructType schema = new StructType()
+			.add("word", DataTypes.StringType, false)
+			.add("count", DataTypes.LongType, false);
+		JavaRDD<Row> rows = counts.map(t -> RowFactory.create(t._1(), t._2()));
+		spark.createDataFrame(rows, schema)
+			.write()
+			.mode(overwrite ? SaveMode.Overwrite : SaveMode.ErrorIfExists)
+			.option("compression", compression)
+			.format(format)
+			.save(output);
+	}
+
+	public static void main(String[] args) throws Exception {
+		String inputFile = args[0];
 		String outputFile = "/opt/bitnami/spark/tmp/result";
-		SparkConf conf = new SparkConf().setAppName("WordCount");
-		try (JavaSparkContext sc = new JavaSparkContext(conf)) {
+		int partitions = 0;
+		int top = 0;
+		String format = "text";
+		String compression = null;
+		boolean overwrite = false;
+		for (int i = 1; i < args.length; i++) {
+			switch (args[i]) {
+				case "--output": outputFile = args[++i]; break;
+				case "--partitions": partitions = Integer.parseInt(args[++i]); break;
+				case "--top": top = Integer.parseInt(args[++i]); break;
+				case "--format": format = args[++i]; break;
+				case "--compression": compression = args[++i]; break;
+				case "--overwrite": overwrite = true; break;
+				default: throw new IllegalArgumentException("Unknown option " + args[i]);
+			}
+		}
+		if (compression == null) {
+			compression = format.equals("text") ? "none" : "snappy";
+		}
+
+		long t0 = System.currentTimeMillis();
+		SparkConf conf = new SparkConf().setAppName("WordCount")
+			.set("spark.serializer", "org.apache.spark.serializer.KryoSerializer")
+			.registerKryoClasses(new Class<?>[] {Tuple2.class, long[].class});
+		StageTimings timings = new StageTimings();
+		List<String> phases = new ArrayList<>();
+		SparkSession spark = SparkSession.builder().config(conf).getOrCreate();
+		// Closing the context waits for the listener to receive every stage
+		try (JavaSparkContext sc = JavaSparkContext.fromSparkContext(spark.sparkContext())) {
+			sc.sc().addSparkListener(timings);
+			if (partitions <= 0) {
+				partitions = sc.defaultParallelism();
+			}
 			long t1 = System.currentTimeMillis();
+			phases.add("startup in ms : " + (t1 - t0));
+
+			JavaPairRDD<String, Long> counts =
+					sc.textFile(inputFile, partitions)
+						.mapPartitionsToPair(lines -> countPartition(lines))
+						.reduceByKey((c1, c2) -> c1 + c2, partitions);
+
+			if (top > 0) {
+				List<Tuple2<String, Long>> topWords = counts.top(top, new ByCount());
+				long t2 = System.currentTimeMillis();
+				phases.add("count in ms : " + (t2 - t1));
+				for (Tuple2<String, Long> word : topWords) {
+					System.out.println(word._1() + "\t" + word._2());
+				}
+				write(spark, sc.parallelizePairs(topWords, 1), outputFile, format, compression, overwrite);
+				phases.add("write in ms : " + (System.currentTimeMillis() - t2));
+			} else {
+				// Counting is lazy: it runs with the write, see the stage timings
+				write(spark, counts, outputFile, format, compression, overwrite);
+				phases.add("count + write in ms : " + (System.currentTimeMillis() - t1));
+			}
+			phases.add("time in ms :" + (System.currentTimeMillis() - t1));
+		}
 
-			JavaRDD<String> data =
-					sc.textFile(inputFile)
-						.flatMap(s -> Arrays.asList(s.split(" "))
-						.iterator());
-			
-			JavaPairRDD<String, Integer> counts =
-					data.mapToPair(w -> new Tuple2<String, Integer>(w,1))
-						.reduceByKey((c1,c2) -> c1 + c2); //add func
-			counts.saveAsTextFile(outputFile);
-
-			long t2 = System.currentTimeMillis();
-			System.out.println("======================");
-			System.out.println("time in ms :"+(t2-t1));
+		System.out.println("======================");
+		System.out.println("partitions : " + partitions + ", format : " + format + ", compression : " + compression + (top > 0 ? ", top " + top : ""));
+		for (String line : phases) {
+			System.out.println(line);
+		}
+		for (String line : timings.lines) {
+			System.out.println(line);
 		}
 		System.out.println("======================");
 	}
@@ -0,0 +1,160 @@
+import argparse
+import gzip
+import heapq
+import json
+import os
+import re
+import shlex
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.SSHPool import pool
+from common.Remote import log, read_cmd
+from common.Output import print_block
+from common.Trace import tracer
+from common.Inventory import master_instance
+
+RESULT_DIR = "/opt/bitnami/spark/tmp/result"
+LOCAL_RESULT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "results"))
+
+# "word\tcount" lines of the WordCount text output
+_COUNT_LINE = re.compile(r"^(.*)\t(\d+)$")
+
+def list_parts(client, ip, pod, remote_dir=RESULT_DIR, namespace="default"):
+    """Names of the part-* files of a Spark output directory in the pod"""
+    output = read_cmd(client, ip, f"kubectl exec --namespace {namespace} {pod} -- sh -c {shlex.quote(f'cd {remote_dir} && ls part-*')}")
+    return [name for name in output.split() if name.startswith("part-")]
+
+def fetch_part(client, ip, pod, name, local_dir, remote_dir=RESULT_DIR, namespace="default", chunk_size=65536):
+    """
+    Stream one part file from the pod to `local_dir/<name>.gz`, compressed by
+    gzip in the pod (files already gzipped are sent as is). Data goes from the
+    channel to the disk chunk by chunk.
+
+    Returns:
+        str: Local path
+    """
+    remote_path = f"{remote_dir}/{name}"
+    compressed = name.endswith(".gz")
+    local_path = os.path.join(local_dir, name if compressed else name + ".gz")
+    reader = "cat" if compressed else "gzip -1 -c"
+    with tracer.span(f"fetch {name}", host=ip, category="transfer") as span:
+        # No tty (-t): it would alter the binary stream
+        stdin, stdout, stderr = client.exec_command(f"kubectl exec --namespace {namespace} {pod} -- {reader} {shlex.quote(remote_path)}")
+        channel = stdout.channel
+        size = 0
+        with open(local_path + ".part", "wb") as file:
+            while True:
+                data = channel.recv(chunk_size)
+                if not data:
+                    break
+                file.write(data)
+                size += len(data)
+        exit_status = channel.recv_exit_status()
+        span["bytes"] = size
+        span["exit_status"] = exit_status
+        if exit_status != 0:
+            os.remove(local_path + ".part")
+            raise Exception(f"[{exit_status}] Error : fetch {remote_path}")
+    os.replace(local_path + ".part", local_path)
+    return local_path
+
+def fetch_result(client, ip, pod, local_dir=LOCAL_RESULT_DIR, remote_dir=RESULT_DIR, parallel=4, namespace="default"):
+    """
+    Fetch every part-* file of a Spark output directory, `parallel` at a time.
+
+    Returns the list of local paths, in part order
+    """
+    names = list_parts(client, ip, pod, remote_dir, namespace)
+    os.makedirs(local_dir, exist_ok=True)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        paths = list(executor.map(lambda name: fetch_part(client, ip, pod, name, local_dir, remote_dir, namespace), names))
+    size = sum(os.path.getsize(path) for path in paths)
+    log(ip, f"{len(paths)} part(s) fetched into {local_dir} : {size / 2**20:.1f} MiB compressed in {time.monotonic() - start:.1f}s")
+    return paths
+
+def text_parts(paths):
+    """Fetched parts of a text output (not parquet/orc)"""
+    return [path for path in paths if not re.search(r"\.(parquet|orc)(\.gz)?$", path)]
+
+def read_lines(paths):
+    """Lines of the fetched part files, one after the other, decompressed on the fly"""
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            for line in file:
+                yield line.rstrip("\n")
+
+def merge(paths, output):
+    """Concatenate the part files into one (uncompressed) file, by chunks"""
+    with open(output, "wb") as merged:
+        for path in paths:
+            with gzip.open(path, "rb") as file:
+                while True:
+                    data = file.read(1 << 20)
+                    if not data:
+                        break
+                    merged.write(data)
+    return output
+
+def top_words(paths, n):
+    """
+    The `n` most frequent words of word count part files, in one pass with a
+    heap of `n` entries.
+
+    Returns a list of (word, count), most frequent first
+    """
+    heap = []
+    for line in read_lines(paths):
+        match = _COUNT_LINE.match(line)
+        if match is None:
+            continue
+        word = match.group(1)
+        count = int(match.group(2))
+        if len(heap) < n:
+            heapq.heappush(heap, (count, word))
+        elif (count, word) > heap[0]:
+            heapq.heapreplace(heap, (count, word))
+    return [(word, count) for count, word in sorted(heap, reverse=True)]
+
+def print_top(words):
+    print_block([f"=== Top {len(words)} ==="] + [f"  {count:>10}  {word}" for word, count in words])
+
+
+if __name__ == '__main__':
+    # Arg parser
+    parser = argparse.ArgumentParser(description="Fetch every partition of a Spark result, then merge them or keep the top words")
+    parser.add_argument("-r", "--remote_dir", default=RESULT_DIR, help="Output directory of the job, in the Spark worker pod")
+    parser.add_argument("-o", "--output", default=LOCAL_RESULT_DIR, help="Local directory of the fetched parts")
+    parser.add_argument("-m", "--merge", help="Merge all the parts into this local file")
+    parser.add_argument("-n", "--top", type=int, default=20, help="Print the N most frequent words (0: don't)")
+    parser.add_argument("-p", "--parallel", type=int, default=4, help="Parts fetched at the same time")
+    args = parser.parse_args()
+
+    # Setup vars
+    with open(f"{os.path.dirname(__file__)}/../01-deploy-aws-infra/inventory.json", 'r') as file:
+        _DATA = json.load(file)
+    _SSH_KEY = _DATA["KeyPairPath"]
+    _PORT = 22
+    _USER = "ubuntu"
+    _MASTER_IP = master_instance(_DATA)["InstanceIp"]
+    tracer.stage = "fetch-result"
+    try:
+        with tracer.span(tracer.stage, category="stage"):
+            client = pool.get(_MASTER_IP, _PORT, _USER, _SSH_KEY)
+            paths = fetch_result(client, _MASTER_IP, "spark-cluster-worker-0", args.output, args.remote_dir, args.parallel)
+            if len(text_parts(paths)) < len(paths):
+                print(f"Columnar output, fetched into {args.output} without merge")
+            else:
+                if args.merge:
+                    print(f"Result : {merge(paths, args.merge)}")
+                if args.top:
+                    print_top(top_words(paths, args.top))
+
+    except Exception as e:
+        print(e)
+    finally:
+        pool.close_all()
+        tracer.finish()
@@ -0,0 +1,255 @@
+import argparse
+import hashlib
+import json
+import os
+import posixpath
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01-deploy-aws-infra"))
+from common.SSHPool import pool
+from common.Remote import log, probe_cmd, run_cmd
+from common.Artifacts import remote_sha256
+from common.Trace import tracer
+from common.Inventory import master_instance, worker_instances
+from SparkSubmit import cluster_nodes, executor_config, submit, write_secret_properties, remove_secret_properties
+from SparkValues import deployed_workers_per_node
+from Storage import LOCAL_INPUT_DIR, storage_conf
+
+_CHUNK_SIZE = 128 * 1024 * 1024
+
+class FileRange:
+    """
+    Read-only file object over the bytes [start, end) of a file. The sha256
+    of what was read is computed on the way, so a chunk is read only once.
+    """
+    def __init__(self, path, start, end):
+        self.file = open(path, "rb")
+        self.file.seek(start)
+        self.remaining = end - start
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        self.sha256.update(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def split_chunks(source, chunk_size=_CHUNK_SIZE):
+    """
+    Split a file, or every file of a directory, into chunks of about
+    `chunk_size` bytes cut on line boundaries (a word is never split in two).
+    Nothing is copied: a chunk is a byte range of its file.
+
+    Returns a list of dict {"name", "path", "start", "end", "mtime"}
+    """
+    if os.path.isfile(source):
+        base, files = os.path.dirname(source), [source]
+    else:
+        base = source
+        files = sorted(os.path.join(root, f) for root, _, names in os.walk(source) for f in names)
+    chunks = []
+    for path in files:
+        prefix = os.path.relpath(path, base).replace(os.sep, "__")
+        size = os.path.getsize(path)
+        mtime = int(os.path.getmtime(path))
+        start = 0
+        index = 0
+        with open(path, "rb") as file:
+            while start < size:
+                end = min(start + chunk_size, size)
+                if end < size:
+                    file.seek(end)
+                    file.readline()
+                    end = file.tell()
+                chunks.append({"name": f"{prefix}.part-{index:05d}", "path": path, "start": start, "end": end, "mtime": mtime})
+                start = end
+                index += 1
+    return chunks
+
+class S3Target:
+    """Chunks uploaded as objects of `s3://bucket/prefix/`, in multipart"""
+    def __init__(self, session, bucket, prefix, max_concurrency=4):
+        self.session = session
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.max_concurrency = max_concurrency
+        self.name = f"s3://{bucket}"
+
+    def prepare(self):
+        self.session.create_bucket(self.bucket)
+
+    def spark_path(self):
+        return f"s3a://{self.bucket}/{self.prefix}/"
+
+    def done(self, chunk):
+        # Resume : same byte range of the same version of the source file
+        head = self.session.find_s3_object(self.bucket, f"{self.prefix}/{chunk['name']}")
+        return head is not None and head["Metadata"].get("source") == _source_id(chunk)
+
+    def upload(self, chunk):
+        with FileRange(chunk["path"], chunk["start"], chunk["end"]) as data:
+            self.session.upload_fileobj_to_s3(data, self.bucket, f"{self.prefix}/{chunk['name']}",
+                metadata={"source": _source_id(chunk)}, max_concurrency=self.max_concurrency)
+
+class NodeTarget:
+    """
+    Chunks copied over SFTP into `LOCAL_INPUT_DIR/<dataset>` of one node,
+    mounted in the Spark worker pods (see install_spark_launch_wc.py). Every
+    executor reads `file://` paths locally: each worker gets the whole dataset.
+    """
+    def __init__(self, ip, port, user, ssh_key, dataset):
+        self.ip = ip
+        self.connection = (ip, port, user, ssh_key)
+        self.user = user
+        self.directory = posixpath.join(LOCAL_INPUT_DIR, dataset)
+        self.name = ip
+        self.present = {}
+
+    def prepare(self):
+        client = pool.get(*self.connection)
+        run_cmd(client, self.ip, f"sudo mkdir -p {self.directory} && sudo chown -R {self.user} {self.directory}")
+        # Complete chunks only: an interrupted upload is still named .part
+        _, output = probe_cmd(client, f"find {self.directory} -maxdepth 1 -type f ! -name '*.part' -printf '%f %s\\n'")
+        self.present = {name: int(size) for name, size in (line.split() for line in output.splitlines() if line.strip())}
+
+    def spark_path(self):
+        return f"file://{self.directory}/"
+
+    def done(self, chunk):
+        return self.present.get(chunk["name"]) == chunk["end"] - chunk["start"]
+
+    def upload(self, chunk):
+        client = pool.get(*self.connection)
+        path = posixpath.join(self.directory, chunk["name"])
+        sftp = client.open_sftp()
+        try:
+            with FileRange(chunk["path"], chunk["start"], chunk["end"]) as data:
+                sftp.putfo(data, path + ".part", file_size=chunk["end"] - chunk["start"])
+                digest = data.sha256.hexdigest()
+            if remote_sha256(client, [path + ".part"]).get(path + ".part") != digest:
+                raise Exception(f"Checksum mismatch after upload : {path}")
+            sftp.posix_rename(path + ".part", path)
+        finally:
+            sftp.close()
+
+def _source_id(chunk):
+    return f"{chunk['mtime']}:{chunk['start']}-{chunk['end']}"
+
+def ingest(source, targets, chunk_size=_CHUNK_SIZE, parallel=8):
+    """
+    Upload the chunks of `source` to every target, `parallel` chunks at a time.
+    Chunks already uploaded by a previous (interrupted) run are skipped.
+
+    Returns a dict {"chunks", "uploaded", "skipped", "bytes", "seconds"}
+    """
+    chunks = split_chunks(source, chunk_size)
+    for target in targets:
+        target.prepare()
+
+    def upload(target, chunk):
+        if target.done(chunk):
+            return None
+        size = chunk["end"] - chunk["start"]
+        with tracer.span(f"upload {chunk['name']}", host=target.name, category="transfer", bytes=size):
+            start = time.monotonic()
+            target.upload(chunk)
+            log(target.name, f"{chunk['name']} : {size / 2**20:.0f} MiB in {time.monotonic() - start:.1f}s")
+        return size
+
+    start = time.monotonic()
+    total = uploaded = skipped = 0
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = [executor.submit(upload, target, chunk) for target in targets for chunk in chunks]
+        for future in as_completed(futures):
+            size = future.result()
+            if size is None:
+                skipped += 1
+            else:
+                uploaded += 1
+                total += size
+    seconds = time.monotonic() - start
+    print(f"=== Ingestion : {uploaded} chunk(s) uploaded, {skipped} already there, {total / 2**20:.0f} MiB in {seconds:.1f}s ({total / 2**20 / max(seconds, 1e-3):.1f} MiB/s) ===")
+    return {"chunks": len(chunks), "uploaded": uploaded, "skipped": skipped, "bytes": total, "seconds": seconds}
+
+
+if __name__ == '__main__':
+    # Arg parser
+    parser = argparse.ArgumentParser(description="Upload an input dataset in chunks, then run WordCount on it")
+    parser.add_argument("source", help="Local file or directory")
+    parser.add_argument("-t", "--target", choices=["s3", "local"], default="local", help="S3 bucket, or local storage of every worker node")
+    parser.add_argument("--bucket", help="S3 bucket (target s3)")
+    parser.add_argument("-d", "--dataset", help="Name of the dataset (default: name of the source)")
+    parser.add_argument("--chunk_size", type=int, default=_CHUNK_SIZE // 2**20, help="Chunk size (MiB)")
+    parser.add_argument("-p", "--parallel", type=int, default=8, help="Chunks uploaded at the same time")
+    parser.add_argument("--no_submit", action="store_true", help="Upload only, don't run WordCount")
+    parser.add_argument("-w", "--workers_per_node", type=int, help="Spark workers per Kubernetes worker node (default: read from the Helm release)")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity", action="count")
+    args = parser.parse_args()
+
+    # Setup vars
+    with open(f"{os.path.dirname(__file__)}/../01-deploy-aws-infra/inventory.json", 'r') as file:
+        _DATA = json.load(file)
+    _SSH_KEY = _DATA["KeyPairPath"]
+    _PORT = 22
+    _USER = "ubuntu"
+    _MASTER_IP = master_instance(_DATA)["InstanceIp"]
+    dataset = args.dataset or os.path.basename(os.path.normpath(args.source))
+    tracer.stage = "ingest-input"
+    try:
+        with tracer.span(tracer.stage, category="stage"):
+            secrets = {}
+            if args.target == "s3":
+                from dotenv import load_dotenv
+                from utils.AWSSession import AWSSession
+                load_dotenv()
+                if not args.bucket:
+                    raise Exception("--bucket is required with --target s3")
+                session = AWSSession(os.environ['AWS_ACCESS_KEY_ID'], os.environ['AWS_SECRET_ACCESS_KEY'],
+                    max_pool_connections=args.parallel * 4, tracer=tracer)
+                targets = [S3Target(session, args.bucket, dataset)]
+                secrets = {
+                    "spark.hadoop.fs.s3a.access.key": os.environ['AWS_ACCESS_KEY_ID'],
+                    "spark.hadoop.fs.s3a.secret.key": os.environ['AWS_SECRET_ACCESS_KEY'],
+                    "spark.hadoop.fs.s3a.endpoint": f"s3.{session.session.region_name}.amazonaws.com",
+                }
+            else:
+                targets = [NodeTarget(i["InstanceIp"], _PORT, _USER, _SSH_KEY, dataset) for i in worker_instances(_DATA)]
+            ingest(args.source, targets, args.chunk_size * 2**20, args.parallel)
+            path = targets[0].spark_path()
+            print(f"Input : {path}")
+
+            if not args.no_submit:
+                client = pool.get(_MASTER_IP, _PORT, _USER, _SSH_KEY)
+                nodes = cluster_nodes(client, _DATA)
+                workers_per_node = args.workers_per_node or deployed_workers_per_node(client, nodes)
+                conf = dict(executor_config(nodes, workers_per_node=workers_per_node), **storage_conf())
+                properties_file = write_secret_properties(client, secrets) if secrets else None
+                try:
+                    submit(client, _MASTER_IP, "tmp/wc.jar", "wc.WordCount", [path, "--overwrite"], conf, args.verbose, properties_file=properties_file)
+                finally:
+                    # The credentials don't outlive the job in the pod; a failed removal doesn't hide the job error
+                    if properties_file:
+                        try:
+                            remove_secret_properties(client, properties_file)
+                        except Exception as e:
+                            log(_MASTER_IP, f"WARNING : {e}")
+
+    except Exception as e:
+        print(e)
+    finally:
+        pool.close_all()
+        tracer.finish()
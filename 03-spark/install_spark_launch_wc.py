@@ -1,224 +1,147 @@
 import argparse
+import importlib.util
 import json
 import os
-import time
-import re
-
-import paramiko
-from termcolor import colored
-
-def install_spark(ip, port, user, ssh_key, verbose=False):
+import subprocess
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.SSHPool import pool
+from common.Remote import banner, read_cmd, run_steps, run_on_hosts, print_summary
+from common.Readiness import wait_for, pods_running, pvc_bound
+from common.Trace import tracer
+from common.Inventory import master_instance, worker_instances, vpc_cidr
+from common.Artifacts import upload_artifacts
+from fetch_result import RESULT_DIR, fetch_result, top_words, print_top
+from SparkSubmit import cluster_nodes, executor_config, submit
+from SparkValues import deploy_spark
+from Storage import NFS_CLIENT_STEPS, PVC_NAME, SHARED_DIR, nfs_server_steps, storage_conf
+
+def setup_storage(ip, port, user, ssh_key, verbose=False, batch=False, data=None, artifacts_dir="projet-cloud-artifacts"):
+    """
+    Shared volume of the Spark pods: NFS export on the master, NFS client on
+    every worker, then the PV/PVC impvc bound to the export.
+    """
+    # Banner
+    banner(ip, "Spark storage")
+
+    client = pool.get(ip, port, user, ssh_key)
+    run_steps(client, ip, nfs_server_steps(vpc_cidr(data or {})), verbose, batch)
+
+    def setup_nfs_client(worker_ip):
+        run_steps(pool.get(worker_ip, port, user, ssh_key), worker_ip, NFS_CLIENT_STEPS, verbose, batch)
+    workers_ip = [i["InstanceIp"] for i in worker_instances(data)] if data is not None else []
+    _, failures = run_on_hosts(setup_nfs_client, workers_ip, len(workers_ip))
+    print_summary("NFS client", workers_ip, failures)
+
+    # The nodes reach the master on its private IP
+    server_ip = read_cmd(client, ip, "hostname -I | awk '{print $1}'").strip()
+    run_steps(client, ip, [
+        # Create a pv
+        "sed 's/NFS_SERVER/" + server_ip + "/' " + artifacts_dir + "/impvc0.yaml | kubectl apply -f - -n default",
+        # Create a pvc
+        "kubectl apply -f " + artifacts_dir + "/impvc1.yaml -n default",
+    ], verbose, batch)
+
+    # verify bound status between the pv & pvc
+    try:
+        wait_for("PVC impvc Bound", pvc_bound(client, PVC_NAME), timeout=60, host=ip)
+    except TimeoutError:
+        print("\n Sorry, pvc or pv not bounded \n")
+
+def spark_jars_dir():
+    """
+    Class path of the WordCount build: $SPARK_JARS, or the jars of the
+    installed pyspark (same Spark version as the cluster image)
+    """
+    jars = os.getenv("SPARK_JARS")
+    if not jars:
+        spec = importlib.util.find_spec("pyspark")
+        jars = os.path.join(os.path.dirname(spec.origin), "jars") if spec and spec.origin else None
+    if not jars or not os.path.isdir(jars):
+        raise Exception("Spark jars not found: install pyspark==3.3.1 or set SPARK_JARS")
+    return jars
+
+def build_wordcount(app_dir, source="WordCount.java", jar="wc.jar"):
+    """
+    Build wc.jar locally from WordCount.java, before it is uploaded with the
+    other artifacts. Skipped while the jar is newer than the source.
+
+    Returns the path of the jar
+    """
+    source_path, jar_path = os.path.join(app_dir, source), os.path.join(app_dir, jar)
+    if os.path.exists(jar_path) and os.path.getmtime(jar_path) >= os.path.getmtime(source_path):
+        return jar_path
+    with tempfile.TemporaryDirectory() as classes:
+        subprocess.run(["javac", "--release", "8", "-cp", os.path.join(spark_jars_dir(), "*"), "-d", classes, source_path], check=True)
+        # Written aside then renamed: no half-written jar is ever uploaded
+        subprocess.run(["jar", "cf", jar_path + ".part", "-C", classes, "."], check=True)
+    os.replace(jar_path + ".part", jar_path)
+    return jar_path
+
+def install_spark(ip, port, user, ssh_key, verbose=False, batch=False, data=None, workers_per_node=1):
     # Variables
     _SPARK_CLUSTER_NAME = "spark-cluster"
     _MYAPP = "wc.jar"
+    _MYAPP_SOURCE = "WordCount.java"
     _EXAMPLE_JAR = "examples/jars/spark-examples_2.12-3.3.1.jar"
+    _APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")
+    _ARTIFACTS_DIR = "projet-cloud-artifacts"
 
     # Banner
-    print("########################################################################")
-    print(f"### {ip} : Helm Spark Bitnami installations + Wordcount launch \t###")
-    print("########################################################################")
-
-    # Connect to instance (master) using paramiko
-    client = paramiko.SSHClient()
-    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(ip, port, user, key_filename=ssh_key)
-    
-    # Add binami spark chart
-    cmd = "helm repo add bitnami https://charts.bitnami.com/bitnami"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    # Create a spark cluster using spark charts 
-    cmd = "helm install "+ _SPARK_CLUSTER_NAME + " bitnami/spark"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-     
+    banner(ip, "Helm Spark Bitnami installations + Wordcount launch")
+
+    # Connect to instance (master), reusing the pooled connection
+    client = pool.get(ip, port, user, ssh_key)
+
+    # WordCount application, built from the current source, and the manifests, checked by sha256 (skipped if unchanged)
+    jar_path = build_wordcount(_APP_DIR, _MYAPP_SOURCE, _MYAPP)
+    artifacts = upload_artifacts(client, ip, [jar_path] + [os.path.join(_APP_DIR, f) for f in ("impvc0.yaml", "impvc1.yaml")], _ARTIFACTS_DIR)
+
+    # Shared volume, before the pods which mount it
+    setup_storage(ip, port, user, ssh_key, verbose, batch, data, _ARTIFACTS_DIR)
+
+    # Spark workers on every node, sized to their allocatable resources
+    nodes = cluster_nodes(client, data)
+    deploy_spark(client, ip, nodes, _SPARK_CLUSTER_NAME, workers_per_node, verbose, batch)
+
     # wait for the pods to start running
-    cmd = "sleep 30"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-            
-    # Test example 
-    cmd = "kubectl exec -ti --namespace default " + _SPARK_CLUSTER_NAME +"-worker-0 -- " + "spark-submit --master spark://" + _SPARK_CLUSTER_NAME + "-master-svc:7077  --class org.apache.spark.examples.SparkPi " + _EXAMPLE_JAR + " 2"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    # Download the WordCount application
-    cmd =  "git clone https://github.com/out3/projet-cloud.git"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    # Install jdk
-    cmd =  "sudo apt-get -y install default-jdk"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    # Make sure WordCount application is not corrupt
-    cmd =  "jar tf "+ "./projet-cloud/03-spark/app/"+ _MYAPP
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-            print(output[1].read().decode())
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-    
-    # Copy WordCount application into pod 
-    cmd =  "kubectl cp ./projet-cloud/03-spark/app/"+ _MYAPP +" default/"+ _SPARK_CLUSTER_NAME + "-worker-0:/opt/bitnami/spark/tmp/"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-            print(output[1].read().decode())
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    # Create a pv
-    cmd =  "kubectl apply -f ./projet-cloud/03-spark/app/impvc0.yaml -n default"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    #Create a pvc
-    cmd =  "kubectl apply -f ./projet-cloud/03-spark/app/impvc1.yaml -n default"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    #verify bound status between the pv & pvc
-    cmd =  "kubectl get pvc | grep 'impvc' | tr -cs '[:alnum:]' '\n' | grep 'Bound'"
-    output = client.exec_command(cmd)
-    if verbose:
-        print(cmd)
-        if re.search("Bound", output[1].read().decode()) != None:
-            print("OK, pvc  bounded")
-        else:
-            print("\n Sorry, pvc or pv not bounded \n")
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    #Launch the WordCount application via spark-submit
-    cmd =  "kubectl exec -ti --namespace default " +_SPARK_CLUSTER_NAME+"-worker-0 -- spark-submit --master spark://" + _SPARK_CLUSTER_NAME + "-master-svc:7077 --class wc.WordCount --conf spark.eventLog.enabled=true --conf spark.eventLog.dir=/opt/bitnami/spark/tmp --conf spark.kubernetes.driver.volumes.persistentVolumeClaim.impvc.options.claimName=impvc --conf spark.kubernetes.driver.volumes.persistentVolumeClaim.impvc.mount.path=/opt/bitnami/spark/tmp --conf spark.kubernetes.executor.volumes.persistentVolumeClaim.impvc.options.claimName=impvc --conf spark.kubernetes.executor.volumes.persistentVolumeClaim.impvc.mount.path=/opt/bitnami/spark/tmp" + " tmp/"+_MYAPP + " /opt/bitnami/spark/NOTICE"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-    
-    # Find result in stored in pod
-    cmd =  "kubectl exec -ti --namespace default " + _SPARK_CLUSTER_NAME + "-worker-0 -- ls -l /opt/bitnami/spark/tmp/result"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
-
-    # Copy and read result
-    cmd =  "kubectl exec -ti --namespace default " + _SPARK_CLUSTER_NAME + "-worker-0 -- cat /opt/bitnami/spark/tmp/result/part-00000"
-    output = client.exec_command(cmd)
-    if verbose:
-        print_std(cmd, output, verbose)
-    else:
-        exit_status = output[1].channel.recv_exit_status()
-        if exit_status == 0:
-            print(cmd)
-        else:
-            raise Exception(f"[{exit_status}] Error : {cmd}")
+    wait_for("Spark pods running", pods_running(client, "app.kubernetes.io/instance=" + _SPARK_CLUSTER_NAME), timeout=600, host=ip)
+
+    # Executors sized to the nodes of the cluster, scratch and event logs on the storage
+    conf = dict(executor_config(nodes, workers_per_node=workers_per_node), **storage_conf())
+
+    run_steps(client, ip, [
+        # Event logs directory, on the shared volume
+        "kubectl exec --namespace default " + _SPARK_CLUSTER_NAME + "-worker-0 -- mkdir -p " + SHARED_DIR + "/events",
+        # Copy WordCount application into the shared volume, unless the same jar is already there
+        "kubectl exec --namespace default " + _SPARK_CLUSTER_NAME + "-worker-0 -- sha256sum " + SHARED_DIR + "/" + _MYAPP + " | grep -q " + artifacts[_ARTIFACTS_DIR + "/" + _MYAPP]
+            + " || kubectl cp " + _ARTIFACTS_DIR + "/" + _MYAPP + " default/" + _SPARK_CLUSTER_NAME + "-worker-0:" + SHARED_DIR + "/",
+    ], verbose, batch)
+
+    # Test example
+    submit(client, ip, _EXAMPLE_JAR, "org.apache.spark.examples.SparkPi", ["2"], conf, verbose, _SPARK_CLUSTER_NAME)
+
+    # Launch the WordCount application via spark-submit, the result written on the shared volume
+    submit(client, ip, "tmp/" + _MYAPP, "wc.WordCount", ["/opt/bitnami/spark/NOTICE", "--output", RESULT_DIR, "--overwrite"], conf, verbose, _SPARK_CLUSTER_NAME)
+
+    # Fetch every partition of the result (compressed, in parallel) and show the most frequent words
+    paths = fetch_result(client, ip, _SPARK_CLUSTER_NAME + "-worker-0")
+    print_top(top_words(paths, 20))
 
     print("The end")
-    
-    
-def print_std(command, output, verbose=1):
-    stdin, stdout, stderr = output
-    stdout = stdout.readlines()
-    stderr = stderr.readlines()
-
-    print(command)
-    [print(colored(i, 'green')) for i in stdout]
-    print()
-    
-    if verbose >= 2:
-        [print(colored(i, 'red')) for i in stderr]
-        print()
-        
+
 
 if __name__ == '__main__':
     # Arg parser
     parser = argparse.ArgumentParser()
     parser.add_argument("-v", "--verbose", help="Increase output verbosity", action="count")
-    verbose = parser.parse_args().verbose
+    parser.add_argument("-b", "--batch", help="Run the steps as one uploaded script", action="store_true")
+    parser.add_argument("-w", "--workers_per_node", type=int, default=1, help="Spark workers per Kubernetes worker node")
+    args = parser.parse_args()
+    verbose = args.verbose
+    batch = args.batch
     
     # Setup vars
     with open(f"{os.path.dirname(__file__)}/../01-deploy-aws-infra/inventory.json", 'r') as file:
@@ -226,10 +149,15 @@ if __name__ == '__main__':
     _SSH_KEY = _DATA["KeyPairPath"]
     _PORT = 22
     _USER = "ubuntu"
-    _MASTER_IP = _DATA["Instances"][0]["InstanceIp"]
+    _MASTER_IP = master_instance(_DATA)["InstanceIp"]
+    tracer.stage = "03-spark"
     try:
         # Install spark & execute word count
-        install_spark(_MASTER_IP, _PORT, _USER, _SSH_KEY, verbose)
+        with tracer.span(tracer.stage, category="stage"):
+            install_spark(_MASTER_IP, _PORT, _USER, _SSH_KEY, verbose, batch, _DATA, args.workers_per_node)
 
     except Exception as e:
         print(e)
+    finally:
+        pool.close_all()
+        tracer.finish()
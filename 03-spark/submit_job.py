@@ -0,0 +1,58 @@
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.SSHPool import pool
+from common.Remote import log
+from common.Trace import tracer
+from common.Inventory import master_instance
+from SparkSubmit import cluster_nodes, executor_config, submit
+from SparkValues import deployed_workers_per_node
+from Storage import storage_conf
+
+def spark_property(item):
+    """argparse type of --conf: KEY=VALUE -> (KEY, VALUE)"""
+    key, sep, value = item.partition("=")
+    if not sep or not key.strip():
+        raise argparse.ArgumentTypeError(f"expected KEY=VALUE, got {item!r}")
+    return key.strip(), value
+
+
+if __name__ == '__main__':
+    # Arg parser
+    parser = argparse.ArgumentParser(description="Submit a Spark job sized to the cluster of the inventory")
+    parser.add_argument("main_class", help="Main class of the job, e.g. wc.WordCount")
+    parser.add_argument("jar", help="Jar of the job, path inside the Spark worker pod, e.g. tmp/wc.jar")
+    parser.add_argument("args", nargs="*", help="Arguments of the job")
+    parser.add_argument("--conf", action="append", default=[], type=spark_property, metavar="KEY=VALUE", help="Extra Spark property, overrides the computed sizing")
+    parser.add_argument("--max_executor_cores", type=int, default=5, help="Maximum cores per executor")
+    parser.add_argument("-w", "--workers_per_node", type=int, help="Spark workers per Kubernetes worker node (default: read from the Helm release)")
+    parser.add_argument("-v", "--verbose", help="Increase output verbosity", action="count")
+    args = parser.parse_args()
+
+    # Setup vars
+    with open(f"{os.path.dirname(__file__)}/../01-deploy-aws-infra/inventory.json", 'r') as file:
+        _DATA = json.load(file)
+    _SSH_KEY = _DATA["KeyPairPath"]
+    _PORT = 22
+    _USER = "ubuntu"
+    _MASTER_IP = master_instance(_DATA)["InstanceIp"]
+    tracer.stage = "spark-job"
+    try:
+        with tracer.span(tracer.stage, category="stage"):
+            client = pool.get(_MASTER_IP, _PORT, _USER, _SSH_KEY)
+            # Executors sized to the cluster, scratch and event logs on the storage
+            nodes = cluster_nodes(client, _DATA)
+            workers_per_node = args.workers_per_node or deployed_workers_per_node(client, nodes)
+            conf = dict(executor_config(nodes, args.max_executor_cores, workers_per_node=workers_per_node), **storage_conf())
+            conf.update(args.conf)
+            log(_MASTER_IP, "Spark configuration : " + json.dumps(conf))
+            submit(client, _MASTER_IP, args.jar, args.main_class, args.args, conf, args.verbose)
+
+    except Exception as e:
+        print(e)
+    finally:
+        pool.close_all()
+        tracer.finish()
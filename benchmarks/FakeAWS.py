@@ -0,0 +1,210 @@
+import itertools
+import random
+import threading
+
+class FakeEC2:
+    """
+    Simulated EC2 region: state of the created resources and latency of every
+    API call, counted in `stats` as "aws:<Operation>".
+
+    Instances are "pending" for a random boot time, then "running" with a
+    public IP.
+    """
+    def __init__(self, clock, stats, api_latency=0.15, boot_time=(25, 60), seed=0):
+        self.clock = clock
+        self.stats = stats
+        self.api_latency = api_latency
+        self.boot_time = boot_time
+        self.random = random.Random(seed)
+        self.instances = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def call(self, operation):
+        self.stats.count(f"aws:{operation}")
+        self.clock.sleep(self.api_latency)
+
+    def new_id(self, prefix):
+        with self._lock:
+            return f"{prefix}-{next(self._ids):08x}"
+
+    def launch(self, image_id, count):
+        instances = []
+        with self._lock:
+            for _ in range(count):
+                number = next(self._ids)
+                instance = FakeInstance(
+                    f"i-{number:08x}",
+                    image_id,
+                    # Benchmark range (RFC 2544), never routed
+                    f"198.18.{number // 256 % 256}.{number % 256}",
+                    self.clock.monotonic() + self.random.uniform(*self.boot_time)
+                )
+                self.instances[instance.id] = instance
+                instances.append(instance)
+        return instances
+
+class FakeObject:
+    def __init__(self, ec2, id, **attributes):
+        self.ec2 = ec2
+        self.id = id
+        self.__dict__.update(attributes)
+
+class FakeInstance:
+    def __init__(self, id, image_id, public_ip, running_at):
+        self.id = id
+        self.image_id = image_id
+        self.public_ip = public_ip
+        self.running_at = running_at
+
+    def describe(self, now):
+        running = now >= self.running_at
+        description = {
+            "InstanceId": self.id,
+            "ImageId": self.image_id,
+            "State": {"Name": "running" if running else "pending"},
+        }
+        if running:
+            description["PublicIpAddress"] = self.public_ip
+        return description
+
+class FakeVpc(FakeObject):
+    def wait_until_available(self):
+        self.ec2.call("DescribeVpcs")
+        self.ec2.clock.sleep(2)
+
+    def attach_internet_gateway(self, InternetGatewayId):
+        self.ec2.call("AttachInternetGateway")
+
+class FakeInternetGateway(FakeObject):
+    attachments = []
+
+    def reload(self):
+        self.ec2.call("DescribeInternetGateways")
+
+class FakeSecurityGroup(FakeObject):
+    def authorize_ingress(self, **kwargs):
+        self.ec2.call("AuthorizeSecurityGroupIngress")
+
+class FakeRouteTable(FakeObject):
+    def create_tags(self, **kwargs):
+        self.ec2.call("CreateTags")
+
+class FakeCollection:
+    """Collection of a fresh account: every filter() finds nothing"""
+    def __init__(self, ec2, operation):
+        self.ec2 = ec2
+        self.operation = operation
+
+    def filter(self, **kwargs):
+        self.ec2.call(self.operation)
+        return []
+
+class FakeEC2Resource:
+    def __init__(self, ec2):
+        self.ec2 = ec2
+        self.vpcs = FakeCollection(ec2, "DescribeVpcs")
+        self.internet_gateways = FakeCollection(ec2, "DescribeInternetGateways")
+        self.subnets = FakeCollection(ec2, "DescribeSubnets")
+        self.security_groups = FakeCollection(ec2, "DescribeSecurityGroups")
+        self.key_pairs = FakeCollection(ec2, "DescribeKeyPairs")
+        self.instances = FakeCollection(ec2, "DescribeInstances")
+        self.images = FakeCollection(ec2, "DescribeImages")
+
+    def create_vpc(self, **kwargs):
+        self.ec2.call("CreateVpc")
+        return FakeVpc(self.ec2, self.ec2.new_id("vpc"))
+
+    def create_internet_gateway(self, **kwargs):
+        self.ec2.call("CreateInternetGateway")
+        return FakeInternetGateway(self.ec2, self.ec2.new_id("igw"))
+
+    def create_subnet(self, **kwargs):
+        self.ec2.call("CreateSubnet")
+        return FakeObject(self.ec2, self.ec2.new_id("subnet"))
+
+    def create_security_group(self, **kwargs):
+        self.ec2.call("CreateSecurityGroup")
+        return FakeSecurityGroup(self.ec2, self.ec2.new_id("sg"))
+
+    def create_key_pair(self, **kwargs):
+        self.ec2.call("CreateKeyPair")
+        return FakeObject(self.ec2, self.ec2.new_id("key"), key_material="FAKE KEY\n")
+
+    def RouteTable(self, id):
+        return FakeRouteTable(self.ec2, id)
+
+    def create_instances(self, ImageId, MinCount, MaxCount, **kwargs):
+        self.ec2.call("RunInstances")
+        return self.ec2.launch(ImageId, MaxCount)
+
+class FakeDescribeInstancesPaginator:
+    def __init__(self, ec2):
+        self.ec2 = ec2
+
+    def paginate(self, Filters=(), **kwargs):
+        ids = set()
+        for f in Filters:
+            if f["Name"] == "instance-id":
+                ids.update(f["Values"])
+        instances = [i for i in self.ec2.instances.values() if not ids or i.id in ids]
+        # 1000 instances per page, one API call per page
+        for start in range(0, max(len(instances), 1), 1000):
+            self.ec2.call("DescribeInstances")
+            now = self.ec2.clock.monotonic()
+            yield {"Reservations": [{"Instances": [i.describe(now) for i in instances[start:start + 1000]]}]}
+
+class FakeWaiter:
+    def __init__(self, ec2, operation):
+        self.ec2 = ec2
+        self.operation = operation
+
+    def wait(self, **kwargs):
+        self.ec2.call(self.operation)
+
+class FakeEC2Client:
+    def __init__(self, ec2):
+        self.ec2 = ec2
+
+    def modify_vpc_attribute(self, **kwargs):
+        self.ec2.call("ModifyVpcAttribute")
+
+    def modify_subnet_attribute(self, **kwargs):
+        self.ec2.call("ModifySubnetAttribute")
+
+    def describe_route_tables(self, **kwargs):
+        self.ec2.call("DescribeRouteTables")
+        return {"RouteTables": [{"RouteTableId": self.ec2.new_id("rtb"), "Routes": []}]}
+
+    def create_route(self, **kwargs):
+        self.ec2.call("CreateRoute")
+
+    def describe_instances(self, InstanceIds=(), **kwargs):
+        self.ec2.call("DescribeInstances")
+        now = self.ec2.clock.monotonic()
+        return {"Reservations": [{"Instances": [self.ec2.instances[i].describe(now) for i in InstanceIds]}]}
+
+    def terminate_instances(self, InstanceIds=(), **kwargs):
+        self.ec2.call("TerminateInstances")
+
+    def get_paginator(self, name):
+        return FakeDescribeInstancesPaginator(self.ec2)
+
+    def get_waiter(self, name):
+        return FakeWaiter(self.ec2, "Describe" + "".join(part.title() for part in name.split("_")[:1]) + "s")
+
+class FakeEvents:
+    def register(self, *args, **kwargs):
+        pass
+
+class FakeBoto3Session:
+    """Stand-in for the boto3 session of AWSSession (`AWSSession.session`)"""
+    def __init__(self, ec2):
+        self.ec2 = ec2
+        self.events = FakeEvents()
+
+    def client(self, service_name, config=None):
+        return FakeEC2Client(self.ec2)
+
+    def resource(self, service_name, config=None):
+        return FakeEC2Resource(self.ec2)
@@ -0,0 +1,215 @@
+import os
+import re
+import threading
+
+# Simulated duration (s) of the remote commands, first match wins
+COMMAND_LATENCY = [
+    (re.compile(r"get\.docker\.com"), 70),
+    (re.compile(r"apt-get install -y kubelet"), 45),
+    (re.compile(r"apt-get install -y apt-cacher-ng"), 35),
+    (re.compile(r"apt-get (update|install)"), 20),
+    (re.compile(r"kubeadm init"), 60),
+    (re.compile(r"kubeadm join"), 25),
+    (re.compile(r"get-helm-3"), 10),
+    (re.compile(r"kubectl apply"), 4),
+    (re.compile(r"systemctl restart"), 3),
+    (re.compile(r"kubeadm token create"), 1),
+    (re.compile(r"kubectl get"), 0.3),
+]
+DEFAULT_LATENCY = 0.5
+
+BATCH_STEP = re.compile(r"^_step_(\d+)\(\) \(\n(.*?)\n\)$(?=\n_step_\d+\(\) \(|\necho ')", re.S | re.M)
+BATCH_MARKER = re.compile(r"^echo '(\S+) 0 START'$", re.M)
+
+def command_latency(cmd):
+    for pattern, latency in COMMAND_LATENCY:
+        if pattern.search(cmd):
+            return latency
+    return DEFAULT_LATENCY
+
+class FakeCluster:
+    """
+    Simulated Kubernetes cluster shared by all the fake hosts: the master
+    after `kubeadm init`, the workers after `kubeadm join`, each one Ready some
+    time after.
+    """
+    def __init__(self, clock, master_ready_delay=30, worker_ready_delay=15):
+        self.clock = clock
+        self.master_ready_delay = master_ready_delay
+        self.worker_ready_delay = worker_ready_delay
+        self.nodes = {}
+        self._lock = threading.Lock()
+
+    def run(self, ip, cmd):
+        """Side effects and output of a command on the cluster"""
+        with self._lock:
+            if "kubeadm init" in cmd:
+                self.nodes[ip] = self.clock.monotonic() + self.master_ready_delay
+            elif "kubeadm join" in cmd:
+                self.nodes[ip] = self.clock.monotonic() + self.worker_ready_delay
+            elif "kubeadm token create" in cmd:
+                return f"kubeadm join {ip}:6443 --token abcdef.0123456789abcdef --discovery-token-ca-cert-hash sha256:00\n"
+            elif "kubectl get nodes" in cmd:
+                now = self.clock.monotonic()
+                return "".join(
+                    f"ip-{node.replace('.', '-')} {'Ready' if now >= ready_at else 'NotReady'} <none> 1m v1.24.0\n"
+                    for node, ready_at in self.nodes.items()
+                )
+        return ""
+
+class FakeChannel:
+    """
+    paramiko.Channel double: output is produced by a thread after the simulated
+    command duration. `fileno()` is a pipe written on every event, so
+    `select()` wakes up like on a real channel.
+    """
+    def __init__(self):
+        self.stdout = b""
+        self.stderr = b""
+        self.exit_status = None
+        self.stdin = []
+        self.stdin_closed = threading.Event()
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+        self._read_fd, self._write_fd = os.pipe()
+
+    def emit(self, stdout=b"", exit_status=None):
+        with self._lock:
+            self.stdout += stdout
+            if exit_status is not None:
+                self.exit_status = exit_status
+                self.done.set()
+            if self._write_fd is not None:
+                os.write(self._write_fd, b"x")
+
+    def fileno(self):
+        return self._read_fd
+
+    def recv_ready(self):
+        return bool(self.stdout)
+
+    def recv(self, size):
+        with self._lock:
+            data, self.stdout = self.stdout[:size], self.stdout[size:]
+            self._drain()
+            return data
+
+    def recv_stderr_ready(self):
+        return bool(self.stderr)
+
+    def recv_stderr(self, size):
+        with self._lock:
+            data, self.stderr = self.stderr[:size], self.stderr[size:]
+            return data
+
+    def exit_status_ready(self):
+        if self.exit_status is not None:
+            with self._lock:
+                self._drain()
+            return True
+        return False
+
+    def recv_exit_status(self):
+        self.done.wait()
+        with self._lock:
+            self._close()
+        return self.exit_status
+
+    def shutdown_write(self):
+        self.stdin_closed.set()
+
+    def _drain(self):
+        # Keep the pipe from filling, select() only needs the latest event
+        if self._read_fd is not None and not self.stdout:
+            os.set_blocking(self._read_fd, False)
+            try:
+                os.read(self._read_fd, 4096)
+            except BlockingIOError:
+                pass
+
+    def _close(self):
+        if self._read_fd is not None:
+            os.close(self._read_fd)
+            os.close(self._write_fd)
+            self._read_fd = self._write_fd = None
+
+class FakeFile:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def write(self, data):
+        self.channel.stdin.append(data)
+
+class FakeTransport:
+    def __init__(self, client):
+        self.client = client
+
+    def set_keepalive(self, interval):
+        pass
+
+    def is_active(self):
+        return self.client.connected
+
+    def send_ignore(self):
+        pass
+
+class FakeSSHClient:
+    """
+    paramiko.SSHClient double. `connect()` costs a handshake, every
+    `exec_command()` a round trip plus the simulated command duration, both
+    counted in `stats` ("ssh:handshake" / "ssh:exec").
+
+    Batch scripts (see `common.Remote.run_batch`) are parsed back into their
+    steps, which are simulated one after the other with their markers.
+    """
+    def __init__(self, cluster, clock, stats, handshake=0.6, round_trip=0.05):
+        self.cluster = cluster
+        self.clock = clock
+        self.stats = stats
+        self.handshake = handshake
+        self.round_trip = round_trip
+        self.ip = None
+        self.connected = False
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, hostname, port=22, username=None, key_filename=None, timeout=None, **kwargs):
+        self.stats.count("ssh:handshake")
+        self.clock.sleep(self.handshake)
+        self.ip = hostname
+        self.connected = True
+
+    def get_transport(self):
+        return FakeTransport(self)
+
+    def close(self):
+        self.connected = False
+
+    def exec_command(self, cmd):
+        self.stats.count("ssh:exec")
+        channel = FakeChannel()
+        if "cat > " in cmd and "bash " in cmd:
+            target = self._run_batch
+        else:
+            target = self._run
+        threading.Thread(target=target, args=(channel, cmd), daemon=True).start()
+        return FakeFile(channel), FakeFile(channel), FakeFile(channel)
+
+    def _run(self, channel, cmd):
+        self.clock.sleep(self.round_trip + command_latency(cmd))
+        channel.emit(self.cluster.run(self.ip, cmd).encode(), 0)
+
+    def _run_batch(self, channel, cmd):
+        channel.stdin_closed.wait()
+        script = "".join(channel.stdin)
+        marker = BATCH_MARKER.search(script).group(1)
+        self.clock.sleep(self.round_trip)
+        for match in BATCH_STEP.finditer(script):
+            index, step = match.group(1), match.group(2)
+            channel.emit(f"{marker} {index} START\n".encode())
+            latency = command_latency(step)
+            self.clock.sleep(latency)
+            output = self.cluster.run(self.ip, step)
+            channel.emit(f"{output}{marker} {index} END 0 {int(latency * 1000)}\n".encode())
+        channel.emit(exit_status=0)
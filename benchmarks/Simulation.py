@@ -0,0 +1,42 @@
+import threading
+import time
+from collections import Counter
+
+class ScaledClock:
+    """
+    Simulated clock: every simulated duration is multiplied by `scale` when
+    actually slept, so a 200 nodes deployment runs in seconds on a laptop.
+    `monotonic()` returns simulated seconds, it replaces the `time` module of
+    the code under test (timeouts and backoff delays stay in simulated seconds).
+    """
+    def __init__(self, scale=0.01):
+        self.scale = scale
+        self._origin = time.monotonic()
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds * self.scale)
+
+    def monotonic(self):
+        return (time.monotonic() - self._origin) / self.scale
+
+    def time(self):
+        return time.time()
+
+class Stats:
+    """Thread-safe counters of the simulated API calls and SSH round trips, per stage"""
+    def __init__(self):
+        self.stage = None
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+
+    def count(self, kind, n=1):
+        with self._lock:
+            self.counters.setdefault(self.stage, Counter())[kind] += n
+
+    def get(self, stage):
+        return self.counters.get(stage, Counter())
@@ -0,0 +1,160 @@
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+
+_ROOT = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(_ROOT)
+sys.path.append(os.path.join(_ROOT, "01-deploy-aws-infra"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import common.Output
+import common.Readiness
+from common.SSHPool import pool
+from common.Trace import tracer
+from Simulation import ScaledClock, Stats
+from FakeAWS import FakeEC2, FakeBoto3Session
+from FakeSSH import FakeCluster, FakeSSHClient
+
+_STAGES = ["01-deploy-aws-infra", "02-install-kubernetes"]
+_PIPELINE_STAGE = "01+02-pipeline"
+_METRICS = ["simulated_s", "aws_calls", "ssh_handshakes", "ssh_execs"]
+
+def load_module(name, path):
+    # The stage scripts live in directories which aren't packages
+    spec = importlib.util.spec_from_file_location(name, os.path.join(_ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+deploy_aws = load_module("deploy_aws_infra", "01-deploy-aws-infra/main.py")
+install_kubernetes = load_module("install_kubernetes", "02-install-kubernetes/main.py")
+aws_session = sys.modules["utils.AWSSession"]
+
+def run_pipeline(nb_nodes, clock, stats, work_dir, max_workers=4, parallel=10, batch=False, pipelined=False):
+    """
+    Run stage 01 and stage 02 against the simulated AWS region and hosts, one
+    after the other, or overlapped (`main.py --pipeline`) if `pipelined`.
+
+    Returns a dict {stage: {"wall_s", "simulated_s", "aws_calls", "ssh_handshakes", "ssh_execs"}}
+    """
+    stats.reset()
+    ec2 = FakeEC2(clock, stats)
+    cluster = FakeCluster(clock)
+    session = aws_session.AWSSession("benchmark", "benchmark")
+    session.session = FakeBoto3Session(ec2)
+    pool.client_factory = lambda: FakeSSHClient(cluster, clock, stats)
+
+    report = {}
+    def stage(name, func, *args, **kwargs):
+        stats.stage = name
+        start = time.monotonic()
+        result = func(*args, **kwargs)
+        wall = time.monotonic() - start
+        counters = stats.get(name)
+        report[name] = {
+            "wall_s": round(wall, 3),
+            "simulated_s": round(wall / clock.scale, 1),
+            "aws_calls": sum(n for kind, n in counters.items() if kind.startswith("aws:")),
+            "ssh_handshakes": counters["ssh:handshake"],
+            "ssh_execs": counters["ssh:exec"],
+        }
+        return result
+
+    def pipeline():
+        deploy = install_kubernetes.PipelinedDeploy(batch=batch, parallel=parallel)
+        data = deploy_aws.main(session, deploy_aws.default_fleet(nb_nodes), max_workers, key_pair_dir=work_dir,
+            on_instance_ready=deploy.add)
+        return deploy.finish(timeout=1800) if data else None
+
+    try:
+        if pipelined:
+            if not stage(_PIPELINE_STAGE, pipeline):
+                raise Exception(f"{_PIPELINE_STAGE} failed with {nb_nodes} node(s)")
+            return report
+        data = stage(_STAGES[0], deploy_aws.main, session, deploy_aws.default_fleet(nb_nodes), max_workers, key_pair_dir=work_dir)
+        if not data:
+            raise Exception(f"{_STAGES[0]} failed with {nb_nodes} node(s)")
+        stage(_STAGES[1], install_kubernetes.deploy, data, batch=batch, parallel=parallel, timeout=1800)
+    finally:
+        pool.close_all()
+    return report
+
+def print_report(results):
+    print(f"{'nodes':>6} {'stage':<24} {'wall (s)':>9} {'simulated (s)':>14} {'AWS calls':>10} {'SSH handshakes':>15} {'SSH execs':>10}")
+    for run in results["runs"]:
+        for name, s in run["stages"].items():
+            print(f"{run['nodes']:>6} {name:<24} {s['wall_s']:>9} {s['simulated_s']:>14} {s['aws_calls']:>10} {s['ssh_handshakes']:>15} {s['ssh_execs']:>10}")
+
+def compare(results, baseline, tolerance):
+    """
+    Compare with a previous result file.
+
+    Returns the list of regressions: metrics more than `tolerance` (ratio)
+    above the baseline, for the same number of nodes and stage.
+    """
+    baseline_runs = {run["nodes"]: run for run in baseline["runs"]}
+    regressions = []
+    for run in results["runs"]:
+        previous = baseline_runs.get(run["nodes"])
+        if previous is None:
+            continue
+        for name, s in run["stages"].items():
+            for metric in _METRICS:
+                before = previous["stages"].get(name, {}).get(metric)
+                if before is not None and s[metric] > before * (1 + tolerance):
+                    regressions.append(f"{run['nodes']} node(s) {name} {metric}: {before} -> {s[metric]}")
+    return regressions
+
+
+if __name__ == '__main__':
+    # Arg parser
+    parser = argparse.ArgumentParser(description="Offline benchmark of the provisioning pipeline, against simulated AWS and SSH hosts")
+    parser.add_argument("-n", "--nodes", type=int, nargs="+", default=[2, 10, 50, 200], help="cluster sizes to benchmark")
+    parser.add_argument("-s", "--scale", type=float, default=0.01, help="real seconds slept per simulated second")
+    parser.add_argument("-w", "--max_workers", type=int, default=4, help="parallel provisioning steps of stage 01")
+    parser.add_argument("-p", "--parallel", type=int, default=10, help="nodes installed/joined at the same time in stage 02")
+    parser.add_argument("-b", "--batch", help="run each node's installation steps as one uploaded script", action="store_true")
+    parser.add_argument("--pipeline", help="overlap stage 02 with the instance boot of stage 01", action="store_true")
+    parser.add_argument("-v", "--verbose", help="show the pipeline output", action="store_true")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("-c", "--compare", help="compare with a previous JSON result file, exit 1 on regression")
+    parser.add_argument("-t", "--tolerance", type=float, default=0.1, help="allowed increase over the baseline (ratio)")
+    args = parser.parse_args()
+
+    clock = ScaledClock(args.scale)
+    stats = Stats()
+    # Timeouts, backoff and waits of the code under test run on the simulated clock
+    aws_session.time = clock
+    common.Readiness.time = clock
+    # Simulated hosts answer on SSH as soon as their instance is running
+    common.Readiness.ssh_reachable = lambda ip, port=22, timeout=3: True
+
+    results = {"scale": args.scale, "batch": args.batch, "pipeline": args.pipeline, "parallel": args.parallel, "runs": []}
+    with tempfile.TemporaryDirectory() as work_dir:
+        common.Output.LOG_DIR = os.path.join(work_dir, "logs")
+        deploy_aws.INVENTORY_PATH = os.path.join(work_dir, "inventory.json")
+        tracer.trace_dir = os.path.join(work_dir, "traces")
+        for nb_nodes in args.nodes:
+            with contextlib.ExitStack() as stack:
+                if not args.verbose:
+                    stack.enter_context(contextlib.redirect_stdout(open(os.devnull, "w")))
+                report = run_pipeline(nb_nodes, clock, stats, work_dir, args.max_workers, args.parallel, args.batch, args.pipeline)
+            results["runs"].append({"nodes": nb_nodes, "stages": report})
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
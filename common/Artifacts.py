@@ -0,0 +1,61 @@
+import hashlib
+import os
+import posixpath
+import shlex
+
+from common.Remote import log, probe_cmd
+from common.Trace import tracer
+
+def file_sha256(path, chunk_size=1 << 20):
+    """sha256 of a local file, read by chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def remote_sha256(client, paths):
+    """
+    sha256 of files on the host.
+
+    Returns a dict {path: sha256}, without the missing files
+    """
+    _, output = probe_cmd(client, "sha256sum " + " ".join(shlex.quote(p) for p in paths) + " 2>/dev/null")
+    hashes = {}
+    for line in output.splitlines():
+        digest, _, path = line.partition("  ")
+        if path:
+            hashes[path] = digest
+    return hashes
+
+def upload_artifacts(client, ip, files, remote_dir):
+    """
+    Upload local files into `remote_dir` on the host over SFTP.
+
+    Content-addressed: a file whose remote sha256 already matches isn't sent
+    again, and every uploaded file is checked against its local sha256. Files
+    are written under a temporary name and renamed, so an interrupted upload
+    never leaves a truncated artifact behind.
+
+    Returns a dict {remote path: sha256}
+    """
+    artifacts = {posixpath.join(remote_dir, os.path.basename(f)): (f, file_sha256(f)) for f in files}
+    with tracer.span("upload artifacts", host=ip, category="ssh", files=len(artifacts)) as span:
+        remote = remote_sha256(client, list(artifacts))
+        stale = [path for path, (_, digest) in artifacts.items() if remote.get(path) != digest]
+        if stale:
+            probe_cmd(client, f"mkdir -p {shlex.quote(remote_dir)}")
+            sftp = client.open_sftp()
+            try:
+                for path in stale:
+                    sftp.put(artifacts[path][0], path + ".part")
+                    sftp.posix_rename(path + ".part", path)
+            finally:
+                sftp.close()
+            remote = remote_sha256(client, stale)
+            for path in stale:
+                if remote.get(path) != artifacts[path][1]:
+                    raise Exception(f"Checksum mismatch after upload : {path}")
+        span["uploaded"] = len(stale)
+        log(ip, f"Artifacts : {len(stale)} uploaded, {len(artifacts) - len(stale)} unchanged in {remote_dir}")
+    return {path: digest for path, (_, digest) in artifacts.items()}
@@ -0,0 +1,64 @@
+from common.Remote import Step
+
+# Ports of the cache services
+APT_CACHE_PORT = 3142
+REGISTRY_MIRROR_PORT = 5000
+
+def cache_server_steps(allowed_cidr):
+    """
+    Steps turning a node into the package and image cache of the cluster:
+    apt-cacher-ng (apt proxy) and a pull-through registry mirror of docker.io.
+    Both come from the Ubuntu archive, so the cache host doesn't need Docker.
+    Only `allowed_cidr` (the VPC) may reach them, on the private IP of the host.
+    """
+    ports = f"{APT_CACHE_PORT},{REGISTRY_MIRROR_PORT}"
+    firewall = f"INPUT -p tcp -m multiport --dports {ports} ! -i lo ! -s {allowed_cidr} -j DROP"
+    return [
+        Step("sudo apt-get update && sudo DEBIAN_FRONTEND=noninteractive apt-get install -y apt-cacher-ng docker-registry"),
+        # HTTPS repositories are fetched by the cache, clients talk plain HTTP to it (no CONNECT tunnel)
+        Step("""
+cat <<EOF | sudo tee /etc/apt-cacher-ng/zz_projet_cloud.conf
+Remap-dockerce: http://download.docker.com ; https://download.docker.com
+Remap-kubernetes: http://apt.kubernetes.io ; https://apt.kubernetes.io
+EOF"""),
+        Step("sudo systemctl restart apt-cacher-ng"),
+        Step(f"""
+cat <<EOF | sudo tee /etc/docker/registry/config.yml
+version: 0.1
+storage:
+  filesystem:
+    rootdirectory: /var/lib/docker-registry
+http:
+  addr: :{REGISTRY_MIRROR_PORT}
+proxy:
+  remoteurl: https://registry-1.docker.io
+EOF"""),
+        Step("sudo systemctl restart docker-registry"),
+        # The security group is open: drop the clients from outside the VPC
+        Step(f"sudo iptables -C {firewall} 2>/dev/null || sudo iptables -I {firewall}"),
+    ]
+
+def apt_proxy_steps(cache_ip):
+    """Steps pointing apt at the cache, to run before any apt-get"""
+    return [
+        Step(f"echo 'Acquire::http::Proxy \"http://{cache_ip}:{APT_CACHE_PORT}\";' | sudo tee /etc/apt/apt.conf.d/01proxy"),
+    ]
+
+def registry_mirror_steps(cache_ip):
+    """Steps pointing containerd at the registry mirror, to run once containerd is installed"""
+    return [
+        Step(f"""
+sudo mkdir -p /etc/containerd/certs.d/docker.io && cat <<EOF | sudo tee /etc/containerd/certs.d/docker.io/hosts.toml
+server = "https://registry-1.docker.io"
+
+[host."http://{cache_ip}:{REGISTRY_MIRROR_PORT}"]
+  capabilities = ["pull", "resolve"]
+EOF"""),
+        Step("""
+cat <<EOF | sudo tee /etc/containerd/config.toml
+version = 2
+[plugins."io.containerd.grpc.v1.cri".registry]
+  config_path = "/etc/containerd/certs.d"
+EOF"""),
+        Step("sudo systemctl restart containerd"),
+    ]
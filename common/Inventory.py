@@ -0,0 +1,23 @@
+def master_instance(data):
+    """
+    Master node of the inventory (01-deploy-aws-infra/inventory.json): the
+    instance with Role "master", or the first one for inventories written
+    before roles were recorded.
+    """
+    instances = data["Instances"]
+    for instance in instances:
+        if instance.get("Role") == "master":
+            return instance
+    return instances[0]
+
+def worker_instances(data):
+    """Every node of the inventory but the master and a dedicated cache host (Role "cache")"""
+    master = master_instance(data)
+    return [i for i in data["Instances"] if i is not master and i.get("Role") != "cache"]
+
+def vpc_cidr(data):
+    """
+    Address range of the VPC of the cluster, "192.168.0.0/24" for inventories
+    written before it was recorded
+    """
+    return data.get("VpcCidr", "192.168.0.0/24")
@@ -0,0 +1,75 @@
+import hashlib
+import json
+
+from common.Remote import Step
+from common.CacheSteps import apt_proxy_steps, registry_mirror_steps
+
+# Tag holding steps_hash(INSTALL_KUBERNETES_STEPS) on the baked images
+IMAGE_TAG_KEY = "ProjetCloud-StepsHash"
+
+def install_kubernetes_steps(cache_ip=None):
+    """
+    Steps of the Kubernetes installation, in order.
+
+    With `cache_ip`, apt and containerd go through the package and image cache
+    of that host (see common/CacheSteps.py).
+    """
+    # Through the cache, HTTPS repositories are requested in plain HTTP (the cache fetches them in HTTPS)
+    docker_install = "wget -qO- https://get.docker.com/ | sh"
+    kubernetes_repository = "https://apt.kubernetes.io/"
+    if cache_ip is not None:
+        docker_install = "wget -qO- https://get.docker.com/ | DOWNLOAD_URL=http://download.docker.com sh"
+        kubernetes_repository = "http://apt.kubernetes.io/"
+
+    steps = apt_proxy_steps(cache_ip) if cache_ip is not None else []
+    steps += [
+        # Install Docker
+        Step("sudo swapoff -a", fatal=False),
+        Step(docker_install),
+        # Install Kubernetes
+        Step("sudo modprobe br_netfilter"),
+        Step("""
+cat <<EOF | sudo tee /etc/sysctl.d/k8s.conf
+net.bridge.bridge-nf-call-ip6tables = 1
+net.bridge.bridge-nf-call-iptables = 1
+EOF"""),
+        Step("sudo sysctl --system"),
+        Step("curl -s https://packages.cloud.google.com/apt/doc/apt-key.gpg | sudo apt-key add -"),
+        Step(f"""
+cat <<EOF | sudo tee /etc/apt/sources.list.d/kubernetes.list
+deb {kubernetes_repository} kubernetes-xenial main
+EOF"""),
+        Step("sudo apt-get update && sudo apt-get install -y kubelet kubeadm kubectl"),
+        Step("sudo sed -i 's|Environment=\"KUBELET_CONFIG_ARGS=--config=/var/lib/kubelet/config.yaml\"|Environment=\"KUBELET_CONFIG_ARGS=--config=/var/lib/kubelet/config.yaml --cgroup-driver=cgroupfs\"|' /etc/systemd/system/kubelet.service.d/10-kubeadm.conf"),
+        Step("sudo systemctl daemon-reload"),
+        Step("sudo rm /etc/containerd/config.toml && sudo systemctl restart containerd"),
+    ]
+    if cache_ip is not None:
+        steps += registry_mirror_steps(cache_ip)
+    return steps
+
+INSTALL_KUBERNETES_STEPS = install_kubernetes_steps()
+
+# Steps whose effect doesn't survive a reboot: still needed on a node booted
+# from an image baked with INSTALL_KUBERNETES_STEPS
+BOOT_KUBERNETES_STEPS = [
+    Step("sudo swapoff -a", fatal=False),
+    Step("sudo modprobe br_netfilter"),
+    Step("sudo sysctl --system"),
+]
+
+def steps_hash(steps) -> str:
+    """Short hash identifying a step list, used to tag the baked images"""
+    steps = [Step(s) if isinstance(s, str) else s for s in steps]
+    content = json.dumps([[step.cmd, step.fatal] for step in steps])
+    return hashlib.sha256(content.encode()).hexdigest()[:16]
+
+def node_install_steps(instance, cache_ip=None):
+    """
+    Installation steps of an inventory node: BOOT_KUBERNETES_STEPS only if it
+    was booted from an image baked with the current steps (see
+    01-deploy-aws-infra/bake_image.py), the whole installation otherwise.
+    """
+    if instance.get("StepsHash") == steps_hash(INSTALL_KUBERNETES_STEPS):
+        return BOOT_KUBERNETES_STEPS + (registry_mirror_steps(cache_ip) if cache_ip is not None else [])
+    return install_kubernetes_steps(cache_ip)
@@ -0,0 +1,114 @@
+import codecs
+import os
+import select
+import threading
+from collections import deque
+
+from termcolor import colored
+
+# Full output of every remote command, one file per host
+LOG_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "logs"))
+
+# Serialize writes to stdout so that lines of different hosts don't mix
+_PRINT_LOCK = threading.Lock()
+
+def print_block(lines):
+    """Print several lines at once, without lines of other hosts in between"""
+    with _PRINT_LOCK:
+        print("\n".join(lines))
+
+class HostOutput:
+    """
+    Output of the commands run on one host.
+
+    Every line is appended to `LOG_DIR/<ip>.log`, echoed with a `[ip]` prefix
+    according to the verbosity (1: stdout, 2: stdout + stderr), and only the
+    last `tail_size` lines are kept in memory for error reports.
+    """
+    def __init__(self, ip, verbose=0, tail_size=50):
+        self.ip = ip
+        self.verbose = verbose or 0
+        self.tail = deque(maxlen=tail_size)
+        os.makedirs(LOG_DIR, exist_ok=True)
+        self._file = open(os.path.join(LOG_DIR, f"{ip}.log"), "a")
+
+    def command(self, cmd):
+        """Start the output of a new command"""
+        self.tail.clear()
+        self._file.write(f"$ {cmd}\n")
+        if self.verbose:
+            self.echo(cmd)
+
+    def line(self, text, stderr=False):
+        self._file.write(text + "\n")
+        self.tail.append(text)
+        if self.verbose >= 2 and stderr:
+            self.echo(colored(text, 'red'))
+        elif self.verbose and not stderr:
+            self.echo(colored(text, 'green'))
+
+    def echo(self, text):
+        print_block([f"[{self.ip}] {line}" for line in text.splitlines() or [""]])
+
+    def print_tail(self):
+        """Echo the kept tail, whatever the verbosity (error report)"""
+        if not self.verbose:
+            self.echo(colored("\n".join(self.tail), 'red'))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class _LineSplitter:
+    """Decode a byte stream chunk by chunk and call `on_line` for each full line"""
+    def __init__(self, on_line):
+        self.on_line = on_line
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.buffer = ""
+
+    def feed(self, data):
+        self.buffer += self.decoder.decode(data)
+        *lines, self.buffer = self.buffer.split("\n")
+        for line in lines:
+            self.on_line(line.rstrip("\r"))
+
+    def flush(self):
+        self.buffer += self.decoder.decode(b"", final=True)
+        if self.buffer:
+            self.on_line(self.buffer.rstrip("\r"))
+            self.buffer = ""
+
+def pump(channel, on_stdout, on_stderr, chunk_size=32768):
+    """
+    Read stdout and stderr of a channel as data arrives, until the command
+    ends, and call `on_stdout(line)` / `on_stderr(line)` for every line.
+    Both streams are drained together, so a full stderr never blocks the
+    remote command.
+
+    Returns:
+        int: Exit status of the command
+    """
+    stdout = _LineSplitter(on_stdout)
+    stderr = _LineSplitter(on_stderr)
+    while True:
+        received = False
+        if channel.recv_ready():
+            stdout.feed(channel.recv(chunk_size))
+            received = True
+        if channel.recv_stderr_ready():
+            stderr.feed(channel.recv_stderr(chunk_size))
+            received = True
+        if received:
+            continue
+        if channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+            break
+        # Wakes up on stdout data, stderr is polled at the timeout
+        select.select([channel], [], [], 0.1)
+    stdout.flush()
+    stderr.flush()
+    return channel.recv_exit_status()
@@ -0,0 +1,96 @@
+import socket
+import time
+
+from common.Remote import log, probe_cmd
+from common.Trace import tracer
+
+def wait_for(name, condition, timeout=300, delay=1, max_delay=15, host="gate"):
+    """
+    Readiness gate: poll `condition()` with an exponential backoff until it
+    returns True, then move on immediately.
+
+    Args:
+        name (str): What is waited for, used in the report
+        condition (callable): Returns True once ready. An exception counts as not ready
+        timeout (float): Maximum wait, in seconds
+        delay (float): First delay between two polls
+        max_delay (float): Maximum delay between two polls
+        host (str): Prefix of the report line
+
+    Returns:
+        float: Seconds waited
+
+    Raises:
+        TimeoutError: The condition still doesn't hold after `timeout` seconds
+    """
+    start = time.monotonic()
+    deadline = start + timeout
+    with tracer.span(name, host=host, category="gate", timeout=timeout) as span:
+        while True:
+            try:
+                ready = condition()
+            except Exception:
+                ready = False
+            waited = time.monotonic() - start
+            if ready:
+                log(host, f"{name} : ready after {waited:.1f}s")
+                span["exit_status"] = 0
+                return waited
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(f"{name} : not ready after {timeout}s")
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+def ssh_reachable(ip, port=22, timeout=3):
+    """True if an SSH server answers on this host (banner received)"""
+    try:
+        with socket.create_connection((ip, port), timeout=timeout) as sock:
+            sock.settimeout(timeout)
+            return sock.recv(4).startswith(b"SSH-")
+    except OSError:
+        return False
+
+def all_ssh_reachable(ips, port=22):
+    """Condition: every host answers on SSH (hosts already reachable aren't polled again)"""
+    pending = set(ips)
+
+    def condition():
+        for ip in list(pending):
+            if ssh_reachable(ip, port):
+                pending.discard(ip)
+        return not pending
+    return condition
+
+def ready_nodes(client):
+    """Names of the Kubernetes nodes which are Ready (none if kubectl fails)"""
+    exit_status, output = probe_cmd(client, "kubectl get nodes --no-headers")
+    if exit_status != 0:
+        return []
+    return [line.split()[0] for line in output.splitlines() if line.split()[1:2] == ["Ready"]]
+
+def nodes_ready(client, count):
+    """Condition: at least `count` Kubernetes nodes are Ready"""
+    def condition():
+        return len(ready_nodes(client)) >= count
+    return condition
+
+def pods_running(client, selector, namespace="default"):
+    """Condition: all the pods matching the label selector are Running with all their containers ready"""
+    def condition():
+        exit_status, output = probe_cmd(client, f"kubectl get pods --namespace {namespace} -l {selector} --no-headers")
+        pods = [line.split() for line in output.splitlines() if line.strip()]
+        if exit_status != 0 or not pods:
+            return False
+        for pod in pods:
+            ready, total = pod[1].split("/")
+            if pod[2] != "Running" or ready != total:
+                return False
+        return True
+    return condition
+
+def pvc_bound(client, name, namespace="default"):
+    """Condition: the PersistentVolumeClaim is Bound"""
+    def condition():
+        exit_status, output = probe_cmd(client, f"kubectl get pvc {name} --namespace {namespace} -o jsonpath='{{.status.phase}}'")
+        return exit_status == 0 and output.strip() == "Bound"
+    return condition
@@ -0,0 +1,215 @@
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from termcolor import colored
+
+from common.Output import HostOutput, print_block, pump
+from common.Trace import tracer, span_name
+
+# A remote step : the shell command, and whether its failure stops the host
+Step = namedtuple("Step", ["cmd", "fatal"], defaults=[True])
+
+def banner(ip, title):
+    line = "#" * (len(ip) + len(title) + 15)
+    print_block([line, f"### {ip} : {title} \t###", line])
+
+def log(ip, message):
+    print_block([f"[{ip}] {line}" for line in str(message).splitlines()])
+
+def run_cmd(client, ip, cmd, verbose=False, fatal=True):
+    """
+    Run one command on a host, streaming its output (see common/Output.py).
+    Raise on a non-zero exit status if `fatal`.
+    """
+    with tracer.span(span_name(cmd), host=ip, category="ssh", cmd=cmd) as span, HostOutput(ip, verbose) as output:
+        stdin, stdout, stderr = client.exec_command(cmd)
+        output.command(cmd)
+        exit_status = pump(stdout.channel, output.line, lambda line: output.line(line, stderr=True))
+        span["exit_status"] = exit_status
+        if exit_status == 0:
+            if not verbose:
+                log(ip, cmd)
+            return
+        output.print_tail()
+    if fatal:
+        raise Exception(f"[{exit_status}] Error : {cmd}")
+    log(ip, f"Error : {cmd} {exit_status}")
+
+def read_cmd(client, ip, cmd):
+    """
+    Run a command with a short output and return its stdout.
+    Raise on a non-zero exit status.
+    """
+    lines = []
+    with tracer.span(span_name(cmd), host=ip, category="ssh", cmd=cmd) as span, HostOutput(ip) as output:
+        stdin, stdout, stderr = client.exec_command(cmd)
+        output.command(cmd)
+
+        def on_stdout(line):
+            lines.append(line)
+            output.line(line)
+
+        exit_status = pump(stdout.channel, on_stdout, lambda line: output.line(line, stderr=True))
+        span["exit_status"] = exit_status
+        if exit_status != 0:
+            output.print_tail()
+            raise Exception(f"[{exit_status}] Error : {cmd}")
+    return "\n".join(lines)
+
+def probe_cmd(client, cmd):
+    """
+    Run a short, silent command (no echo, no log file), e.g. a readiness check.
+
+    Returns a tuple (exit_status, stdout)
+    """
+    lines = []
+    stdin, stdout, stderr = client.exec_command(cmd)
+    exit_status = pump(stdout.channel, lines.append, lambda line: None)
+    return exit_status, "\n".join(lines)
+
+def run_steps(client, ip, steps, verbose=False, batch=False):
+    """
+    Run an ordered list of steps (str or Step) on a host.
+
+    Without `batch`, every step is its own `exec_command()`. With `batch`, the
+    whole list is uploaded as one script and run in a single round trip, see
+    `run_batch()`.
+    """
+    steps = [Step(s) if isinstance(s, str) else s for s in steps]
+    if batch:
+        return run_batch(client, ip, steps, verbose)
+    for step in steps:
+        run_cmd(client, ip, step.cmd, verbose, step.fatal)
+
+def build_batch_script(steps, marker):
+    """
+    Build the bash script running `steps` in order.
+
+    Each step runs in its own subshell (like a separate `exec_command()`) and
+    is surrounded by `<marker> <index> START` and
+    `<marker> <index> END <exit_status> <duration_ms>` lines on stdout.
+    The script stops at the first failing fatal step.
+    """
+    lines = ["exec 2>&1", "_now() { echo $(( $(date +%s%N) / 1000000 )); }"]
+    for index, step in enumerate(steps):
+        # The command is pasted verbatim, so heredocs keep working
+        lines += [f"_step_{index}() (", step.cmd, ")"]
+    for index, step in enumerate(steps):
+        lines += [
+            f"echo '{marker} {index} START'",
+            "_start=$(_now)",
+            f"_step_{index} < /dev/null",
+            "_rc=$?",
+            f"echo \"{marker} {index} END $_rc $(( $(_now) - _start ))\"",
+        ]
+        if step.fatal:
+            lines.append("[ $_rc -eq 0 ] || exit $_rc")
+    lines.append("exit 0")
+    return "\n".join(lines) + "\n"
+
+def run_batch(client, ip, steps, verbose=False):
+    """
+    Upload the steps as one script and run it on the host, in one round trip.
+
+    Step markers are parsed while the output streams back, so every step is
+    reported as soon as it ends.
+
+    Returns a list of dict {"cmd", "exit_status", "duration_ms"}, one per step
+    that ran. Raises on the first failing fatal step, like `run_cmd()`.
+    """
+    marker = f"@@STEP-{uuid.uuid4().hex}"
+    script = build_batch_script(steps, marker)
+    # The script is written to a temporary file first: a step reading its
+    # stdin must not consume the rest of the script
+    stdin, stdout, stderr = client.exec_command(
+        'f=$(mktemp) && cat > "$f" && bash "$f"; rc=$?; rm -f "$f"; exit $rc'
+    )
+    stdin.write(script)
+    stdin.channel.shutdown_write()
+
+    results = []
+    state = {"current": None, "failed": None}
+    output = HostOutput(ip, verbose)
+
+    def on_marker(line):
+        fields = line.split()
+        index = int(fields[1])
+        step = steps[index]
+        if fields[2] == "START":
+            state["current"] = index
+            output.command(step.cmd)
+            return
+        # END
+        exit_status, duration_ms = int(fields[3]), int(fields[4])
+        results.append({"cmd": step.cmd, "exit_status": exit_status, "duration_ms": duration_ms})
+        # Timed on the host: the span ends now and lasted duration_ms
+        end = time.time()
+        tracer.record(span_name(step.cmd), end - duration_ms / 1000, end, ip, "ssh", cmd=step.cmd, exit_status=exit_status, batch=True)
+        state["current"] = None
+        if exit_status == 0:
+            log(ip, f"{step.cmd} ({duration_ms} ms)")
+            return
+        output.print_tail()
+        if step.fatal:
+            state["failed"] = (exit_status, step)
+        else:
+            log(ip, f"Error : {step.cmd} {exit_status}")
+
+    def on_stdout(line):
+        position = line.find(marker)
+        if position < 0:
+            output.line(line)
+            return
+        if position > 0:
+            # Last output line of the step had no trailing newline
+            output.line(line[:position])
+        on_marker(line[position:])
+
+    with tracer.span("batch", host=ip, category="batch", steps=len(steps)) as span, output:
+        exit_status = pump(stdout.channel, on_stdout, lambda line: output.line(line, stderr=True))
+        span["exit_status"] = exit_status
+
+    if state["failed"] is not None:
+        exit_status, step = state["failed"]
+        raise Exception(f"[{exit_status}] Error : {step.cmd}")
+    if state["current"] is not None:
+        # The script died in the middle of a step (connection lost, killed...)
+        raise Exception(f"[{exit_status}] Error : {steps[state['current']].cmd}")
+    if exit_status != 0:
+        raise Exception(f"[{exit_status}] Error : batch script")
+    return results
+
+def run_on_hosts(func, ips, parallel, *args):
+    """
+    Run `func(ip, *args)` on every host, at most `parallel` hosts at a time.
+    A failing host doesn't stop the others.
+
+    Returns a tuple ({ip: result}, {ip: exception})
+    """
+    results = {}
+    failures = {}
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = {executor.submit(traced, func, ip, *args): ip for ip in ips}
+        for future in as_completed(futures):
+            ip = futures[future]
+            try:
+                results[ip] = future.result()
+            except Exception as e:
+                failures[ip] = e
+                log(ip, colored(f"FAILED : {e}", 'red'))
+    return results, failures
+
+def traced(func, ip, *args):
+    with tracer.span(func.__name__, host=ip, category="task"):
+        return func(ip, *args)
+
+def print_summary(stage, ips, failures):
+    lines = [f"=== {stage} : {len(ips) - len(failures)}/{len(ips)} node(s) OK ==="]
+    for ip in ips:
+        if ip in failures:
+            lines.append(colored(f"  {ip}\tFAILED\t{failures[ip]}", 'red'))
+        else:
+            lines.append(colored(f"  {ip}\tOK", 'green'))
+    print_block(lines)
@@ -0,0 +1,92 @@
+import threading
+
+import paramiko
+
+class SSHPool:
+    """
+    Pool of SSH connections shared by the deployment stages.
+
+    Connections are keyed by (ip, port, user, ssh_key): the TCP and key
+    handshake is done once per host, every command then opens a new channel
+    over the existing transport. A connection whose transport died is
+    recycled on the next `get()`.
+    """
+    def __init__(self, keepalive: int = 30, timeout: int = 30, client_factory=paramiko.SSHClient) -> None:
+        """
+        Args:
+            keepalive (int): Interval (s) of the SSH keepalive packets
+            timeout (int): TCP connection timeout (s)
+            client_factory (callable): Builds the (not yet connected) clients, paramiko.SSHClient
+                or a double with the same interface (benchmarks)
+        """
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.client_factory = client_factory
+        self._clients = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, ip: str, port: int, user: str, ssh_key: str) -> paramiko.SSHClient:
+        """
+        Return a connected client for this host, reusing the pooled one if alive
+
+        Returns:
+            paramiko.SSHClient
+        """
+        key = (ip, port, user, ssh_key)
+        # One lock per host: two threads never handshake the same host twice
+        with self._lock:
+            host_lock = self._locks.setdefault(key, threading.Lock())
+        with host_lock:
+            client = self._clients.get(key)
+            if client is not None:
+                if self._is_alive(client):
+                    return client
+                # Stale connection
+                client.close()
+            client = self._connect(ip, port, user, ssh_key)
+            self._clients[key] = client
+            return client
+
+    def discard(self, ip: str, port: int, user: str, ssh_key: str) -> None:
+        """Close and forget the connection to this host (e.g. after a reboot)"""
+        key = (ip, port, user, ssh_key)
+        with self._lock:
+            client = self._clients.pop(key, None)
+        if client is not None:
+            client.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            client.close()
+
+    def _connect(self, ip, port, user, ssh_key) -> paramiko.SSHClient:
+        client = self.client_factory()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        client.connect(ip, port, user, key_filename=ssh_key, timeout=self.timeout)
+        client.get_transport().set_keepalive(self.keepalive)
+        return client
+
+    @staticmethod
+    def _is_alive(client: paramiko.SSHClient) -> bool:
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        try:
+            # Fails if the socket is half-closed
+            transport.send_ignore()
+        except (paramiko.SSHException, EOFError, OSError):
+            return False
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close_all()
+
+# Shared pool, used by all the stages of a run
+pool = SSHPool()
@@ -0,0 +1,157 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Spans of all the stages of a run, one JSON object per line
+TRACE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "traces"))
+
+class Tracer:
+    """
+    Records timed spans (AWS calls, remote commands, readiness gates...) of
+    the deployment stages.
+
+    Every span is appended as one JSON line to `TRACE_DIR/trace.jsonl`, so the
+    three stages (separate processes) build one trace. `finish()` converts it
+    to the Chrome trace format (`trace.json`, for chrome://tracing or
+    Perfetto) and prints a summary of the critical path.
+    """
+    def __init__(self, trace_dir=TRACE_DIR, stage="pipeline"):
+        self.trace_dir = trace_dir
+        self.stage = stage
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return os.path.join(self.trace_dir, "trace.jsonl")
+
+    def reset(self):
+        """Start a new trace (first stage of a run)"""
+        os.makedirs(self.trace_dir, exist_ok=True)
+        with self._lock:
+            open(self.path, "w").close()
+
+    def record(self, name, start, end, host="orchestrator", category="step", **args):
+        """Record a span, `start` and `end` being `time.time()` values"""
+        span = {
+            "stage": self.stage,
+            "host": host,
+            "category": category,
+            "name": name,
+            "start": start,
+            "end": end,
+            "args": args,
+        }
+        os.makedirs(self.trace_dir, exist_ok=True)
+        with self._lock, open(self.path, "a") as file:
+            file.write(json.dumps(span, default=str) + "\n")
+
+    @contextmanager
+    def span(self, name, host="orchestrator", category="step", **args):
+        """
+        Record the enclosed block as a span. The yielded dict holds the span
+        arguments, e.g. `span["exit_status"] = 0`. An exception sets
+        `exit_status` to "error".
+        """
+        start = time.time()
+        try:
+            yield args
+        except BaseException as e:
+            args.setdefault("exit_status", "error")
+            args.setdefault("error", str(e))
+            raise
+        finally:
+            self.record(name, start, time.time(), host, category, **args)
+
+    ###
+    # botocore hooks: one span per AWS API call
+    ###
+    def before_aws_call(self, context=None, **kwargs):
+        if context is not None:
+            context["trace_start"] = time.time()
+
+    def after_aws_call(self, event_name, context=None, http_response=None, **kwargs):
+        start = (context or {}).get("trace_start", time.time())
+        # event_name : after-call.<service>.<Operation>
+        name = ".".join(event_name.split(".")[1:])
+        status = getattr(http_response, "status_code", None)
+        if status is None and kwargs.get("exception") is not None:
+            status = "error"
+        self.record(name, start, time.time(), "aws", "aws", exit_status=status)
+
+    def instrument_boto3_session(self, session):
+        """Record every API call of the clients and resources of a boto3 session"""
+        session.events.register("before-call", self.before_aws_call)
+        session.events.register("after-call", self.after_aws_call)
+        session.events.register("after-call-error", self.after_aws_call)
+
+    ###
+    # Export
+    ###
+    def load(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+    def export_chrome(self, spans, path):
+        """Write the spans in the Chrome trace event format (one process per stage, one thread per host)"""
+        pids, tids, events = {}, {}, []
+        for span in spans:
+            pid = pids.setdefault(span["stage"], len(pids) + 1)
+            tid = tids.setdefault((span["stage"], span["host"]), len(tids) + 1)
+            events.append({
+                "name": span["name"],
+                "cat": span["category"],
+                "ph": "X",
+                "ts": span["start"] * 1e6,
+                "dur": (span["end"] - span["start"]) * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": dict(span["args"], host=span["host"]),
+            })
+        for stage, pid in pids.items():
+            events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": stage}})
+        for (stage, host), tid in tids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pids[stage], "tid": tid, "args": {"name": host}})
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+    @staticmethod
+    def summary(spans, top=5):
+        """
+        Critical path summary: for each stage, its wall time, the host that
+        finished last (the one the next stage waited for) and its longest spans
+        """
+        lines = []
+        stages = {}
+        for span in spans:
+            stages.setdefault(span["stage"], []).append(span)
+        for stage, stage_spans in sorted(stages.items(), key=lambda s: min(span["start"] for span in s[1])):
+            start = min(span["start"] for span in stage_spans)
+            end = max(span["end"] for span in stage_spans)
+            inner_spans = [span for span in stage_spans if span["category"] != "stage"] or stage_spans
+            last = max(inner_spans, key=lambda span: span["end"])
+            lines.append(f"{stage} : {end - start:.1f}s, last host {last['host']}")
+            host_spans = [span for span in stage_spans if span["host"] == last["host"] and span["category"] != "stage"]
+            for span in sorted(host_spans, key=lambda span: span["start"] - span["end"])[:top]:
+                lines.append(f"    {span['end'] - span['start']:8.1f}s  [{span['category']}] {span['name']}")
+        return lines
+
+    def finish(self):
+        """Export the trace of the run so far and print its summary"""
+        spans = self.load()
+        if not spans:
+            return
+        chrome_path = os.path.join(self.trace_dir, "trace.json")
+        self.export_chrome(spans, chrome_path)
+        print("\n".join([f"=== Trace : {chrome_path} ==="] + self.summary(spans)))
+
+def span_name(cmd, size=60):
+    """Short one-line name of a shell command"""
+    name = " ".join(cmd.split())
+    return name if len(name) <= size else name[:size - 3] + "..."
+
+# Shared tracer, the stage scripts set `tracer.stage`
+tracer = Tracer()